@@ -0,0 +1,1133 @@
+# Нагрузочные замеры сервиса бронирований.
+# Запуск: python benchmark.py <сценарий> [параметры], результат - JSON в stdout
+# (и в --output). Два таких файла сравнивает python benchmark.py compare.
+import argparse
+import asyncio
+import atexit
+import csv
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import bcrypt
+import httpx
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPBasicCredentials
+
+try:
+    # Необязателен: нужен только для CPU сервера там, где нет /proc (Windows, macOS)
+    import psutil
+except ImportError:
+    psutil = None
+
+# main.py берёт DB_PATH из окружения при импорте - каждый прогон идёт в чистую базу
+WORKDIR = tempfile.mkdtemp(prefix="bookings-bench-")
+atexit.register(shutil.rmtree, WORKDIR, ignore_errors=True)
+os.environ["DB_PATH"] = os.path.join(WORKDIR, "bookings.db")
+# Замеряется пропускная способность, а не отказы по вместимости
+os.environ.setdefault("ATTRACTION_CAPACITY", "1000000")
+# Общий ключ, чтобы токены из этого процесса принимал и запущенный сервер
+os.environ.setdefault("SESSION_SECRET", "benchmark-secret")
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+ATTRACTIONS = ["Скалодром", "Зиплайн", "Веревочный парк", "Батутный парк"]
+# Операции сценария load и их веса по умолчанию
+LOAD_OPERATIONS = ("book", "burst", "list", "next_page", "filter", "update", "delete", "availability", "stats")
+LOAD_MIX = "book=20,burst=5,list=25,next_page=10,filter=10,update=10,delete=5,availability=10,stats=5"
+# Для сценария search: ФИО, похожие на настоящие, а не "Клиент N"
+SURNAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев",
+            "Козлов", "Новиков", "Морозов", "Волков", "Алексеев", "Фёдоров", "Семёнов", "Егоров"]
+FIRST_NAMES = ["Александр", "Алексей", "Андрей", "Дмитрий", "Иван", "Михаил", "Пётр", "Сергей",
+               "Анна", "Елена", "Мария", "Ольга", "Наталья", "Татьяна", "Юлия", "Ксения"]
+
+
+def fake_booking(rng):
+    return {
+        "name": f"Клиент {rng.randrange(100000)}",
+        "phone": f"79{rng.randrange(10 ** 9):09d}",
+        "age": rng.randrange(14, 80),
+        "date": (date(2025, 1, 1) + timedelta(days=rng.randrange(365))).isoformat(),
+        "attractions": rng.sample(ATTRACTIONS, rng.randrange(1, len(ATTRACTIONS) + 1))
+    }
+
+
+def named_booking(rng):
+    # 16 фамилий на всю таблицу: каждое слово совпадает с тысячами броней,
+    # то есть ранжировать приходится больше, чем на настоящих данных
+    first = rng.choice(FIRST_NAMES)
+    surname = rng.choice(SURNAMES) + ('а' if first[-1] == 'а' else '')
+    return {**fake_booking(rng), "name": f"{surname} {first}"}
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+def admin_headers():
+    return {"Authorization": f"Bearer {main.issue_token('admin')}"}
+
+
+def temp_db(name):
+    path = os.path.join(WORKDIR, name)
+    main.init_db(path)
+    return path
+
+
+def seed(path, rows, rng, make=fake_booking):
+    conn = sqlite3.connect(path)
+    try:
+        for start in range(0, rows, main.BATCH_CHUNK_SIZE):
+            count = min(main.BATCH_CHUNK_SIZE, rows - start)
+            main.insert_chunk(conn, [(start + i, main.Booking(**make(rng))) for i in range(count)])
+    finally:
+        conn.close()
+
+
+def run_workers(threads, ops, op):
+    # op(rng) -> 'read' | 'write'; возвращает задержки по видам операций
+    latencies = {"read": [], "write": []}
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(index)
+        local = {"read": [], "write": []}
+        for _ in range(ops // threads):
+            started = time.perf_counter()
+            kind = op(rng)
+            local[kind].append(time.perf_counter() - started)
+        with lock:
+            for kind, values in local.items():
+                latencies[kind].extend(values)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "ops_per_s": round(sum(map(len, latencies.values())) / elapsed, 1),
+        "read": percentiles(latencies["read"]),
+        "write": percentiles(latencies["write"]),
+    }
+
+
+def booking_ops(acquire, write_ratio):
+    # Вызывает сами обработчики main.py, меняется только источник соединения
+    def op(rng):
+        with acquire() as conn:
+            if rng.random() < write_ratio:
+                main.create_booking(main.Booking(**fake_booking(rng)), conn=conn)
+                return "write"
+            main.get_bookings(filters=([], []), sort="id", order="desc",
+                              limit=main.PAGE_LIMIT_DEFAULT, cursor=None, conn=conn)
+            return "read"
+    return op
+
+
+def bench_pool(args):
+    class PerRequest:
+        # Поведение до пула: новое соединение и rollback-журнал на каждый запрос
+        def __init__(self, path):
+            self.path = path
+
+        def __enter__(self):
+            self.conn = sqlite3.connect(self.path)
+            self.conn.row_factory = sqlite3.Row
+            return self.conn
+
+        def __exit__(self, *exc):
+            self.conn.close()
+
+    results = {}
+    before = temp_db("before.db")
+    with sqlite3.connect(before) as conn:
+        conn.execute('PRAGMA journal_mode=DELETE')
+    conn.close()
+    seed(before, args.rows, random.Random(args.seed))
+    results["per_request_connect"] = run_workers(
+        args.threads, args.ops, booking_ops(lambda: PerRequest(before), args.write_ratio))
+
+    after = temp_db("after.db")
+    seed(after, args.rows, random.Random(args.seed))
+    pool = main.ConnectionPool(after, args.pool_size, main.DB_POOL_TIMEOUT,
+                               main.DB_BUSY_TIMEOUT_MS, main.DB_MMAP_SIZE)
+    try:
+        results["pooled_wal"] = run_workers(
+            args.threads, args.ops, booking_ops(pool.connection, args.write_ratio))
+    finally:
+        pool.close()
+    return results
+
+
+def batch_body(rows, fmt, rng):
+    bookings = [fake_booking(rng) for _ in range(rows)]
+    if fmt == "ndjson":
+        return "\n".join(json.dumps(b, ensure_ascii=False) for b in bookings).encode(), "application/x-ndjson"
+    if fmt == "json":
+        return json.dumps(bookings, ensure_ascii=False).encode(), "application/json"
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["name", "phone", "age", "date", "attractions"])
+    for b in bookings:
+        writer.writerow([b["name"], b["phone"], b["age"], b["date"], ", ".join(b["attractions"])])
+    return out.getvalue().encode(), "text/csv"
+
+
+def bench_batch(args):
+    rng = random.Random(args.seed)
+    results = {}
+    with TestClient(main.app) as client:
+        # Для сравнения - та же загрузка по одной строке через POST /book
+        single = [fake_booking(rng) for _ in range(args.single_rows)]
+        started = time.perf_counter()
+        for booking in single:
+            client.post("/book", json=booking).raise_for_status()
+        elapsed = time.perf_counter() - started
+        results["single_post"] = {"rows": len(single), "elapsed_s": round(elapsed, 3),
+                                  "rows_per_s": round(len(single) / elapsed, 1)}
+
+        for fmt in args.formats:
+            body, content_type = batch_body(args.rows, fmt, rng)
+            started = time.perf_counter()
+            response = client.post("/bookings/batch", content=body,
+                                   headers={"content-type": content_type, **admin_headers()})
+            elapsed = time.perf_counter() - started
+            response.raise_for_status()
+            report = response.json()
+            results[f"batch_{fmt}"] = {
+                "rows": args.rows,
+                "inserted": report["inserted"],
+                "failed": report["failed"],
+                "body_bytes": len(body),
+                "elapsed_s": round(elapsed, 3),
+                "rows_per_s": round(args.rows / elapsed, 1),
+            }
+    return results
+
+
+def timed(func, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    return percentiles(latencies)
+
+
+def bench_auth(args):
+    password = "benchmark-password"
+    os.environ["ADMIN_PASSWORD_HASH"] = bcrypt.hashpw(
+        password.encode(), bcrypt.gensalt(rounds=args.bcrypt_rounds)).decode()
+    credentials = HTTPBasicCredentials(username="admin", password=password)
+
+    def cold_login():
+        main.auth_cache.clear()
+        assert main.check_admin_password(credentials)
+
+    token = main.issue_token("admin")
+    results = {
+        "bcrypt_check": timed(cold_login, args.cold),
+        "cached_check": timed(lambda: main.check_admin_password(credentials), args.repeat),
+        "token_verify": timed(lambda: main.verify_token(token), args.repeat),
+    }
+    # То же через HTTP: админский запрос с Basic без кэша и с токеном
+    with TestClient(main.app) as client:
+        def basic_request():
+            main.auth_cache.clear()
+            client.get("/bookings", params={"limit": 1}, auth=("admin", password)).raise_for_status()
+
+        headers = admin_headers()
+        results["http_basic_uncached"] = timed(basic_request, args.cold)
+        results["http_bearer"] = timed(
+            lambda: client.get("/bookings", params={"limit": 1}, headers=headers).raise_for_status(),
+            args.cold * 10)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def server(db_path, *args, **env):
+    # Настоящий uvicorn в отдельном процессе; args - дополнительные флаги uvicorn
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning", *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "DB_PATH": db_path, **env},
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/availability", timeout=1)
+                break
+            except httpx.TransportError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.2)
+        yield f"http://127.0.0.1:{port}", process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def load_test(base_url, clients, requests_per_client, write_ratio, seed_value):
+    # clients одновременных пользователей, у каждого своя очередь запросов
+    latencies = {"read": [], "write": []}
+    errors = 0
+    headers = admin_headers()
+    # Сервер на http, но httpx собирает SSL-контекст на каждый клиент - дорого
+    ssl_context = ssl.create_default_context()
+
+    async def run():
+        # У каждого пользователя свой клиент с одним keep-alive соединением:
+        # общий пул httpx на сотни соединений сам съедает больше CPU, чем сервер
+        async def user(index):
+            nonlocal errors
+            rng = random.Random(seed_value + index)
+            async with httpx.AsyncClient(base_url=base_url, timeout=120,
+                                         verify=ssl_context) as client:
+                for _ in range(requests_per_client):
+                    kind = "write" if rng.random() < write_ratio else "read"
+                    started = time.perf_counter()
+                    try:
+                        if kind == "write":
+                            response = await client.post("/book", json=fake_booking(rng))
+                        else:
+                            response = await client.get("/bookings", headers=headers,
+                                                        params={"limit": 20, "order": "desc"})
+                        ok = response.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    latencies[kind].append(time.perf_counter() - started)
+                    errors += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(clients)))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    total = sum(map(len, latencies.values()))
+    return {
+        "clients": clients,
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(total / elapsed, 1),
+        "all": percentiles(latencies["read"] + latencies["write"]),
+        "read": percentiles(latencies["read"]),
+        "write": percentiles(latencies["write"]),
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in LOAD_OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected {', '.join(LOAD_OPERATIONS)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"bad weight for {name!r}: {weight!r}")
+    return mix
+
+
+def random_day(rng):
+    return date(2025, 1, 1) + timedelta(days=rng.randrange(365))
+
+
+def mixed_load(base_url, process, args):
+    # Смешанная нагрузка: args.clients пользователей, у каждого args.requests
+    # операций, выбранных по весам args.mix из своего генератора с seed + номер
+    names, weights = list(args.mix), list(args.mix.values())
+    latencies = {name: [] for name in names}
+    statuses = {name: Counter() for name in names}
+    # id из seed идут подряд с 1, новые брони продолжают последовательность
+    live = list(range(1, args.rows + 1))
+    next_id = args.rows + 1
+    headers = admin_headers()
+    ssl_context = ssl.create_default_context()
+
+    async def call(name, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        latencies[name].append(time.perf_counter() - started)
+        statuses[name][status] += 1
+        return response
+
+    async def book(name, client, rng):
+        nonlocal next_id
+        response = await call(name, client.post("/book", json=fake_booking(rng)))
+        if response is not None and response.status_code == 200:
+            live.append(next_id)
+            next_id += 1
+
+    async def user(index):
+        rng = random.Random(args.seed + index)
+        page = None
+        # Простаивающие после burst соединения закрываем раньше uvicorn (5 с):
+        # иначе POST может уйти в соединение, которое сервер как раз закрывает
+        limits = httpx.Limits(keepalive_expiry=2)
+        async with httpx.AsyncClient(base_url=base_url, timeout=120, verify=ssl_context,
+                                     limits=limits) as client:
+            for _ in range(args.requests):
+                name = rng.choices(names, weights)[0]
+                if name == "book":
+                    await book(name, client, rng)
+                elif name == "burst":
+                    await asyncio.gather(*(book(name, client, rng) for _ in range(args.burst_size)))
+                elif name in ("list", "next_page"):
+                    # next_page идёт по курсору предыдущей страницы этого пользователя
+                    if name == "list" or page is None:
+                        page = {"limit": args.page_size, "format": "columns",
+                                "sort": rng.choice(main.SORT_COLUMNS), "order": rng.choice(("asc", "desc"))}
+                    response = await call(name, client.get("/bookings", params=page, headers=headers))
+                    cursor = response is not None and response.headers.get("X-Next-Cursor")
+                    page = {**page, "cursor": cursor} if cursor else None
+                elif name == "filter":
+                    start = random_day(rng)
+                    params = {"from": start.isoformat(), "to": (start + timedelta(days=7)).isoformat(),
+                              "attraction": rng.choice(ATTRACTIONS), "limit": args.page_size}
+                    await call(name, client.get("/bookings", params=params, headers=headers))
+                elif name == "update" and live:
+                    booking_id = rng.choice(live)
+                    await call(name, client.put(f"/bookings/{booking_id}", json=fake_booking(rng),
+                                                headers=headers))
+                elif name == "delete" and live:
+                    position = rng.randrange(len(live))
+                    live[position], live[-1] = live[-1], live[position]
+                    await call(name, client.delete(f"/bookings/{live.pop()}", headers=headers))
+                elif name == "availability":
+                    start = random_day(rng)
+                    params = {"from": start.isoformat(), "to": (start + timedelta(days=30)).isoformat()}
+                    await call(name, client.get("/availability", params=params))
+                elif name == "stats":
+                    start = random_day(rng)
+                    params = {"from": start.isoformat(), "to": (start + timedelta(days=30)).isoformat()}
+                    await call(name, client.get("/stats", params=params, headers=headers))
+                if args.think_ms:
+                    await asyncio.sleep(rng.expovariate(1 / args.think_ms) / 1000)
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(args.clients)))
+        return time.perf_counter() - started
+
+    cpu_before = process_cpu(process.pid)
+    elapsed = asyncio.run(run())
+    cpu_after = process_cpu(process.pid)
+    total = sum(map(len, latencies.values()))
+    # 4xx - ответ по делу (404 у гонки удаления), ошибка - 5xx или обрыв
+    errors = sum(count for counter in statuses.values() for status, count in counter.items()
+                 if not isinstance(status, int) or status >= 500)
+    return {
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(total / elapsed, 1),
+        "server_cpu_ms_per_request": cpu_ms(cpu_before, cpu_after, max(total, 1), 3),
+        "all": percentiles([value for values in latencies.values() for value in values]),
+        "operations": {
+            name: {**percentiles(latencies[name]), "statuses": {str(key): value for key, value in statuses[name].items()}}
+            for name in names
+        },
+    }
+
+
+def bench_load(args):
+    results = {}
+    for mode in args.modes:
+        path = temp_db(f"load-{mode}.db")
+        seed(path, args.rows, random.Random(args.seed))
+        with server(path, API_MODE=mode) as (base_url, process):
+            results[mode] = mixed_load(base_url, process, args)
+    return results
+
+
+def bench_workers(args):
+    # Кривая масштабирования: та же смешанная нагрузка на 1, 2, 4... воркера
+    # uvicorn над одной базой, каждый раз с чистой копией засеянного файла
+    source = temp_db("workers-seed.db")
+    seed(source, args.rows, random.Random(args.seed))
+    results = {}
+    for workers in args.workers:
+        path = os.path.join(WORKDIR, f"workers-{workers}.db")
+        shutil.copyfile(source, path)
+        with server(path, "--workers", str(workers), API_MODE=args.mode) as (base_url, process):
+            # Воркеры поднимаются после ответа первого из них
+            time.sleep(args.warmup)
+            results[f"workers={workers}"] = mixed_load(base_url, process, args)
+    return results
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            items.update(flatten(item, f"{prefix}{key}/"))
+        return items
+    return {prefix.rstrip("/"): value}
+
+
+def bench_compare(args):
+    # Все числа, которые есть в обоих файлах, с изменением в процентах
+    with open(args.base, encoding="utf-8") as file:
+        base = flatten(json.load(file)["results"])
+    with open(args.new, encoding="utf-8") as file:
+        new = flatten(json.load(file)["results"])
+    results = {}
+    for key, old in base.items():
+        value = new.get(key)
+        if isinstance(old, bool) or not isinstance(old, (int, float)) or not isinstance(value, (int, float)):
+            continue
+        change = round((value - old) / old * 100, 1) if old else None
+        results[key] = {"base": old, "new": value, "change_pct": change}
+    return results
+
+
+def environment():
+    # С какого кода и на чём сняты цифры - чтобы сравнивать прогоны между коммитами
+    def git(*command):
+        try:
+            return subprocess.run(["git", *command], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except OSError:
+            return ""
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD") or None,
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def bench_async(args):
+    results = {}
+    for mode in args.modes:
+        path = temp_db(f"{mode}.db")
+        seed(path, args.rows, random.Random(args.seed))
+        with server(path, API_MODE=mode) as (base_url, _):
+            results[mode] = load_test(base_url, args.clients, args.requests,
+                                      args.write_ratio, args.seed)
+    return results
+
+
+def queued_writes(path, synchronous, size, delay_ms, rows, rng):
+    # Писатель без HTTP: сколько вставок в секунду даёт сама база
+    pool = main.ConnectionPool(path, 2, main.DB_POOL_TIMEOUT, main.DB_BUSY_TIMEOUT_MS,
+                               main.DB_MMAP_SIZE, synchronous)
+    db = main.QueuedDatabase(pool, 1, size, delay_ms / 1000)
+    bookings = [main.Booking(**fake_booking(rng)) for _ in range(rows)]
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(*(db.write(main.insert_booking, booking) for booking in bookings))
+        return time.perf_counter() - started
+
+    try:
+        elapsed = asyncio.run(run())
+    finally:
+        db.close()
+        pool.close()
+    return round(rows / elapsed, 1)
+
+
+def bench_group_commit(args):
+    # Всплеск бронирований: только POST /book, режим async, разный размер группы
+    results = {}
+    for synchronous in args.synchronous:
+        for size in args.batch_sizes:
+            writer_rows_per_s = queued_writes(temp_db(f"writer-{synchronous}-{size}.db"), synchronous,
+                                              size, args.delay_ms, args.writer_rows,
+                                              random.Random(args.seed))
+            path = temp_db(f"group-{synchronous}-{size}.db")
+            env = {"API_MODE": "async", "DB_SYNCHRONOUS": synchronous,
+                   "WRITE_BATCH_SIZE": str(size), "WRITE_BATCH_DELAY_MS": str(args.delay_ms)}
+            with server(path, **env) as (base_url, _):
+                result = load_test(base_url, args.clients, args.requests, 1.0, args.seed)
+            results[f"{synchronous} batch={size}"] = {
+                "writer_rows_per_s": writer_rows_per_s,
+                **{key: result[key] for key in ("requests", "errors", "requests_per_s", "write")},
+            }
+    return results
+
+
+def process_cpu(pid):
+    # user + system CPU процесса и его живых потомков (воркеров uvicorn)
+    # в секундах: /proc на Linux, иначе psutil; без обоих - None
+    if os.path.exists(f"/proc/{pid}/stat"):
+        return proc_cpu(pid)
+    if psutil is None:
+        return None
+    total = 0.0
+    process = psutil.Process(pid)
+    for member in (process, *process.children(recursive=True)):
+        try:
+            times = member.cpu_times()
+        except psutil.NoSuchProcess:
+            continue
+        total += times.user + times.system
+    return total
+
+
+def proc_cpu(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    total = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            total += sum(proc_cpu(int(child)) for child in f.read().split())
+    return total
+
+
+def cpu_ms(before, after, per, digits):
+    # Миллисекунды CPU на единицу работы; None, если CPU снять нечем
+    if before is None or after is None:
+        return None
+    return round((after - before) / per * 1000, digits)
+
+
+def legacy_page(conn, after_id, limit):
+    # Прежний путь: dict на строку и jsonable_encoder + json.dumps из FastAPI
+    rows = conn.execute(f'''
+        SELECT id, name, phone, age, date, {main.attractions_column('bookings')} FROM bookings
+        WHERE id > ? ORDER BY id LIMIT ?
+    ''', (after_id, limit)).fetchall()
+    body = JSONResponse(jsonable_encoder([main.row_to_booking(row) for row in rows])).body
+    return body, rows[-1]['id'] if len(rows) == limit else None
+
+
+def bench_serialize(args):
+    # CPU и байты на 10k броней: выборка всех строк страницами по page_size
+    path = temp_db("serialize.db")
+    seed(path, args.rows, random.Random(args.seed))
+    per_10k = 10000 / args.rows
+    results = {}
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+
+    def legacy():
+        after_id, size = 0, 0
+        while after_id is not None:
+            body, after_id = legacy_page(conn, after_id, args.page_size)
+            size += len(body)
+        return size
+
+    def sqlite_json(fmt):
+        def run():
+            cursor, size = None, 0
+            while True:
+                _, body, cursor = main.select_bookings(conn, ([], []), "id", "asc",
+                                                       args.page_size, cursor, fmt)
+                size += len(body)
+                if cursor is None:
+                    return size
+        return run
+
+    for name, run in (("dicts", legacy), ("sqlite_json", sqlite_json("json")),
+                      ("sqlite_columns", sqlite_json("columns"))):
+        size = run()
+        started = time.process_time()
+        for _ in range(args.repeat):
+            run()
+        cpu = (time.process_time() - started) / args.repeat
+        results[f"in_process_{name}"] = {"bytes_per_10k": round(size * per_10k),
+                                         "cpu_ms_per_10k": round(cpu * per_10k * 1000, 1)}
+    conn.close()
+
+    # То же через HTTP: байты на проводе и CPU процесса uvicorn.
+    # Кэш страниц выключен, иначе повторы замеряли бы его, а не сериализацию.
+    with server(path, PAGE_CACHE_SIZE="0") as (base_url, process), httpx.Client(base_url=base_url, timeout=60) as client:
+        for fmt in ("json", "columns"):
+            for encoding in ("identity", "gzip"):
+                headers = {"Accept-Encoding": encoding, **admin_headers()}
+                wire = 0
+                cpu_before = process_cpu(process.pid)
+                for _ in range(args.repeat):
+                    cursor = None
+                    while True:
+                        params = {"limit": args.page_size, "format": fmt}
+                        if cursor:
+                            params["cursor"] = cursor
+                        response = client.get("/bookings", params=params, headers=headers)
+                        response.raise_for_status()
+                        wire += response.num_bytes_downloaded
+                        cursor = response.headers.get("X-Next-Cursor")
+                        if cursor is None:
+                            break
+                cpu_after = process_cpu(process.pid)
+                results[f"http_{fmt}_{encoding}"] = {
+                    "bytes_per_10k": round(wire / args.repeat * per_10k),
+                    "server_cpu_ms_per_10k": cpu_ms(cpu_before, cpu_after, args.repeat / per_10k, 1),
+                }
+    return results
+
+
+def bench_export(args):
+    # Выгрузка всей таблицы: fetchall с JSON целиком в памяти против порций
+    # export_chunk. Время - отдельным прогоном, tracemalloc его замедляет.
+    path = temp_db("export.db")
+    seed(path, args.rows, random.Random(args.seed))
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+
+    def fetchall_json():
+        rows = conn.execute(f'''
+            SELECT id, name, phone, age, date, {main.attractions_column('bookings')}
+            FROM bookings ORDER BY date, id
+        ''').fetchall()
+        return len(json.dumps([main.row_to_booking(row) for row in rows], ensure_ascii=False).encode("utf-8"))
+
+    def chunked(fmt):
+        def run():
+            size, after = 0, None
+            while True:
+                text, after = main.export_chunk(conn, ([], []), after, fmt)
+                if after is None:
+                    return size
+                size += len(text.encode("utf-8"))
+        return run
+
+    results = {}
+    for name, func in (("fetchall_json", fetchall_json), ("export_csv", chunked("csv")),
+                       ("export_ndjson", chunked("ndjson"))):
+        started = time.perf_counter()
+        size = func()
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[f"in_process_{name}"] = {"bytes": size, "elapsed_s": round(elapsed, 3),
+                                         "peak_python_mb": round(peak / 2 ** 20, 2)}
+    conn.close()
+
+    # Через HTTP: клиент пишет поток на диск, как кнопка "Экспорт" в админке
+    with server(path) as (base_url, process), httpx.Client(base_url=base_url, timeout=60) as client:
+        for fmt in ("csv", "ndjson"):
+            for encoding in ("identity", "gzip"):
+                headers = {"Accept-Encoding": encoding, **admin_headers()}
+                target = os.path.join(WORKDIR, f"export.{fmt}")
+                started = time.perf_counter()
+                with client.stream("GET", "/bookings/export", params={"format": fmt},
+                                   headers=headers) as response, open(target, "wb") as file:
+                    response.raise_for_status()
+                    for data in response.iter_bytes():
+                        file.write(data)
+                    wire = response.num_bytes_downloaded
+                elapsed = time.perf_counter() - started
+                results[f"http_{fmt}_{encoding}"] = {
+                    "bytes_on_wire": wire,
+                    "file_bytes": os.path.getsize(target),
+                    "elapsed_s": round(elapsed, 3),
+                    "rows_per_s": round(args.rows / elapsed),
+                }
+    return results
+
+
+def bench_stats(args):
+    # /stats по сводным таблицам против тех же агрегатов сканом bookings,
+    # и во что триггеры сводок обходятся записи
+    year = (date(2025, 1, 1), date(2025, 12, 31))
+    bounds = tuple(day.isoformat() for day in year)
+    results = {}
+    for name in ("without_stats_triggers", "with_stats_triggers"):
+        path = temp_db(f"{name}.db")
+        if name == "without_stats_triggers":
+            with sqlite3.connect(path) as conn:
+                for trigger in ("bookings_stats_insert", "bookings_stats_delete", "bookings_stats_update"):
+                    conn.execute(f"DROP TRIGGER {trigger}")
+        started = time.perf_counter()
+        seed(path, args.rows, random.Random(args.seed))
+        results[f"seed_{name}_rows_per_s"] = round(args.rows / (time.perf_counter() - started))
+
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    stats = main.get_stats(date_from=year[0], date_to=year[1], conn=conn)
+
+    def scan():
+        # Те же ответы без сводок: группировка по всем броням за год
+        days = conn.execute('''
+            SELECT date, COUNT(*) FROM bookings WHERE date BETWEEN ? AND ?
+            GROUP BY date ORDER BY date
+        ''', bounds).fetchall()
+        attractions = conn.execute('''
+            SELECT a.name, COUNT(ba.booking_id) FROM attractions a
+            LEFT JOIN booking_attractions ba ON ba.attraction_id = a.id AND ba.date BETWEEN ? AND ?
+            GROUP BY a.id
+        ''', bounds).fetchall()
+        bands = conn.execute(f'''
+            SELECT {main.age_band('age')}, COUNT(*) FROM bookings WHERE date BETWEEN ? AND ?
+            GROUP BY 1
+        ''', bounds).fetchall()
+        return days, attractions, bands
+
+    days, attractions, bands = scan()
+    assert [(day["date"], day["bookings"]) for day in stats["days"]] == [tuple(row) for row in days]
+    assert stats["total"] == args.rows
+    results["year_stats"] = timed(lambda: main.get_stats(date_from=year[0], date_to=year[1], conn=conn),
+                                  args.repeat)
+    results["year_scan"] = timed(scan, args.repeat)
+    conn.close()
+    return results
+
+
+def bench_search(args):
+    # /bookings/search по FTS5 и префиксу телефона против LIKE '%...%' - единственного,
+    # чем без индекса находится имя из середины ФИО или часть номера
+    results = {}
+    for name in ("without_search_triggers", "with_search_triggers"):
+        path = temp_db(f"{name}.db")
+        if name == "without_search_triggers":
+            with sqlite3.connect(path) as conn:
+                for trigger in ("bookings_search_insert", "bookings_search_delete", "bookings_search_update"):
+                    conn.execute(f"DROP TRIGGER {trigger}")
+        started = time.perf_counter()
+        seed(path, args.rows, random.Random(args.seed), named_booking)
+        results[f"seed_{name}_rows_per_s"] = round(args.rows / (time.perf_counter() - started))
+
+    conn = sqlite3.connect(path)
+    samples = conn.execute("SELECT name, phone FROM bookings ORDER BY random() LIMIT ?",
+                           (args.repeat,)).fetchall()
+    # (что ввёл администратор, слова и цифры для LIKE)
+    queries = {
+        "surname_prefix": [(surname[:3], [surname[:3]], "") for surname, _ in
+                           (sample[0].split(" ", 1) for sample in samples)],
+        "first_name": [(first, [first], "") for _, first in (sample[0].split(" ", 1) for sample in samples)],
+        "surname_and_first_name": [(f"{surname[:4]} {first[:3]}", [surname[:4], first[:3]], "")
+                                   for surname, first in (sample[0].split(" ", 1) for sample in samples)],
+        "phone_prefix": [(phone[1:7], [], phone[1:7]) for _, phone in samples],
+    }
+    for kind, items in queries.items():
+        latencies, scans, found = [], [], 0
+        for text, words, digits in items:
+            terms, query_digits = main.search_terms(text)
+            started = time.perf_counter()
+            hits = json.loads(main.find_bookings(conn, terms, query_digits, main.SEARCH_LIMIT_DEFAULT))
+            latencies.append(time.perf_counter() - started)
+            found += bool(hits)
+            clauses = ["name LIKE ?"] * len(words) + (["phone LIKE ?"] if digits else [])
+            params = [f"%{word}%" for word in words] + ([f"%{digits}%"] if digits else [])
+            started = time.perf_counter()
+            conn.execute(f"SELECT id FROM bookings WHERE {' AND '.join(clauses)} ORDER BY name LIMIT ?",
+                         (*params, main.SEARCH_LIMIT_DEFAULT)).fetchall()
+            scans.append(time.perf_counter() - started)
+        results[kind] = {"search": percentiles(latencies), "like_scan": percentiles(scans),
+                         "queries_with_hits": found}
+    conn.close()
+    return results
+
+
+def during_live_writes(path, job, rng):
+    # job() в фоне, параллельно одна бронь каждые 5 мс своим соединением:
+    # (секунды job, задержки этих броней)
+    pool = main.ConnectionPool(path, 2, main.DB_POOL_TIMEOUT, main.DB_BUSY_TIMEOUT_MS, main.DB_MMAP_SIZE)
+    done = threading.Event()
+    latencies = []
+
+    def writer():
+        while not done.is_set():
+            booking = main.Booking(**{**fake_booking(rng), "date": "2026-06-01"})
+            started = time.perf_counter()
+            with pool.connection() as conn:
+                with conn:
+                    main.insert_booking(conn, booking)
+            latencies.append(time.perf_counter() - started)
+            time.sleep(0.005)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        started = time.perf_counter()
+        job(pool)
+        elapsed = time.perf_counter() - started
+    finally:
+        done.set()
+        thread.join()
+        pool.close()
+    return round(elapsed, 3), percentiles(latencies)
+
+
+def stats_before(path, cutoff):
+    # /stats за дни до cutoff: живые брони during_live_writes идут позже и его не меняют
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return main.get_stats(date_from=None, date_to=date.fromisoformat(cutoff) - timedelta(days=1), conn=conn)
+    finally:
+        conn.close()
+
+
+def bench_archive(args):
+    # Архивация половины таблицы и DELETE /bookings порциями против одной транзакции;
+    # главное - сколько ждёт бронь, пришедшая во время переноса
+    results = {}
+    cutoff = "2025-07-01"
+    for name, chunk in (("chunked", main.ARCHIVE_CHUNK_SIZE), ("single_transaction", args.rows)):
+        path = temp_db(f"archive-{name}.db")
+        seed(path, args.rows, random.Random(args.seed))
+        db_bytes = os.path.getsize(path)
+        stats = stats_before(path, cutoff)
+        main.ARCHIVE_DIR = os.path.join(WORKDIR, f"archive-{name}")
+        main.ARCHIVE_CHUNK_SIZE = chunk
+        elapsed, writes = during_live_writes(path, lambda pool: main.archive_bookings(pool, cutoff),
+                                             random.Random(args.seed))
+        with sqlite3.connect(path) as conn:
+            moved = conn.execute("SELECT COUNT(*) FROM bookings WHERE date < ?", (cutoff,)).fetchone()[0]
+        # Перенос в архив не должен менять статистику
+        assert stats_before(path, cutoff) == stats, "archive changed /stats"
+        archive_bytes = sum(os.path.getsize(os.path.join(folder, file))
+                            for folder, _, files in os.walk(main.ARCHIVE_DIR) for file in files)
+        results[f"archive_{name}"] = {
+            "seconds": elapsed, "left_in_db": moved, "db_bytes_before": db_bytes,
+            "archive_bytes": archive_bytes, "live_writes": writes,
+        }
+
+        main.DELETE_CHUNK_SIZE = chunk
+
+        def clear(pool):
+            with pool.connection() as conn:
+                last_id = main.max_booking_id(conn)
+                while True:
+                    with conn:
+                        if not main.remove_bookings_chunk(conn, last_id):
+                            break
+
+        elapsed, writes = during_live_writes(path, clear, random.Random(args.seed))
+        results[f"delete_all_{name}"] = {"seconds": elapsed, "live_writes": writes}
+    return results
+
+
+def bench_conditional(args):
+    # Админки раз за разом перезапрашивают одну и ту же первую страницу:
+    # сборка заново, готовая страница из кэша и 304 по If-None-Match
+    path = temp_db("conditional.db")
+    seed(path, args.rows, random.Random(args.seed))
+    params = {"limit": args.page_size, "format": "columns", "sort": "date", "order": "desc"}
+    results = {}
+    for name, env, conditional in (("no_cache", {"PAGE_CACHE_SIZE": "0"}, False),
+                                   ("page_cache", {}, False),
+                                   ("if_none_match", {}, True)):
+        with server(path, **env) as (base_url, process), httpx.Client(base_url=base_url, timeout=60) as client:
+            headers = {"Accept-Encoding": "gzip", **admin_headers()}
+            first = client.get("/bookings", params=params, headers=headers)
+            first.raise_for_status()
+            if conditional:
+                headers["If-None-Match"] = first.headers["ETag"]
+            latencies, wire = [], 0
+            cpu_before = process_cpu(process.pid)
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                response = client.get("/bookings", params=params, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == (304 if conditional else 200)
+                wire += response.num_bytes_downloaded
+            cpu_after = process_cpu(process.pid)
+            results[name] = {
+                **percentiles(latencies),
+                "server_cpu_ms_per_request": cpu_ms(cpu_before, cpu_after, args.requests, 3),
+                "bytes_per_request": round(wire / args.requests),
+            }
+    return results
+
+
+def bench_metrics(args):
+    # Во что обходится учёт: запрос SQLite через TimedConnection против
+    # обычного соединения и полный путь запроса с MetricsMiddleware и без
+    path = temp_db("metrics.db")
+    seed(path, args.rows, random.Random(args.seed))
+    results = {}
+    for name, factory in (("plain", sqlite3.Connection), ("timed", main.TimedConnection)):
+        conn = sqlite3.connect(path, factory=factory)
+        started = time.perf_counter()
+        for i in range(args.queries):
+            conn.execute("SELECT name FROM bookings WHERE id = ?", (i % args.rows + 1,)).fetchall()
+        results[f"query_{name}_us"] = round((time.perf_counter() - started) / args.queries * 1e6, 2)
+        conn.close()
+
+    middleware = [entry for entry in main.app.user_middleware if entry.cls is main.MetricsMiddleware]
+    for name in ("with_middleware", "without_middleware"):
+        if name == "without_middleware":
+            main.app.user_middleware = [entry for entry in main.app.user_middleware if entry not in middleware]
+            main.app.middleware_stack = None
+        with TestClient(main.app) as client:
+            client.get("/availability")
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                client.get("/availability")
+            results[f"request_{name}_ms"] = round((time.perf_counter() - started) / args.requests * 1000, 3)
+    main.app.user_middleware.extend(middleware)
+    main.app.middleware_stack = None
+    started = time.perf_counter()
+    text = main.metrics.render()
+    results["render_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    results["render_lines"] = text.count("\n")
+    return results
+
+
+def add_load_arguments(parser):
+    # Параметры mixed_load, общие для сценариев load и workers
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=50, help="операций на клиента")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(LOAD_MIX),
+                        help=f"веса операций, по умолчанию {LOAD_MIX}")
+    parser.add_argument("--burst-size", type=int, default=10, help="POST /book одновременно в операции burst")
+    parser.add_argument("--page-size", type=int, default=main.PAGE_LIMIT_DEFAULT)
+    parser.add_argument("--think-ms", type=float, default=0, help="средняя пауза между операциями клиента")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Замеры производительности бронирований")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    pool = sub.add_parser("pool", help="sqlite3.connect на запрос против пула с WAL")
+    pool.add_argument("--rows", type=int, default=10000)
+    pool.add_argument("--ops", type=int, default=4000)
+    pool.add_argument("--threads", type=int, default=16)
+    pool.add_argument("--write-ratio", type=float, default=0.2)
+    pool.add_argument("--pool-size", type=int, default=main.DB_POOL_SIZE)
+    pool.set_defaults(func=bench_pool)
+
+    batch = sub.add_parser("batch", help="импорт через POST /bookings/batch")
+    batch.add_argument("--rows", type=int, default=100000)
+    batch.add_argument("--single-rows", type=int, default=2000)
+    batch.add_argument("--formats", nargs="+", choices=["ndjson", "csv", "json"],
+                       default=["ndjson", "csv", "json"])
+    batch.set_defaults(func=bench_batch)
+
+    auth = sub.add_parser("auth", help="bcrypt на каждый запрос против кэша и токена")
+    auth.add_argument("--bcrypt-rounds", type=int, default=12)
+    auth.add_argument("--cold", type=int, default=20)
+    auth.add_argument("--repeat", type=int, default=10000)
+    auth.set_defaults(func=bench_auth)
+
+    modes = sub.add_parser("async", help="API_MODE=sync против async под сотнями клиентов")
+    modes.add_argument("--modes", nargs="+", choices=["sync", "async"], default=["sync", "async"])
+    modes.add_argument("--rows", type=int, default=10000)
+    modes.add_argument("--clients", type=int, default=500)
+    modes.add_argument("--requests", type=int, default=10, help="запросов на клиента")
+    modes.add_argument("--write-ratio", type=float, default=0.2)
+    modes.set_defaults(func=bench_async)
+
+    group = sub.add_parser("group-commit", help="POST /book с групповой фиксацией записей")
+    group.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32, 128])
+    group.add_argument("--delay-ms", type=float, default=main.WRITE_BATCH_DELAY_MS)
+    group.add_argument("--synchronous", nargs="+", choices=["NORMAL", "FULL"], default=["FULL", "NORMAL"])
+    group.add_argument("--writer-rows", type=int, default=20000)
+    group.add_argument("--clients", type=int, default=200)
+    group.add_argument("--requests", type=int, default=10, help="запросов на клиента")
+    group.set_defaults(func=bench_group_commit)
+
+    serialize = sub.add_parser("serialize", help="сериализация GET /bookings: CPU и байты на 10k броней")
+    serialize.add_argument("--rows", type=int, default=10000)
+    serialize.add_argument("--page-size", type=int, default=main.PAGE_LIMIT_MAX)
+    serialize.add_argument("--repeat", type=int, default=10)
+    serialize.set_defaults(func=bench_serialize)
+
+    export = sub.add_parser("export", help="выгрузка /bookings/export: память и скорость")
+    export.add_argument("--rows", type=int, default=200000)
+    export.set_defaults(func=bench_export)
+
+    stats = sub.add_parser("stats", help="GET /stats по сводным таблицам против скана bookings")
+    stats.add_argument("--rows", type=int, default=200000)
+    stats.add_argument("--repeat", type=int, default=50)
+    stats.set_defaults(func=bench_stats)
+
+    search = sub.add_parser("search", help="GET /bookings/search по FTS5 против LIKE-скана")
+    search.add_argument("--rows", type=int, default=200000)
+    search.add_argument("--repeat", type=int, default=100)
+    search.set_defaults(func=bench_search)
+
+    archive = sub.add_parser("archive", help="архивация и DELETE /bookings порциями: задержка живых записей")
+    archive.add_argument("--rows", type=int, default=200000)
+    archive.set_defaults(func=bench_archive)
+
+    conditional = sub.add_parser("conditional", help="GET /bookings: без кэша, из кэша и 304")
+    conditional.add_argument("--rows", type=int, default=50000)
+    conditional.add_argument("--page-size", type=int, default=main.PAGE_LIMIT_MAX)
+    conditional.add_argument("--requests", type=int, default=500)
+    conditional.set_defaults(func=bench_conditional)
+
+    overhead = sub.add_parser("metrics", help="накладные расходы /metrics: SQLite и middleware")
+    overhead.add_argument("--rows", type=int, default=10000)
+    overhead.add_argument("--queries", type=int, default=100000)
+    overhead.add_argument("--requests", type=int, default=2000)
+    overhead.set_defaults(func=bench_metrics)
+
+    load = sub.add_parser("load", help="смешанная нагрузка: брони, списки, изменения и удаления")
+    load.add_argument("--modes", nargs="+", choices=["sync", "async"], default=["sync", "async"])
+    add_load_arguments(load)
+    load.set_defaults(func=bench_load)
+
+    scaling = sub.add_parser("workers", help="масштабирование смешанной нагрузки по числу воркеров uvicorn")
+    scaling.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    scaling.add_argument("--mode", choices=["sync", "async"], default="sync")
+    scaling.add_argument("--warmup", type=float, default=3, help="секунд на запуск остальных воркеров")
+    add_load_arguments(scaling)
+    scaling.set_defaults(func=bench_workers)
+
+    for scenario in sub.choices.values():
+        scenario.add_argument("--seed", type=int, default=1)
+        scenario.add_argument("--output", help="записать результат ещё и в файл")
+
+    compare = sub.add_parser("compare", help="сравнить два файла результатов одного сценария")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--output", help="записать результат ещё и в файл")
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    params = {key: value for key, value in vars(args).items() if key not in ("func", "output")}
+    result = {"scenario": args.scenario, "params": params, "environment": environment()}
+    result["results"] = args.func(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main_cli()
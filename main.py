@@ -1,183 +1,2567 @@
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from pydantic import BaseModel, field_validator, constr
-from typing import List
-from contextlib import asynccontextmanager
-from datetime import date
-import sqlite3
-import uvicorn
-import bcrypt
-import hashlib
-import os
-from dotenv import load_dotenv
-
-load_dotenv('.env')
-app = FastAPI()
-
-
-def init_db():
-    with sqlite3.connect('bookings.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT NOT NULL CHECK(length(phone) >= 10),
-                age INTEGER NOT NULL CHECK(age >= 14),
-                date TEXT NOT NULL,
-                attractions TEXT NOT NULL
-            )
-        ''')
-        conn.commit()
-    conn.close()
-
-
-init_db()
-
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    init_db()
-    yield
-app = FastAPI(lifespan=lifespan)
-security = HTTPBasic()
-
-
-class Booking(BaseModel):
-    name: str
-    phone: constr(pattern=r'^\d{10,15}$')  # Только цифры, 10-15 символов
-    age: int
-    date: date
-    attractions: List[str]
-
-    @field_validator('age')
-    def validate_age(cls, v):
-        if v < 14:
-            raise ValueError('Minimum age is 14')
-        return v
-
-
-@app.post("/book")
-def create_booking(booking: Booking):
-    try:
-        with sqlite3.connect('bookings.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO bookings (name, phone, age, date, attractions)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                booking.name,
-                booking.phone,
-                booking.age,
-                booking.date.isoformat(),
-                ','.join(booking.attractions)
-            ))
-            conn.commit()
-        return {"status": "ok"}
-    except sqlite3.IntegrityError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-
-
-@app.get("/bookings")
-def get_bookings():
-    with sqlite3.connect('bookings.db') as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM bookings')
-        return [
-            {
-                "id": row['id'],
-                "name": row['name'],
-                "phone": row['phone'],
-                "age": row['age'],
-                "date": row['date'],
-                "attractions": row['attractions'].split(',')
-            }
-            for row in cursor.fetchall()
-        ]
-
-
-@app.delete("/bookings")
-def delete_bookings():
-    with sqlite3.connect('bookings.db') as conn:
-        conn.execute('DELETE FROM bookings')
-        conn.commit()
-    return {"message": "All bookings deleted"}
-
-
-@app.delete("/bookings/{booking_id}")
-def delete_booking_id(booking_id: int):
-    with sqlite3.connect('bookings.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "DELETE FROM bookings WHERE id = ?",
-            (booking_id,)
-        )
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Бронирование не найдено")
-        conn.commit()
-    return {"message": f"Booking {booking_id} deleted"}
-
-
-@app.put("/bookings/{booking_id}")
-def update_booking(booking_id: int, booking: Booking):
-    try:
-        with sqlite3.connect('bookings.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE bookings
-                SET name = ?,
-                    phone = ?,
-                    age = ?,
-                    date = ?,
-                    attractions = ?
-                WHERE id = ?
-            ''', (
-                booking.name,
-                booking.phone,
-                booking.age,
-                booking.date.isoformat(),
-                ','.join(booking.attractions),
-                booking_id
-            ))
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Бронирование не найдено")
-            conn.commit()
-        return {"status": "updated"}
-    except sqlite3.IntegrityError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-
-
-@app.post("/auth/admin")
-def admin_auth(credentials: HTTPBasicCredentials = Depends(security)):
-    try:
-        print(f"Auth attempt with password: {credentials.password}")
-
-        stored_hash = os.getenv("ADMIN_PASSWORD_HASH")
-        if not stored_hash:
-            print("Error: ADMIN_PASSWORD_HASH not set in .env")
-            raise HTTPException(status_code=500, detail="Server configuration error")
-
-        # Проверка хеша
-        password_bytes = credentials.password.encode('utf-8')
-        stored_hash_bytes = stored_hash.encode('utf-8')
-
-        print(f"Stored hash: {stored_hash}")
-        print(f"Password hash: {bcrypt.hashpw(password_bytes, stored_hash_bytes)}")
-
-        if bcrypt.checkpw(password_bytes, stored_hash_bytes):
-            print("Authentication successful")
-            return {"status": "ok"}
-
-        print("Invalid password")
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-
-    except Exception as e:
-        print(f"Auth error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-if __name__ == "__main__":
-    print("Переменные окружения:")
-    print("ADMIN_PASSWORD_HASH:", os.getenv("ADMIN_PASSWORD_HASH"))
-    uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
+from fastapi import APIRouter, Body, FastAPI, Header, HTTPException, Depends, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
+from pydantic import BaseModel, ValidationError, field_validator, constr
+from typing import Annotated, Any, List, Literal, Optional
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager, contextmanager, suppress
+from datetime import date, timedelta
+import argparse
+import asyncio
+import base64
+import csv
+import gzip
+import hmac
+import io
+import json
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uvicorn
+import bcrypt
+import hashlib
+import os
+import sys
+from dotenv import load_dotenv
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+load_dotenv('.env')
+app = FastAPI()
+
+DB_PATH = os.getenv("DB_PATH", "bookings.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# NORMAL в WAL не делает fsync на каждый коммит; FULL - делает
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+# sync - обработчики def в threadpool FastAPI; async - обработчики async def
+# с отдельным потоком-писателем и пулом читателей (QueuedDatabase)
+API_MODE = os.getenv("API_MODE", "sync")
+# Групповая фиксация в режиме async: писатель забирает из очереди до
+# WRITE_BATCH_SIZE записей, дожидаясь следующих не дольше WRITE_BATCH_DELAY_MS,
+# и фиксирует их одной транзакцией. 1 - каждая запись в своей транзакции.
+WRITE_BATCH_SIZE = max(int(os.getenv("WRITE_BATCH_SIZE", "1")), 1)
+WRITE_BATCH_DELAY_MS = float(os.getenv("WRITE_BATCH_DELAY_MS", "2"))
+# Процессов uvicorn; python main.py передаёт выбранное число воркерам через окружение.
+# /metrics и профайлер живут в памяти процесса, поэтому работают только при одном.
+WORKERS = max(int(os.getenv("WORKERS", "1")), 1)
+
+BOOKING_COLUMNS = ('id', 'name', 'phone', 'age', 'date', 'attractions')
+SORT_COLUMNS = ('id', 'name', 'phone', 'age', 'date', 'attractions')
+# Колонка bookings, по которой идёт сортировка, если имя поля с ней не совпадает
+SORT_KEYS = {'attractions': 'attractions_key'}
+PAGE_LIMIT_DEFAULT = 100
+PAGE_LIMIT_MAX = 1000
+# Ответы больше GZIP_MIN_SIZE байт сжимаются, если клиент принимает gzip
+GZIP_MIN_SIZE = 1000
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+# Готовые страницы /bookings; страница до PAGE_LIMIT_MAX строк - около 170 КБ
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "128"))
+CHANGE_LOG_SIZE = 10000
+# Без уведомлений (например, запись из другого процесса) поток всё равно
+# перечитывает журнал с этим интервалом и заодно шлёт keep-alive
+STREAM_POLL_INTERVAL = 5
+BATCH_CHUNK_SIZE = 1000
+BATCH_MAX_ERRORS = 1000
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+SEARCH_QUERY_MAX_LENGTH = 100
+SEARCH_RANK_WINDOW = 1000
+DELETE_CHUNK_SIZE = 250
+# Брони с датой старше ARCHIVE_AFTER_DAYS дней переносятся в сжатые файлы
+# ARCHIVE_DIR/ГГГГ-ММ/*.ndjson.gz раз в ARCHIVE_INTERVAL секунд; 0 - не переносить
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_CHUNK_SIZE = 250
+# Ключ идемпотентности от клиента (киоск с очередью неотправленных броней)
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+BOOK_BATCH_MAX = 100
+
+ATTRACTIONS = ["Скалодром", "Зиплайн", "Веревочный парк", "Батутный парк"]
+# Вместимость аттракциона в день по умолчанию; NULL в базе - без ограничения
+ATTRACTION_CAPACITY = int(os.getenv("ATTRACTION_CAPACITY", "50"))
+AVAILABILITY_MAX_DAYS = 366
+# Нижние границы возрастных групп /stats; после изменения - python main.py rebuild-stats
+AGE_BANDS = (14, 18, 25, 35, 45, 55, 65)
+CAPACITY_ERROR = 'capacity exceeded'
+UNKNOWN_ATTRACTION_ERROR = 'unknown attraction'
+
+AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", str(12 * 3600)))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "128"))
+# Ключ подписи токенов. Без SESSION_SECRET он случайный и токены
+# перестают действовать после перезапуска сервера; python main.py передаёт
+# один случайный ключ всем своим воркерам.
+SESSION_SECRET = os.getenv("SESSION_SECRET", "").encode('utf-8') or os.urandom(32)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Запросы дольше этого попадают в журнал предупреждением
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# Границы корзин гистограмм /metrics, секунды
+METRICS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILER_INTERVAL_MS = 10
+# Забытый профилировщик сам перестаёт снимать стеки через столько секунд
+PROFILER_MAX_SECONDS = 600
+
+
+class JsonFormatter(logging.Formatter):
+    # Одна JSON-строка на запись; поля события передаются в extra={"fields": {...}}
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+log = logging.getLogger("bookings")
+if not log.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(JsonFormatter())
+    log.addHandler(log_handler)
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+
+
+class Metrics:
+    # Счётчики, датчики и гистограммы в памяти процесса; /metrics отдаёт их
+    # в текстовом формате Prometheus. Метки - кортеж пар (имя, значение).
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._kinds = {}
+        self._help = {}
+        self._values = {}
+
+    def describe(self, name, kind, text):
+        self._kinds[name] = kind
+        self._help[name] = text
+
+    def observe(self, name, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get((name, labels))
+            if series is None:
+                # счётчики по корзинам (последняя - +Inf), сумма, количество
+                series = self._values[(name, labels)] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def add(self, name, value=1, labels=()):
+        with self._lock:
+            self._values[(name, labels)] = self._values.get((name, labels), 0) + value
+
+    def set(self, name, value, labels=()):
+        with self._lock:
+            self._values[(name, labels)] = value
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ''
+        escaped = (
+            (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for key, value in pairs
+        )
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(value) if isinstance(value, list) else value)
+                           for key, value in self._values.items())
+        lines, described = [], set()
+        for (name, labels), value in items:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {self._help.get(name, name)}')
+                lines.append(f'# TYPE {name} {self._kinds.get(name, "gauge")}')
+            if not isinstance(value, list):
+                lines.append(f'{name}{self._labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), value):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{self._labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{self._labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(METRICS_BUCKETS)
+metrics.describe('http_request_duration_seconds', 'histogram', 'Время обработки запроса до отправки всего ответа')
+metrics.describe('http_requests_in_flight', 'gauge', 'Запросы в обработке')
+metrics.describe('sqlite_query_duration_seconds', 'histogram', 'Время execute/executemany по первому слову SQL')
+metrics.describe('sqlite_fetch_duration_seconds', 'histogram', 'Время fetchall')
+metrics.describe('sqlite_commit_duration_seconds', 'histogram', 'Время фиксации и отката транзакций')
+metrics.describe('db_pool_wait_seconds', 'histogram', 'Ожидание соединения из пула')
+metrics.describe('db_pool_idle_connections', 'gauge', 'Свободные соединения пула')
+metrics.describe('db_pool_waiters', 'gauge', 'Запросы в очереди за соединением')
+metrics.describe('db_write_queue_depth', 'gauge', 'Задания в очереди писателя (API_MODE=async)')
+metrics.describe('db_write_group_seconds', 'histogram', 'Фиксация одной группы записей писателем')
+metrics.describe('bookings_archived_total', 'counter', 'Брони, перенесённые в архив')
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Строки, читаемые перебором курсора, выбираются лениво и во время не входят
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe('sqlite_query_duration_seconds', time.perf_counter() - started,
+                            (('statement', sql.split(None, 1)[0].upper()),))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe('sqlite_query_duration_seconds', time.perf_counter() - started,
+                            (('statement', sql.split(None, 1)[0].upper()),))
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.observe('sqlite_fetch_duration_seconds', time.perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Соединение пула: запросы и фиксации попадают в /metrics.
+    # execute соединения и with conn написаны на C и мимо cursor()/commit()
+    # не проходят, поэтому переопределены отдельно.
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            metrics.observe('sqlite_commit_duration_seconds', time.perf_counter() - started,
+                            (('op', 'commit'),))
+
+    def rollback(self):
+        started = time.perf_counter()
+        try:
+            super().rollback()
+        finally:
+            metrics.observe('sqlite_commit_duration_seconds', time.perf_counter() - started,
+                            (('op', 'rollback'),))
+
+    def __exit__(self, exc_type, exc, traceback):
+        started = time.perf_counter()
+        try:
+            return super().__exit__(exc_type, exc, traceback)
+        finally:
+            metrics.observe('sqlite_commit_duration_seconds', time.perf_counter() - started,
+                            (('op', 'commit' if exc_type is None else 'rollback'),))
+
+
+# Номер схемы в PRAGMA user_version. Увеличивать при каждом изменении
+# create_schema - иначе уже инициализированные базы её не выполнят.
+SCHEMA_VERSION = 5
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    # Блокировка между процессами (инициализация схемы, архивация).
+    # Без ожидания занятая блокировка - BlockingIOError
+    with open(path, 'a+b') as file:
+        try:
+            if os.name == 'nt':
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if blocking:
+                raise
+            raise BlockingIOError(str(e))
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def init_db(path=DB_PATH):
+    # Воркеры стартуют одновременно: схему создаёт и мигрирует первый взявший
+    # блокировку, остальные видят актуальную user_version и ничего не делают
+    with file_lock(f'{path}.lock'):
+        conn = sqlite3.connect(path)
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            conn.close()
+        if version < SCHEMA_VERSION:
+            create_schema(path)
+            log.info("schema initialised", extra={"fields": {"db": path, "from_version": version,
+                                                             "to_version": SCHEMA_VERSION}})
+
+
+def create_schema(path):
+    with sqlite3.connect(path) as conn:
+        # WAL хранится в самом файле базы: читатели не ждут писателя
+        conn.execute('PRAGMA journal_mode=WAL')
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bookings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                phone TEXT NOT NULL CHECK(length(phone) >= 10),
+                age INTEGER NOT NULL CHECK(age >= 14),
+                date TEXT NOT NULL,
+                idempotency_key TEXT,
+                attractions_key TEXT NOT NULL DEFAULT ''
+            )
+        ''')
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(bookings)')]
+        if 'idempotency_key' not in columns:
+            cursor.execute('ALTER TABLE bookings ADD COLUMN idempotency_key TEXT')
+        if 'attractions_key' not in columns:
+            cursor.execute("ALTER TABLE bookings ADD COLUMN attractions_key TEXT NOT NULL DEFAULT ''")
+        # Повтор запроса с тем же ключом не создаёт вторую бронь
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_idempotency_key
+            ON bookings (idempotency_key) WHERE idempotency_key IS NOT NULL
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attractions (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                daily_capacity INTEGER CHECK(daily_capacity >= 0)
+            )
+        ''')
+        if 'daily_capacity' not in [row[1] for row in cursor.execute('PRAGMA table_info(attractions)')]:
+            cursor.execute('ALTER TABLE attractions ADD COLUMN daily_capacity INTEGER CHECK(daily_capacity >= 0)')
+        cursor.executemany(
+            'INSERT OR IGNORE INTO attractions (name, daily_capacity) VALUES (?, ?)',
+            [(name, ATTRACTION_CAPACITY) for name in ATTRACTIONS]
+        )
+        # date продублирована из bookings, чтобы "кто идёт на X в день Y"
+        # читался одним диапазоном индекса (attraction_id, date)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS booking_attractions (
+                booking_id INTEGER NOT NULL REFERENCES bookings (id) ON DELETE CASCADE,
+                attraction_id INTEGER NOT NULL REFERENCES attractions (id),
+                date TEXT NOT NULL,
+                PRIMARY KEY (booking_id, attraction_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_booking_attractions_attraction_date
+            ON booking_attractions (attraction_id, date)
+        ''')
+        # Аттракционы заводит только схема (и миграция): название, которого нет
+        # в attractions, даёт attraction_id NULL, и бронь отклоняется целиком
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS booking_attractions_known
+            BEFORE INSERT ON booking_attractions
+            WHEN NEW.attraction_id IS NULL
+            BEGIN
+                SELECT RAISE(ABORT, '{UNKNOWN_ATTRACTION_ERROR}');
+            END
+        ''')
+        migrate_attractions(cursor)
+        if 'attractions_key' not in columns:
+            cursor.execute(f'UPDATE bookings SET attractions_key = {attractions_key("bookings")}')
+        create_occupancy(cursor)
+        create_stats(cursor)
+        create_search(cursor)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS booking_changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                booking_id INTEGER,
+                op TEXT NOT NULL
+            )
+        ''')
+        # id (rowid) неявно входит в каждый индекс, поэтому keyset по (колонка, id)
+        # и ORDER BY колонка, id идут прямо по индексу
+        for sort in SORT_COLUMNS:
+            if sort != 'id':
+                column = SORT_KEYS.get(sort, sort)
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_bookings_{column} ON bookings ({column})'
+                )
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+    conn.close()
+
+
+def migrate_attractions(cursor):
+    # Старая схема хранила аттракционы строкой 'a,b,c' прямо в bookings
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(bookings)')]
+    if 'attractions' not in columns:
+        return
+    rows = cursor.execute('SELECT id, date, attractions FROM bookings').fetchall()
+    items = [
+        (booking_id, booking_date, [name for name in attractions.split(',') if name])
+        for booking_id, booking_date, attractions in rows
+    ]
+    # Названия из старых броней, которых нет в ATTRACTIONS, - без ограничения мест
+    cursor.executemany(
+        'INSERT OR IGNORE INTO attractions (name) VALUES (?)',
+        [(name,) for name in dict.fromkeys(name for _, _, names in items for name in names)]
+    )
+    save_attractions(cursor, items)
+    cursor.execute('DROP INDEX IF EXISTS idx_bookings_attractions')
+    cursor.execute('ALTER TABLE bookings DROP COLUMN attractions')
+
+
+def create_occupancy(cursor):
+    # occupancy - счётчик занятых мест на аттракцион и день. Его ведут триггеры
+    # на booking_attractions, поэтому он меняется в той же транзакции, что и бронь,
+    # при любом пути записи (одна бронь, пачка, изменение, каскадное удаление).
+    is_new = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'occupancy'"
+    ).fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS occupancy (
+            date TEXT NOT NULL,
+            attraction_id INTEGER NOT NULL,
+            booked INTEGER NOT NULL,
+            PRIMARY KEY (date, attraction_id)
+        ) WITHOUT ROWID
+    ''')
+    # Вместимость на конкретный день, перекрывает attractions.daily_capacity
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attraction_capacity (
+            date TEXT NOT NULL,
+            attraction_id INTEGER NOT NULL REFERENCES attractions (id),
+            capacity INTEGER NOT NULL CHECK(capacity >= 0),
+            PRIMARY KEY (date, attraction_id)
+        ) WITHOUT ROWID
+    ''')
+    # Запись идёт под единственной блокировкой записи SQLite, поэтому
+    # проверка и увеличение счётчика не разрываются параллельными бронями
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS booking_attractions_capacity
+        BEFORE INSERT ON booking_attractions
+        WHEN COALESCE((
+            SELECT booked FROM occupancy
+            WHERE date = NEW.date AND attraction_id = NEW.attraction_id
+        ), 0) >= COALESCE((
+            SELECT capacity FROM attraction_capacity
+            WHERE date = NEW.date AND attraction_id = NEW.attraction_id
+        ), (
+            SELECT daily_capacity FROM attractions WHERE id = NEW.attraction_id
+        ))
+        BEGIN
+            SELECT RAISE(ABORT, '{CAPACITY_ERROR}');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS booking_attractions_occupy
+        AFTER INSERT ON booking_attractions
+        BEGIN
+            INSERT INTO occupancy (date, attraction_id, booked)
+            VALUES (NEW.date, NEW.attraction_id, 1)
+            ON CONFLICT (date, attraction_id) DO UPDATE SET booked = booked + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS booking_attractions_release
+        AFTER DELETE ON booking_attractions
+        BEGIN
+            UPDATE occupancy SET booked = booked - 1
+            WHERE date = OLD.date AND attraction_id = OLD.attraction_id;
+        END
+    ''')
+    if is_new:
+        # Брони, сделанные до появления счётчика
+        cursor.execute('''
+            INSERT INTO occupancy (date, attraction_id, booked)
+            SELECT date, attraction_id, COUNT(*) FROM booking_attractions
+            GROUP BY date, attraction_id
+        ''')
+
+
+def age_band(column):
+    return 'CASE ' + ' '.join(f'WHEN {column} >= {low} THEN {low}' for low in reversed(AGE_BANDS)) + ' END'
+
+
+def create_stats(cursor):
+    # booking_stats - число броней на день и возрастную группу. Как и occupancy,
+    # её ведут триггеры, теперь на bookings. Визиты по дням - сумма групп дня,
+    # популярность аттракционов - occupancy: /stats не читает bookings вовсе.
+    is_new = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'booking_stats'"
+    ).fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS booking_stats (
+            date TEXT NOT NULL,
+            age_band INTEGER NOT NULL,
+            bookings INTEGER NOT NULL,
+            PRIMARY KEY (date, age_band)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_stats_insert
+        AFTER INSERT ON bookings
+        BEGIN
+            INSERT INTO booking_stats (date, age_band, bookings)
+            VALUES (NEW.date, {age_band('NEW.age')}, 1)
+            ON CONFLICT (date, age_band) DO UPDATE SET bookings = bookings + 1;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_stats_delete
+        AFTER DELETE ON bookings
+        BEGIN
+            UPDATE booking_stats SET bookings = bookings - 1
+            WHERE date = OLD.date AND age_band = {age_band('OLD.age')};
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_stats_update
+        AFTER UPDATE OF date, age ON bookings
+        BEGIN
+            UPDATE booking_stats SET bookings = bookings - 1
+            WHERE date = OLD.date AND age_band = {age_band('OLD.age')};
+            INSERT INTO booking_stats (date, age_band, bookings)
+            VALUES (NEW.date, {age_band('NEW.age')}, 1)
+            ON CONFLICT (date, age_band) DO UPDATE SET bookings = bookings + 1;
+        END
+    ''')
+    if is_new:
+        cursor.execute(f'''
+            INSERT INTO booking_stats (date, age_band, bookings)
+            SELECT date, {age_band('age')}, COUNT(*) FROM bookings
+            GROUP BY 1, 2
+        ''')
+    # Брони, перенесённые в архив: их удаление триггеры вычли из booking_stats
+    # и occupancy, а /stats показывает и их. Из bookings эти счётчики уже не
+    # пересчитать, поэтому rebuild_stats их не трогает. Хранится возраст, а не
+    # группа - смена AGE_BANDS их не портит.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_stats (
+            date TEXT NOT NULL,
+            age INTEGER NOT NULL,
+            bookings INTEGER NOT NULL,
+            PRIMARY KEY (date, age)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_occupancy (
+            date TEXT NOT NULL,
+            attraction_id INTEGER NOT NULL,
+            booked INTEGER NOT NULL,
+            PRIMARY KEY (date, attraction_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def search_name(column):
+    # unicode61 приводит кириллицу к нижнему регистру, но ё и е для него разные буквы
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_search(cursor):
+    # bookings_fts - полнотекстовый индекс ФИО. Таблица без содержимого (content=''):
+    # имя и так лежит в bookings, а rowid индекса - id брони. Такой индекс не умеет
+    # удалять строку по rowid, поэтому триггеры передают ему прежнее имя целиком.
+    is_new = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bookings_fts'"
+    ).fetchone() is None
+    # prefix - готовые списки для префиксов из 2 и 3 букв: поиск по мере ввода
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS bookings_fts USING fts5(
+            name, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_search_insert
+        AFTER INSERT ON bookings
+        BEGIN
+            INSERT INTO bookings_fts (rowid, name) VALUES (NEW.id, {search_name('NEW.name')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_search_delete
+        AFTER DELETE ON bookings
+        BEGIN
+            INSERT INTO bookings_fts (bookings_fts, rowid, name)
+            VALUES ('delete', OLD.id, {search_name('OLD.name')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_search_update
+        AFTER UPDATE OF name ON bookings
+        BEGIN
+            INSERT INTO bookings_fts (bookings_fts, rowid, name)
+            VALUES ('delete', OLD.id, {search_name('OLD.name')});
+            INSERT INTO bookings_fts (rowid, name) VALUES (NEW.id, {search_name('NEW.name')});
+        END
+    ''')
+    if is_new:
+        cursor.execute(f'''
+            INSERT INTO bookings_fts (rowid, name)
+            SELECT id, {search_name('name')} FROM bookings
+        ''')
+
+
+def rebuild_stats(path=DB_PATH):
+    # Полный пересчёт производных таблиц (booking_stats, occupancy и поискового
+    # индекса) одной транзакцией: после правки базы в обход сервера или изменения AGE_BANDS
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        for trigger in ('bookings_stats_insert', 'bookings_stats_delete', 'bookings_stats_update',
+                        'bookings_search_insert', 'bookings_search_delete', 'bookings_search_update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute('DROP TABLE IF EXISTS booking_stats')
+        cursor.execute('DROP TABLE IF EXISTS occupancy')
+        cursor.execute('DROP TABLE IF EXISTS bookings_fts')
+        create_occupancy(cursor)
+        create_stats(cursor)
+        create_search(cursor)
+        cursor.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+def save_attractions(cursor, items):
+    # items: [(id брони, дата, [названия аттракционов])]. Неизвестное название
+    # отклоняет бронь (триггер booking_attractions_known), новых аттракционов здесь не бывает
+    cursor.executemany('''
+        INSERT OR IGNORE INTO booking_attractions (booking_id, attraction_id, date)
+        VALUES (?, (SELECT id FROM attractions WHERE name = ?), ?)
+    ''', [
+        (booking_id, name, booking_date)
+        for booking_id, booking_date, attractions in items
+        for name in dict.fromkeys(attractions)
+    ])
+    cursor.executemany(
+        f'UPDATE bookings SET attractions_key = {attractions_key("bookings")} WHERE id = ?',
+        [(booking_id,) for booking_id in dict.fromkeys(booking_id for booking_id, _, _ in items)]
+    )
+
+
+# Список аттракционов брони одной колонкой: JSON-массив не ломается на запятых
+def attractions_json(alias):
+    return f'''(
+        SELECT json_group_array(name) FROM (
+            SELECT a.name FROM booking_attractions ba
+            JOIN attractions a ON a.id = ba.attraction_id
+            WHERE ba.booking_id = {alias}.id
+            ORDER BY ba.attraction_id
+        )
+    )'''
+
+
+def attractions_key(alias):
+    # Ключ сортировки по аттракционам: та же строка, что показывает клиент
+    return f'''COALESCE((
+        SELECT group_concat(name, ', ') FROM (
+            SELECT a.name FROM booking_attractions ba
+            JOIN attractions a ON a.id = ba.attraction_id
+            WHERE ba.booking_id = {alias}.id
+            ORDER BY ba.attraction_id
+        )
+    ), '')'''
+
+
+def attractions_column(alias):
+    return f'{attractions_json(alias)} AS attractions'
+
+
+def booking_json(alias, fmt):
+    # JSON строки брони собирает сам SQLite: без dict и кодировщика на каждую строку.
+    # columns - массив значений в порядке BOOKING_COLUMNS, имена колонок один раз.
+    values = [f'{alias}.{column}' for column in BOOKING_COLUMNS if column != 'attractions']
+    values.append(f'json({attractions_json(alias)})')
+    if fmt == 'columns':
+        return f"json_array({', '.join(values)})"
+    pairs = ', '.join(f"'{column}', {value}" for column, value in zip(BOOKING_COLUMNS, values))
+    return f'json_object({pairs})'
+
+
+class ConnectionPool:
+    # Долгоживущие соединения вместо sqlite3.connect на каждый запрос.
+    # Стек заранее заполнен None - соединение создаётся при первой выдаче.
+    # Ждущие соединения стоят в очереди Future: освободившееся соединение
+    # отдаётся первому из них, будь то поток или корутина.
+    def __init__(self, path, size, timeout, busy_timeout_ms, mmap_size, synchronous='NORMAL'):
+        self.path = path
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.synchronous = synchronous
+        self._lock = threading.Lock()
+        self._idle = [None] * size
+        self._waiters = deque()
+
+    def _connect(self):
+        # IMMEDIATE: транзакция записи сразу берёт блокировку, ожидая её
+        # по busy_timeout. Отложенная, начав с чтения, при записи другого
+        # процесса получила бы SQLITE_BUSY без ожидания.
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            isolation_level='IMMEDIATE',
+            factory=TimedConnection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), None
+            waiter = Future()
+            self._waiters.append(waiter)
+            return None, waiter
+
+    def _timed_out(self, waiter):
+        # Отменить можно только ещё не обслуженное ожидание, иначе
+        # соединение уже выдано и его нужно забрать
+        if waiter.cancel():
+            raise HTTPException(status_code=503, detail="Database is busy")
+        return waiter.result()
+
+    def _ready(self, conn):
+        if conn is None:
+            try:
+                conn = self._connect()
+            except BaseException:
+                self.release(None)
+                raise
+        return conn
+
+    def acquire(self):
+        started = time.perf_counter()
+        conn, waiter = self._checkout()
+        if waiter is not None:
+            try:
+                conn = waiter.result(self.timeout)
+            except FutureTimeoutError:
+                conn = self._timed_out(waiter)
+        metrics.observe('db_pool_wait_seconds', time.perf_counter() - started)
+        return self._ready(conn)
+
+    async def acquire_async(self):
+        # Ожидание в event loop, а не в потоке threadpool: иначе при
+        # сотнях запросов все потоки ждут соединений, а держащим
+        # соединения запросам не на чем выполниться
+        started = time.perf_counter()
+        conn, waiter = self._checkout()
+        if waiter is not None:
+            try:
+                conn = await asyncio.wait_for(asyncio.wrap_future(waiter), self.timeout)
+            except asyncio.TimeoutError:
+                conn = self._timed_out(waiter)
+            except asyncio.CancelledError:
+                # Клиент ушёл, но соединение могло успеть достаться нам
+                if not waiter.cancel():
+                    self.release(waiter.result())
+                raise
+        metrics.observe('db_pool_wait_seconds', time.perf_counter() - started)
+        return self._ready(conn)
+
+    def release(self, conn):
+        # Незавершённая транзакция не должна достаться следующему запросу
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(conn)
+                    return
+            self._idle.append(conn)
+
+    def idle(self):
+        return len(self._idle)
+
+    def waiting(self):
+        return len(self._waiters)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def run(self, func, *args):
+        with self.connection() as conn:
+            return func(conn, *args)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            if conn is not None:
+                conn.close()
+
+
+def create_pool():
+    return ConnectionPool(DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+                          DB_BUSY_TIMEOUT_MS, DB_MMAP_SIZE, DB_SYNCHRONOUS)
+
+
+async def get_db(request: Request):
+    # Соединение берётся без занятия потока, сам sync-обработчик
+    # выполняется в threadpool как и раньше
+    pool = request.app.state.pool
+    conn = await pool.acquire_async()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+class QueuedDatabase:
+    # Асинхронный доступ к базе. Записи идут через один поток-писатель с очередью
+    # (SQLite всё равно пишет по одному), чтения - через свой пул потоков,
+    # поэтому ожидание SQLite не занимает ни event loop, ни threadpool FastAPI.
+    def __init__(self, pool, readers, batch_size=1, batch_delay=0):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._jobs = queue.Queue()
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix='db-reader')
+        self._writer = threading.Thread(target=self._write_loop, name='db-writer', daemon=True)
+        self._writer.start()
+
+    def _write_loop(self):
+        with self.pool.connection() as conn:
+            while True:
+                jobs = self._take_jobs()
+                stop = jobs[-1] is None
+                if stop:
+                    jobs.pop()
+                if jobs:
+                    self._commit_group(conn, jobs)
+                if stop:
+                    break
+
+    def _take_jobs(self):
+        # Первое задание ждём сколько угодно, следующие - до batch_delay секунд
+        jobs = [self._jobs.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while jobs[-1] is not None and len(jobs) < self.batch_size:
+            try:
+                jobs.append(self._jobs.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return jobs
+
+    def _commit_group(self, conn, jobs):
+        # Одна транзакция на группу, у каждого задания своя точка сохранения:
+        # ошибка откатывает только это задание, остальные фиксируются вместе.
+        # BEGIN явный - иначе первая SAVEPOINT сама открыла бы транзакцию
+        # и её RELEASE зафиксировал бы задание отдельно.
+        outcomes = []
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for func, args, future in jobs:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT write_job')
+                try:
+                    outcomes.append((future, True, func(conn, *args)))
+                except BaseException as e:
+                    conn.execute('ROLLBACK TO write_job')
+                    outcomes.append((future, False, e))
+                conn.execute('RELEASE write_job')
+            conn.commit()
+        except BaseException as e:
+            # Не удалась сама транзакция - не сохранилось ни одно задание
+            log.exception("write group failed", extra={"fields": {"jobs": len(jobs)}})
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, future in jobs:
+                if not future.done() and (future.running() or future.set_running_or_notify_cancel()):
+                    future.set_exception(e)
+            return
+        metrics.observe('db_write_group_seconds', time.perf_counter() - started)
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def write(self, func, *args):
+        # func(conn, *args) выполняется в отдельной транзакции
+        future = Future()
+        self._jobs.put((func, args, future))
+        return await asyncio.wrap_future(future)
+
+    def pending(self):
+        return self._jobs.qsize()
+
+    async def read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self.pool.run, func, *args)
+
+    def close(self):
+        self._jobs.put(None)
+        self._writer.join()
+        self._readers.shutdown()
+
+
+async def get_async_db(request: Request):
+    return request.app.state.db
+
+
+class ChangeNotifier:
+    # Будит подписчиков /bookings/stream после коммита в потоках пула
+    def __init__(self):
+        self.loop = None
+        self.events = set()
+
+    def subscribe(self):
+        event = asyncio.Event()
+        self.events.add(event)
+        return event
+
+    def unsubscribe(self, event):
+        self.events.discard(event)
+
+    def notify(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        for event in self.events:
+            event.set()
+
+
+notifier = ChangeNotifier()
+
+
+class MetricsMiddleware:
+    # Чистый ASGI, а не BaseHTTPMiddleware: тело ответа идёт насквозь, потоки
+    # (SSE, экспорт) не буферизуются. Маршрут - шаблон пути, а не сам путь,
+    # иначе каждый id брони дал бы свой ряд в /metrics.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        metrics.add('http_requests_in_flight', 1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.add('http_requests_in_flight', -1)
+            route = scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            metrics.observe('http_request_duration_seconds', elapsed,
+                            (('method', scope['method']), ('route', path), ('status', status_code)))
+            if elapsed * 1000 >= SLOW_REQUEST_MS:
+                log.warning("slow request", extra={"fields": {
+                    "method": scope['method'], "route": path, "status": status_code,
+                    "duration_ms": round(elapsed * 1000, 1),
+                }})
+
+
+class SamplingProfiler:
+    # Выключен, пока его не запустят через /debug/profiler/start. Поток раз в
+    # interval снимает стеки всех потоков процесса и считает одинаковые;
+    # результат - collapsed stacks для flamegraph.pl или speedscope.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._samples = Counter()
+
+    def start(self, interval, duration):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._samples = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval, duration),
+                                            name='profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        # Возвращает накопленные стеки или None, если профилировщик не запущен
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return None
+        self._stop.set()
+        thread.join()
+        return self._samples
+
+    def _run(self, interval, duration):
+        own = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while not self._stop.wait(interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples[';'.join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # При запуске через python main.py схема уже готова, здесь только проверка
+    init_db()
+    app.state.pool = create_pool()
+    if API_MODE == "async":
+        # Одно соединение пула занимает писатель, остальные - читатели
+        app.state.db = QueuedDatabase(app.state.pool, max(DB_POOL_SIZE - 1, 1),
+                                      WRITE_BATCH_SIZE, WRITE_BATCH_DELAY_MS / 1000)
+    notifier.loop = asyncio.get_running_loop()
+    archive_stop = threading.Event()
+    archiver = asyncio.create_task(archive_loop(app.state.pool, archive_stop)) if ARCHIVE_AFTER_DAYS > 0 else None
+    yield
+    if archiver is not None:
+        # Начатая порция архивации доделывается, следующая уже не начнётся
+        archive_stop.set()
+        archiver.cancel()
+        with suppress(asyncio.CancelledError):
+            await archiver
+    notifier.loop = None
+    if API_MODE == "async":
+        app.state.db.close()
+    app.state.pool.close()
+app = FastAPI(lifespan=lifespan)
+# text/event-stream (/bookings/stream) middleware не сжимает
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+# Добавлен последним - внешний, время запроса включает и сжатие
+app.add_middleware(MetricsMiddleware)
+# Обработчики броней в двух вариантах, подключается один из роутеров по API_MODE
+sync_router = APIRouter()
+async_router = APIRouter()
+security = HTTPBasic()
+bearer = HTTPBearer(auto_error=False)
+optional_basic = HTTPBasic(auto_error=False)
+
+
+class AuthCache:
+    # Недавние успешные проверки bcrypt. Ключ - HMAC от логина и пароля,
+    # так что сам пароль в памяти не остаётся.
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(username, password):
+        return hmac.new(SESSION_SECRET, f'{username}\0{password}'.encode('utf-8'), hashlib.sha256).digest()
+
+    def hit(self, key):
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key):
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+auth_cache = AuthCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+class PageCache:
+    # Сериализованные страницы /bookings по (запрос, версия журнала). Любая
+    # запись двигает версию, так что устаревшая страница просто перестаёт
+    # находиться и вытесняется как самая давно не нужная.
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._entries.get(key)
+            if page is not None:
+                self._entries.move_to_end(key)
+            return page
+
+    def add(self, key, page):
+        with self._lock:
+            self._entries[key] = page
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+page_cache = PageCache(PAGE_CACHE_SIZE)
+
+
+def check_admin_password(credentials):
+    stored_hash = os.getenv("ADMIN_PASSWORD_HASH")
+    if not stored_hash:
+        log.error("ADMIN_PASSWORD_HASH is not set")
+        raise HTTPException(status_code=500, detail="Server configuration error")
+
+    key = auth_cache.key(credentials.username, credentials.password)
+    if auth_cache.hit(key):
+        return True
+    # Проверка хеша - сотни миллисекунд CPU, поэтому результат кэшируется
+    if bcrypt.checkpw(credentials.password.encode('utf-8'), stored_hash.encode('utf-8')):
+        auth_cache.add(key)
+        return True
+    return False
+
+
+def b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def sign(payload):
+    # payload - байты base64, подпись тоже байтами
+    return b64encode(hmac.new(SESSION_SECRET, payload, hashlib.sha256).digest()).encode('ascii')
+
+
+def issue_token(subject):
+    claims = {"sub": subject, "exp": int(time.time()) + AUTH_TOKEN_TTL}
+    payload = b64encode(json.dumps(claims).encode('utf-8'))
+    return f"{payload}.{sign(payload.encode('ascii')).decode('ascii')}"
+
+
+def verify_token(token):
+    # Заголовок приходит любым latin-1: токен с не-ASCII символами - просто
+    # неверный токен (401), а не исключение при кодировании или сравнении
+    try:
+        payload, _, signature = token.encode('ascii').partition(b'.')
+        if not hmac.compare_digest(signature, sign(payload)):
+            return None
+        claims = json.loads(b64decode(payload.decode('ascii')))
+    except (UnicodeError, TypeError, ValueError):
+        return None
+    if claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+
+async def require_admin(
+    token: Optional[HTTPAuthorizationCredentials] = Depends(bearer),
+    credentials: Optional[HTTPBasicCredentials] = Depends(optional_basic),
+):
+    # Обычный путь - токен из /auth/admin (одна проверка HMAC прямо в event loop);
+    # Basic оставлен для скриптов, bcrypt для него уходит в threadpool
+    if token is not None and verify_token(token.credentials) is not None:
+        return
+    if credentials is not None and await run_in_threadpool(check_admin_password, credentials):
+        return
+    raise HTTPException(
+        status_code=401,
+        detail="Invalid or expired token",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+
+def log_change(cursor, op, booking_id=None):
+    # Пишется в той же транзакции, что и само изменение
+    cursor.execute(
+        'INSERT INTO booking_changes (booking_id, op) VALUES (?, ?)',
+        (booking_id, op)
+    )
+    version = cursor.lastrowid
+    if version % 1000 == 0:
+        cursor.execute(
+            'DELETE FROM booking_changes WHERE version <= ?',
+            (version - CHANGE_LOG_SIZE,)
+        )
+    return version
+
+
+def log_changes(cursor, op, booking_ids):
+    cursor.executemany(
+        'INSERT INTO booking_changes (booking_id, op) VALUES (?, ?)',
+        [(booking_id, op) for booking_id in booking_ids]
+    )
+    version = current_version(cursor.connection)
+    cursor.execute(
+        'DELETE FROM booking_changes WHERE version <= ?',
+        (version - CHANGE_LOG_SIZE,)
+    )
+    return version
+
+
+def current_version(conn):
+    row = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'booking_changes'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+class Booking(BaseModel):
+    name: str
+    phone: constr(pattern=r'^\d{10,15}$')  # Только цифры, 10-15 символов
+    age: int
+    date: date
+    attractions: List[str]
+
+    @field_validator('age')
+    def validate_age(cls, v):
+        if v < 14:
+            raise ValueError('Minimum age is 14')
+        return v
+
+
+def booking_row(booking):
+    return (
+        booking.name,
+        booking.phone,
+        booking.age,
+        booking.date.isoformat()
+    )
+
+
+INSERT_BOOKING_SQL = '''
+    INSERT INTO bookings (name, phone, age, date)
+    VALUES (?, ?, ?, ?)
+'''
+INSERT_KEYED_BOOKING_SQL = '''
+    INSERT INTO bookings (name, phone, age, date, idempotency_key)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+'''
+
+
+# Функции ниже не управляют транзакцией - её открывает вызывающий код
+def keyed_booking_id(cursor, idempotency_key):
+    row = cursor.execute('SELECT id FROM bookings WHERE idempotency_key = ?',
+                         (idempotency_key,)).fetchone()
+    return row[0] if row else None
+
+
+def insert_booking(conn, booking, idempotency_key=None):
+    # С ключом повтор того же запроса возвращает id уже созданной брони.
+    # Сначала поиск: конфликт в INSERT тоже тратил бы значение AUTOINCREMENT,
+    # а ON CONFLICT страхует от параллельной вставки того же ключа.
+    cursor = conn.cursor()
+    if idempotency_key is not None:
+        booking_id = keyed_booking_id(cursor, idempotency_key)
+        if booking_id is not None:
+            return booking_id
+    cursor.execute(INSERT_KEYED_BOOKING_SQL, (*booking_row(booking), idempotency_key))
+    if cursor.rowcount == 0:
+        return keyed_booking_id(cursor, idempotency_key)
+    booking_id = cursor.lastrowid
+    save_attractions(cursor, [(booking_id, booking.date.isoformat(), booking.attractions)])
+    log_change(cursor, 'insert', booking_id)
+    return booking_id
+
+
+def replace_booking(conn, booking_id, booking):
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE bookings
+        SET name = ?,
+            phone = ?,
+            age = ?,
+            date = ?
+        WHERE id = ?
+    ''', (*booking_row(booking), booking_id))
+    if cursor.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Бронирование не найдено")
+    # Меняется только разница: оставшийся аттракцион на тот же день триггер
+    # вместимости принял бы за новый, и на переполненном дне (вместимость снизили
+    # после брони) не сохранилась бы даже правка ФИО. Со сменой даты новые все.
+    day = booking.date.isoformat()
+    wanted = dict.fromkeys(booking.attractions)
+    held = cursor.execute('''
+        SELECT ba.attraction_id, a.name, ba.date FROM booking_attractions ba
+        JOIN attractions a ON a.id = ba.attraction_id
+        WHERE ba.booking_id = ?
+    ''', (booking_id,)).fetchall()
+    kept = {name for _, name, held_day in held if held_day == day and name in wanted}
+    cursor.executemany(
+        'DELETE FROM booking_attractions WHERE booking_id = ? AND attraction_id = ?',
+        [(booking_id, attraction_id) for attraction_id, name, held_day in held
+         if held_day != day or name not in wanted]
+    )
+    save_attractions(cursor, [(booking_id, day, [name for name in wanted if name not in kept])])
+    log_change(cursor, 'update', booking_id)
+
+
+def remove_booking(conn, booking_id):
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM bookings WHERE id = ?",
+        (booking_id,)
+    )
+    if cursor.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Бронирование не найдено")
+    log_change(cursor, 'delete', booking_id)
+
+
+def max_booking_id(conn):
+    return conn.execute('SELECT MAX(id) FROM bookings').fetchone()[0] or 0
+
+
+def remove_bookings_chunk(conn, last_id):
+    # Очистка идёт порциями по DELETE_CHUNK_SIZE броней, каждая в своей транзакции:
+    # запись не стоит на всё время удаления, WAL не растёт на размер таблицы.
+    # last_id - последний id на начало очистки, брони новее него остаются.
+    # Возвращает число удалённых броней, 0 - удалять больше нечего.
+    cursor = conn.cursor()
+    upper = cursor.execute(
+        'SELECT MAX(id) FROM (SELECT id FROM bookings WHERE id <= ? ORDER BY id LIMIT ?)',
+        (last_id, DELETE_CHUNK_SIZE)
+    ).fetchone()[0]
+    if upper is None:
+        # Счётчики триггеры довели до нуля, сами строки больше не нужны
+        cursor.execute('DELETE FROM occupancy WHERE booked = 0')
+        cursor.execute('DELETE FROM booking_stats WHERE bookings = 0')
+        return 0
+    # Брони до upper удаляются все, поэтому связи - одним диапазоном, а не каскадом
+    cursor.execute('DELETE FROM booking_attractions WHERE booking_id <= ?', (upper,))
+    cursor.execute('DELETE FROM bookings WHERE id <= ?', (upper,))
+    deleted = cursor.rowcount
+    # Старые записи журнала больше не нужны, клиентам хватит одной 'clear'
+    cursor.execute('DELETE FROM booking_changes')
+    log_change(cursor, 'clear')
+    return deleted
+
+
+# Annotated, а не Header(...) по умолчанию: при прямом вызове функции ключ - None
+IdempotencyKey = Annotated[Optional[str], Header(max_length=IDEMPOTENCY_KEY_MAX_LENGTH)]
+
+
+@sync_router.post("/book")
+def create_booking(booking: Booking, conn=Depends(get_db),
+                   idempotency_key: IdempotencyKey = None):
+    try:
+        with conn:
+            insert_booking(conn, booking, idempotency_key)
+        notifier.notify()
+        return {"status": "ok"}
+    except sqlite3.IntegrityError as e:
+        raise integrity_error(e)
+
+
+@async_router.post("/book")
+async def create_booking_async(booking: Booking, db=Depends(get_async_db),
+                               idempotency_key: IdempotencyKey = None):
+    try:
+        await db.write(insert_booking, booking, idempotency_key)
+    except sqlite3.IntegrityError as e:
+        raise integrity_error(e)
+    notifier.notify()
+    return {"status": "ok"}
+
+
+class KeyedBooking(Booking):
+    idempotency_key: constr(min_length=1, max_length=IDEMPOTENCY_KEY_MAX_LENGTH)
+
+
+def parse_keyed_bookings(items):
+    # Каждая запись проверяется отдельно, ошибка в одной не отклоняет пачку -
+    # даже если это вовсе не объект. Возвращает
+    # ([(индекс, KeyedBooking)], результаты с None на месте валидных)
+    bookings, results = [], []
+    for index, item in enumerate(items):
+        try:
+            bookings.append((index, KeyedBooking.model_validate(item)))
+            results.append(None)
+        except ValidationError as e:
+            key = item.get('idempotency_key') if isinstance(item, dict) else None
+            results.append({"idempotency_key": key, "status": 422, "errors": validation_errors(e)})
+    return bookings, results
+
+
+def insert_keyed_bookings(conn, bookings):
+    # {индекс: результат}; у каждой брони своя точка сохранения, поэтому
+    # нехватка мест откатывает только её
+    cursor = conn.cursor()
+    results = {}
+    for index, booking in bookings:
+        cursor.execute('SAVEPOINT booking_row')
+        try:
+            booking_id = insert_booking(conn, booking, booking.idempotency_key)
+        except sqlite3.IntegrityError as e:
+            cursor.execute('ROLLBACK TO booking_row')
+            error = integrity_error(e)
+            results[index] = {"idempotency_key": booking.idempotency_key,
+                              "status": error.status_code, "detail": error.detail}
+        else:
+            results[index] = {"idempotency_key": booking.idempotency_key,
+                              "status": 200, "id": booking_id}
+        cursor.execute('RELEASE booking_row')
+    return results
+
+
+@sync_router.post("/book/batch")
+def create_bookings(items: List[Any] = Body(..., max_length=BOOK_BATCH_MAX), conn=Depends(get_db)):
+    # Отправка очереди киоска: повтор пачки целиком безопасен благодаря ключам
+    bookings, results = parse_keyed_bookings(items)
+    if bookings:
+        with conn:
+            # Явный BEGIN - иначе первая SAVEPOINT сама станет транзакцией на одну бронь
+            conn.execute('BEGIN IMMEDIATE')
+            inserted = insert_keyed_bookings(conn, bookings)
+        for index, result in inserted.items():
+            results[index] = result
+        notifier.notify()
+    return {"results": results}
+
+
+@async_router.post("/book/batch")
+async def create_bookings_async(items: List[Any] = Body(..., max_length=BOOK_BATCH_MAX),
+                                db=Depends(get_async_db)):
+    bookings, results = parse_keyed_bookings(items)
+    if bookings:
+        inserted = await db.write(insert_keyed_bookings, bookings)
+        for index, result in inserted.items():
+            results[index] = result
+        notifier.notify()
+    return {"results": results}
+
+
+def integrity_error(e):
+    # Нехватка мест - конфликт с текущим состоянием, а не ошибка в данных
+    if CAPACITY_ERROR in str(e):
+        return HTTPException(status_code=409, detail="Нет свободных мест на выбранную дату")
+    if UNKNOWN_ATTRACTION_ERROR in str(e):
+        return HTTPException(status_code=422, detail="Неизвестный аттракцион")
+    return HTTPException(status_code=400, detail=str(e))
+
+
+def insert_chunk(conn, chunk):
+    # chunk: [(номер строки, Booking)]; возвращает (вставлено, ошибки)
+    rows = [booking_row(booking) for _, booking in chunk]
+    try:
+        with conn:
+            cursor = conn.cursor()
+            cursor.executemany(INSERT_BOOKING_SQL, rows)
+            # Транзакция держит блокировку записи, поэтому id идут подряд
+            last_id = conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'bookings'"
+            ).fetchone()[0]
+            booking_ids = range(last_id - len(rows) + 1, last_id + 1)
+            save_attractions(cursor, [
+                (booking_id, booking.date.isoformat(), booking.attractions)
+                for booking_id, (_, booking) in zip(booking_ids, chunk)
+            ])
+            log_changes(cursor, 'insert', booking_ids)
+        return len(rows), []
+    except sqlite3.IntegrityError:
+        pass
+
+    # Пачка не прошла ограничения базы - вставляем построчно, чтобы найти виноватых.
+    # Бронь и её аттракционы откатываются вместе через точку сохранения.
+    inserted, errors = 0, []
+    with conn:
+        # Явный BEGIN - иначе первая SAVEPOINT сама станет транзакцией на одну бронь
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.cursor()
+        for (number, booking), row in zip(chunk, rows):
+            cursor.execute('SAVEPOINT booking_row')
+            try:
+                cursor.execute(INSERT_BOOKING_SQL, row)
+                booking_id = cursor.lastrowid
+                save_attractions(cursor, [(booking_id, row[3], booking.attractions)])
+                log_change(cursor, 'insert', booking_id)
+            except sqlite3.IntegrityError as e:
+                cursor.execute('ROLLBACK TO booking_row')
+                cursor.execute('RELEASE booking_row')
+                errors.append({"row": number, "errors": [{"field": None, "message": integrity_error(e).detail}]})
+                continue
+            cursor.execute('RELEASE booking_row')
+            inserted += 1
+    return inserted, errors
+
+
+def validation_errors(e):
+    return [
+        {"field": ".".join(map(str, error['loc'])) or None, "message": error['msg']}
+        for error in e.errors()
+    ]
+
+
+def decode_line(line):
+    # Строка не в UTF-8 - ошибка этой строки, как и битый JSON, а не всей загрузки
+    try:
+        return line.decode('utf-8-sig').rstrip('\r')
+    except UnicodeDecodeError as e:
+        return e
+
+
+async def body_lines(request):
+    buffer = b''
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b'\n')
+        if lines:
+            yield [decode_line(line) for line in lines]
+    if buffer.strip():
+        yield [decode_line(buffer)]
+
+
+async def ndjson_records(request):
+    async for lines in body_lines(request):
+        records = []
+        for line in lines:
+            if isinstance(line, UnicodeDecodeError):
+                records.append(line)
+                continue
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                records.append(e)
+        yield records
+
+
+async def csv_records(request):
+    # Первая строка - заголовок: name,phone,age,date,attractions;
+    # аттракционы внутри ячейки через запятую, как их показывает админка
+    header = None
+    async for lines in body_lines(request):
+        records = []
+
+        def text_lines():
+            # Ошибка встаёт в records на место своей строки: reader читает лениво
+            for line in lines:
+                if isinstance(line, UnicodeDecodeError):
+                    records.append(line)
+                elif line.strip():
+                    yield line
+
+        for values in csv.reader(text_lines()):
+            if header is None:
+                header = [column.strip() for column in values]
+                continue
+            record = dict(zip(header, values))
+            if isinstance(record.get('attractions'), str):
+                record['attractions'] = [a.strip() for a in record['attractions'].split(',') if a.strip()]
+            records.append(record)
+        yield records
+
+
+async def json_records(request):
+    try:
+        records = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(records, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of bookings")
+    yield records
+
+
+@app.post("/bookings/batch", dependencies=[Depends(require_admin)])
+async def create_bookings_batch(request: Request):
+    content_type = request.headers.get('content-type', '').split(';')[0].strip()
+    if content_type == 'application/json':
+        records = json_records(request)
+    elif content_type in ('application/x-ndjson', 'application/jsonl'):
+        records = ndjson_records(request)
+    elif content_type == 'text/csv':
+        records = csv_records(request)
+    else:
+        raise HTTPException(status_code=415, detail="Use application/json, application/x-ndjson or text/csv")
+
+    pool = request.app.state.pool
+    number, inserted, failed, errors = 0, 0, 0, []
+    chunk = []
+
+    async def flush():
+        nonlocal inserted, failed
+        chunk_inserted, chunk_errors = await run_in_threadpool(pool.run, insert_chunk, chunk[:])
+        chunk.clear()
+        inserted += chunk_inserted
+        failed += len(chunk_errors)
+        errors.extend(chunk_errors[:BATCH_MAX_ERRORS - len(errors)])
+        if chunk_inserted:
+            notifier.notify()
+
+    # Строки вставляются по мере чтения тела, целиком загрузка в памяти не держится
+    async for batch in records:
+        for record in batch:
+            number += 1
+            try:
+                if isinstance(record, UnicodeDecodeError):
+                    raise ValueError(f"Invalid UTF-8: {record}")
+                if isinstance(record, Exception):
+                    raise ValueError(f"Invalid JSON: {record}")
+                if not isinstance(record, dict):
+                    raise ValueError("Expected a JSON object")
+                chunk.append((number, Booking(**record)))
+            except ValidationError as e:
+                failed += 1
+                if len(errors) < BATCH_MAX_ERRORS:
+                    errors.append({"row": number, "errors": validation_errors(e)})
+            except ValueError as e:
+                failed += 1
+                if len(errors) < BATCH_MAX_ERRORS:
+                    errors.append({"row": number, "errors": [{"field": None, "message": str(e)}]})
+            if len(chunk) >= BATCH_CHUNK_SIZE:
+                await flush()
+    if chunk:
+        await flush()
+
+    return {"inserted": inserted, "failed": failed, "errors": errors}
+
+
+def row_to_booking(row):
+    return {
+        "id": row['id'],
+        "name": row['name'],
+        "phone": row['phone'],
+        "age": row['age'],
+        "date": row['date'],
+        "attractions": json.loads(row['attractions'])
+    }
+
+
+def prefix_bounds(prefix):
+    # name LIKE 'abc%' не использует индекс, а диапазон [abc, abd) использует.
+    # Последний символ U+10FFFF не увеличить - переносим на предыдущий; префикс из
+    # одних таких символов сверху не ограничен: любая строка TEXT меньше BLOB.
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return prefix, b''
+    following = ord(stem[-1]) + 1
+    if 0xD800 <= following <= 0xDFFF:
+        # суррогаты в UTF-8 не кодируются, а по байтам за U+D7FF сразу идёт U+E000
+        following = 0xE000
+    return prefix, stem[:-1] + chr(following)
+
+
+async def booking_filters(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    attraction: Optional[str] = None,
+    phone: Optional[str] = None,
+    name: Optional[str] = None,
+):
+    clauses, params = [], []
+    date_clauses, date_params = [], []
+    if date_from:
+        date_clauses.append('date >= ?')
+        date_params.append(date_from.isoformat())
+    if date_to:
+        date_clauses.append('date <= ?')
+        date_params.append(date_to.isoformat())
+    if attraction:
+        # Поиск по индексу (attraction_id, date), диапазон дат - туда же
+        clauses.append(f'''id IN (
+            SELECT booking_id FROM booking_attractions
+            WHERE attraction_id = (SELECT id FROM attractions WHERE name = ?)
+            {''.join(' AND ' + clause for clause in date_clauses)}
+        )''')
+        params.extend((attraction, *date_params))
+    clauses.extend(date_clauses)
+    params.extend(date_params)
+    if phone:
+        clauses.append('phone >= ? AND phone < ?')
+        params.extend(prefix_bounds(phone))
+    if name:
+        clauses.append('name >= ? AND name < ?')
+        params.extend(prefix_bounds(name))
+    return clauses, params
+
+
+def encode_cursor(value, booking_id):
+    raw = json.dumps([value, booking_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def sqlite_integer(value):
+    # SQLite хранит целые в 64 битах, большее число не привязать параметром
+    if not -2 ** 63 <= value < 2 ** 63:
+        raise OverflowError(value)
+    return value
+
+
+def decode_cursor(cursor):
+    try:
+        value, booking_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        # Значение уходит параметром в SQL: список или объект там не привязать
+        if value is not None and not isinstance(value, (str, int, float)):
+            raise ValueError(value)
+        if isinstance(value, int):
+            sqlite_integer(value)
+        return value, sqlite_integer(int(booking_id))
+    except (ValueError, TypeError, OverflowError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def select_bookings(conn, filters, sort, order, limit, cursor, fmt='json'):
+    # Возвращает (версия журнала, тело ответа JSON, курсор следующей страницы)
+    clauses, params = filters
+    column = SORT_KEYS.get(sort, sort)
+    op = '>' if order == 'asc' else '<'
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        if sort == 'id':
+            clauses.append(f'id {op} ?')
+            params.append(last_id)
+        else:
+            clauses.append(f'({column}, id) {op} (?, ?)')
+            params.extend((value, last_id))
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    direction = order.upper()
+    order_by = 'id' if sort == 'id' else f'{column} {direction}, id'
+    # Версию читаем до выборки: изменение между ними клиент просто применит повторно
+    version = current_version(conn)
+    rows = conn.execute(f'''
+        SELECT {booking_json('bookings', fmt)}, id, {column} FROM bookings
+        {where}
+        ORDER BY {order_by} {direction}
+        LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+
+    # Лишняя строка только сообщает, что есть следующая страница
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        _, last_id, last_value = rows[-1]
+        next_cursor = encode_cursor(last_value, last_id)
+    items = ','.join(row[0] for row in rows)
+    if fmt == 'columns':
+        body = f'{{"columns":{json.dumps(BOOKING_COLUMNS)},"rows":[{items}]}}'
+    else:
+        body = f'[{items}]'
+    return version, body.encode('utf-8'), next_cursor
+
+
+def page_etag(key, version):
+    # Слабый валидатор: GZipMiddleware меняет байты, но не содержимое.
+    # Страница зависит и от запроса (фильтры, сортировка, курсор, формат), и
+    # от версии журнала - одной версии мало, иначе 304 получит и другой запрос
+    digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in tags]
+
+
+def bookings_page(conn, filters, sort, order, limit, cursor, fmt, if_none_match):
+    # Страница целиком зависит от запроса и версии журнала: если версия та же,
+    # что у клиента, - 304 без выборки, если страница уже собиралась - из кэша.
+    # Возвращает (версия, тело, курсор, ETag); тело None означает 304.
+    version = current_version(conn)
+    key = (tuple(filters[0]), tuple(filters[1]), sort, order, limit, cursor, fmt)
+    if etag_matches(if_none_match, page_etag(key, version)):
+        return version, None, None, page_etag(key, version)
+    page = page_cache.get((key, version))
+    if page is None:
+        page = select_bookings(conn, filters, sort, order, limit, cursor, fmt)
+        # Версию выборка читает сама: если запись успела между ними, ключ - новая
+        page_cache.add((key, page[0]), page)
+    return (*page, page_etag(key, page[0]))
+
+
+def page_response(page):
+    version, body, next_cursor, etag = page
+    headers = {"X-Change-Version": str(version), "ETag": etag}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(body, media_type="application/json", headers=headers)
+
+
+IfNoneMatch = Annotated[Optional[str], Header()]
+
+
+@sync_router.get("/bookings", dependencies=[Depends(require_admin)])
+def get_bookings(
+    filters=Depends(booking_filters),
+    sort: Literal[SORT_COLUMNS] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+    format: Literal["json", "columns"] = "json",
+    if_none_match: IfNoneMatch = None,
+    conn=Depends(get_db),
+):
+    return page_response(bookings_page(conn, filters, sort, order, limit, cursor, format, if_none_match))
+
+
+@async_router.get("/bookings", dependencies=[Depends(require_admin)])
+async def get_bookings_async(
+    filters=Depends(booking_filters),
+    sort: Literal[SORT_COLUMNS] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+    format: Literal["json", "columns"] = "json",
+    if_none_match: IfNoneMatch = None,
+    db=Depends(get_async_db),
+):
+    page = await db.read(bookings_page, filters, sort, order, limit, cursor, format, if_none_match)
+    return page_response(page)
+
+
+def read_changes(conn, since, limit):
+    latest = current_version(conn)
+    oldest = conn.execute('SELECT MIN(version) FROM booking_changes').fetchone()[0]
+    # Журнал уже обрезан или база пересоздана - клиенту нужна полная перезагрузка
+    if since > latest or (oldest is not None and since < oldest - 1):
+        return {"version": latest, "reset": True, "changes": []}
+
+    rows = conn.execute(f'''
+        SELECT c.version, c.op, c.booking_id,
+               b.id, b.name, b.phone, b.age, b.date, {attractions_column('b')}
+        FROM booking_changes c
+        LEFT JOIN bookings b ON b.id = c.booking_id
+        WHERE c.version > ?
+        ORDER BY c.version
+        LIMIT ?
+    ''', (since, limit)).fetchall()
+
+    return {
+        "version": rows[-1]['version'] if rows else since,
+        "reset": False,
+        "changes": [
+            {
+                "version": row['version'],
+                "op": row['op'],
+                "id": row['booking_id'],
+                "booking": row_to_booking(row) if row['id'] is not None else None
+            }
+            for row in rows
+        ]
+    }
+
+
+@sync_router.get("/bookings/changes", dependencies=[Depends(require_admin)])
+def get_booking_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(PAGE_LIMIT_MAX, ge=1, le=PAGE_LIMIT_MAX),
+    conn=Depends(get_db),
+):
+    return read_changes(conn, since, limit)
+
+
+@async_router.get("/bookings/changes", dependencies=[Depends(require_admin)])
+async def get_booking_changes_async(
+    since: int = Query(0, ge=0),
+    limit: int = Query(PAGE_LIMIT_MAX, ge=1, le=PAGE_LIMIT_MAX),
+    db=Depends(get_async_db),
+):
+    return await db.read(read_changes, since, limit)
+
+
+@app.get("/bookings/stream", dependencies=[Depends(require_admin)])
+async def stream_bookings(request: Request, since: Optional[int] = Query(None, ge=0)):
+    # Server-Sent Events: каждое событие - тот же ответ, что у /bookings/changes
+    pool = request.app.state.pool
+
+    # Соединение берём из пула только на время чтения, а не на всё время потока
+    async def events():
+        version = since if since is not None else await run_in_threadpool(pool.run, current_version)
+        wakeup = notifier.subscribe()
+        try:
+            while not await request.is_disconnected():
+                data = await run_in_threadpool(pool.run, read_changes, version, PAGE_LIMIT_MAX)
+                if data['changes'] or data['reset']:
+                    version = data['version']
+                    yield f"id: {version}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    # Журнал мог не поместиться в одно событие - дочитываем без ожидания
+                    if len(data['changes']) == PAGE_LIMIT_MAX:
+                        continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), STREAM_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                wakeup.clear()
+        finally:
+            notifier.unsubscribe(wakeup)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+def export_chunk(conn, filters, after, fmt):
+    # Порция выгрузки в порядке (date, id) по индексу idx_bookings_date.
+    # Возвращает (текст порции, ключ последней строки; None - строк больше нет)
+    clauses, params = list(filters[0]), list(filters[1])
+    if after:
+        clauses.append('(date, id) > (?, ?)')
+        params.extend(after)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    rows = conn.execute(f'''
+        SELECT {booking_json('bookings', 'json' if fmt == 'ndjson' else 'columns')}, date, id
+        FROM bookings
+        {where}
+        ORDER BY date, id
+        LIMIT ?
+    ''', (*params, EXPORT_CHUNK_SIZE)).fetchall()
+    if not rows:
+        return '', None
+    if fmt == 'ndjson':
+        text = ''.join(f'{row[0]}\n' for row in rows)
+    else:
+        text = csv_text(json.loads(row[0]) for row in rows)
+    return text, (rows[-1][1], rows[-1][2])
+
+
+def csv_text(rows):
+    # rows - значения в порядке BOOKING_COLUMNS, аттракционы списком.
+    # Аттракционы в ячейке через запятую - такой CSV принимает /bookings/batch
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for *values, attractions in rows:
+        writer.writerow((*values, ', '.join(attractions)))
+    return buffer.getvalue()
+
+
+@app.get("/bookings/export", dependencies=[Depends(require_admin)])
+async def export_bookings(
+    request: Request,
+    filters=Depends(booking_filters),
+    format: Literal["csv", "ndjson"] = "csv",
+):
+    # Выгрузка идёт порциями по EXPORT_CHUNK_SIZE строк: память не зависит от
+    # размера таблицы, а соединение пула занято только на чтение порции,
+    # так что медленный клиент не держит ни соединение, ни снимок WAL
+    pool = request.app.state.pool
+
+    async def chunks():
+        if format == 'csv':
+            yield ','.join(BOOKING_COLUMNS) + '\n'
+        after = None
+        while True:
+            text, after = await run_in_threadpool(pool.run, export_chunk, filters, after, format)
+            if after is None:
+                break
+            yield text
+
+    media_type = "text/csv" if format == 'csv' else "application/x-ndjson"
+    return StreamingResponse(
+        chunks(),
+        media_type=f"{media_type}; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="bookings.{format}"'}
+    )
+
+
+def archive_horizon(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def archive_candidates(conn, before):
+    # Самые старые брони по индексу idx_bookings_date, сразу в виде строк архива
+    return conn.execute(f'''
+        SELECT id, date, {booking_json('bookings', 'json')} FROM bookings
+        WHERE date < ?
+        ORDER BY date, id
+        LIMIT ?
+    ''', (before, ARCHIVE_CHUNK_SIZE)).fetchall()
+
+
+def write_archive(rows):
+    # Порция ложится отдельным файлом в папку месяца: файл пишется рядом и
+    # появляется целиком (os.replace), оборванная запись не портит архив.
+    # Имя начинается со времени записи - при чтении более поздняя копия брони побеждает.
+    months = {}
+    for _, booking_date, text in rows:
+        months.setdefault(booking_date[:7], []).append(text)
+    stamp = f'{time.time_ns()}-{rows[0][0]}'
+    for month, lines in months.items():
+        folder = os.path.join(ARCHIVE_DIR, month)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'{stamp}.ndjson.gz')
+        with open(f'{path}.tmp', 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as file:
+                file.write(''.join(f'{line}\n' for line in lines).encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(f'{path}.tmp', path)
+
+
+def delete_archived(conn, rows):
+    # Удаляется только бронь, не изменившаяся после чтения порции. Изменённая
+    # остаётся в базе (следующая порция заархивирует её снова), а её старую
+    # копию в архиве перекрывает живая строка. Возвращает id удалённых.
+    # Строка архива совпала с удалённой бронью, так что её счётчики для /stats
+    # берутся прямо из неё.
+    cursor = conn.cursor()
+    ids, archived = [], []
+    for booking_id, _, text in rows:
+        cursor.execute(
+            f"DELETE FROM bookings WHERE id = ? AND {booking_json('bookings', 'json')} = ?",
+            (booking_id, text)
+        )
+        if cursor.rowcount:
+            ids.append(booking_id)
+            archived.append(json.loads(text))
+    if ids:
+        cursor.executemany('''
+            INSERT INTO archived_stats (date, age, bookings) VALUES (?, ?, 1)
+            ON CONFLICT (date, age) DO UPDATE SET bookings = bookings + 1
+        ''', [(booking['date'], booking['age']) for booking in archived])
+        cursor.executemany('''
+            INSERT INTO archived_occupancy (date, attraction_id, booked)
+            SELECT ?, id, 1 FROM attractions WHERE name = ?
+            ON CONFLICT (date, attraction_id) DO UPDATE SET booked = booked + 1
+        ''', [(booking['date'], name) for booking in archived for name in booking['attractions']])
+        log_changes(cursor, 'delete', ids)
+    return ids
+
+
+def archive_bookings(pool, before, stop=None):
+    # Переносит брони с датой раньше before в архив порциями по ARCHIVE_CHUNK_SIZE:
+    # чтение, файл на диск (fsync), затем короткая транзакция удаления. После
+    # порции - пауза такой же длины, чтобы живые записи успевали взять блокировку.
+    # Второй одновременный запуск (другой воркер, cron) ничего не делает: None.
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archived = 0
+    try:
+        with file_lock(os.path.join(ARCHIVE_DIR, '.lock'), blocking=False):
+            while stop is None or not stop.is_set():
+                started = time.perf_counter()
+                rows = pool.run(archive_candidates, before)
+                if not rows:
+                    break
+                write_archive(rows)
+                with pool.connection() as conn:
+                    with conn:
+                        ids = delete_archived(conn, rows)
+                notifier.notify()
+                archived += len(ids)
+                metrics.add('bookings_archived_total', len(ids))
+                if not ids:
+                    break
+                time.sleep(time.perf_counter() - started)
+    except BlockingIOError:
+        log.debug("archive already running", extra={"fields": {"archive_dir": ARCHIVE_DIR}})
+        return None
+    if archived:
+        log.info("bookings archived", extra={"fields": {"before": before, "bookings": archived}})
+    return archived
+
+
+async def archive_loop(pool, stop):
+    while True:
+        try:
+            await run_in_threadpool(archive_bookings, pool, archive_horizon(ARCHIVE_AFTER_DAYS), stop)
+        except Exception:
+            log.exception("archive failed")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+def archive_months():
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(name for name in os.listdir(ARCHIVE_DIR) if re.fullmatch(r'\d{4}-\d{2}', name))
+
+
+def archive_text(conn, month, bounds, fmt):
+    # Месяц архива целиком в памяти: повторы брони схлопываются по id (последняя
+    # копия), брони, которые есть в базе, пропускаются - живая строка главнее
+    records = {}
+    folder = os.path.join(ARCHIVE_DIR, month)
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.ndjson.gz'):
+            with gzip.open(os.path.join(folder, name), 'rt', encoding='utf-8') as file:
+                for line in file:
+                    record = json.loads(line)
+                    records[record['id']] = record
+    live = {row[0] for row in conn.execute(
+        'SELECT id FROM bookings WHERE id IN (SELECT value FROM json_each(?))',
+        (json.dumps(list(records)),)
+    )}
+    selected = sorted(
+        (record for record in records.values()
+         if bounds[0] <= record['date'] <= bounds[1] and record['id'] not in live),
+        key=lambda record: (record['date'], record['id'])
+    )
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in selected)
+    return csv_text([record[column] for column in BOOKING_COLUMNS] for record in selected)
+
+
+@app.get("/bookings/archive", dependencies=[Depends(require_admin)])
+async def get_archive(
+    request: Request,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    format: Literal["csv", "ndjson"] = "csv",
+):
+    # Архивные брони за диапазон дат в тех же форматах, что и /bookings/export.
+    # Читаются только месяцы диапазона, в памяти - не больше одного месяца.
+    if date_from and date_to and date_to < date_from:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    bounds = (date_from.isoformat() if date_from else '', date_to.isoformat() if date_to else '9999-12-31')
+    months = [month for month in archive_months() if bounds[0][:7] <= month <= bounds[1][:7]]
+    pool = request.app.state.pool
+
+    async def chunks():
+        if format == 'csv':
+            yield ','.join(BOOKING_COLUMNS) + '\n'
+        for month in months:
+            yield await run_in_threadpool(pool.run, archive_text, month, bounds, format)
+
+    media_type = "text/csv" if format == 'csv' else "application/x-ndjson"
+    return StreamingResponse(
+        chunks(),
+        media_type=f"{media_type}; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="archive.{format}"'}
+    )
+
+
+def search_terms(q):
+    # Слова запроса - префиксы ФИО, группы цифр вместе - начало телефона
+    words = re.findall(r'[^\W_]+', q.replace('ё', 'е').replace('Ё', 'Е'))
+    terms = [word for word in words if not word.isdigit()]
+    digits = ''.join(word for word in words if word.isdigit())
+    return terms, digits
+
+
+def phone_prefixes(digits):
+    # Номер набирают и с 8, и с 7, и без кода страны: ищем все три начала
+    national = digits[1:] if digits[0] in '78' and len(digits) > 1 else digits
+    return list(dict.fromkeys((digits, national, '7' + national, '8' + national)))
+
+
+def find_bookings(conn, terms, digits, limit):
+    # Каждый префикс телефона - диапазон по idx_bookings_phone, SQLite объединяет их
+    # (MULTI-INDEX OR). Слова в кавычках: FTS-синтаксис из запроса не разбирается.
+    clauses, params = [], []
+    if digits:
+        prefixes = phone_prefixes(digits)
+        clauses.append('(' + ' OR '.join('b.phone >= ? AND b.phone < ?' for _ in prefixes) + ')')
+        params.extend(bound for prefix in prefixes for bound in prefix_bounds(prefix))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    if terms:
+        # Ранг bm25 считается на каждое совпадение. Слово вроде "Ольга" есть в тысячах
+        # броней, поэтому ранжируются только SEARCH_RANK_WINDOW самых новых из них
+        # (rowid по убыванию индекс отдаёт без сортировки). С телефоном совпадений мало.
+        window = '' if digits else f'ORDER BY rowid DESC LIMIT {SEARCH_RANK_WINDOW}'
+        query = ' '.join(f'"{term}"*' for term in terms)
+        rows = conn.execute(f'''
+            SELECT {booking_json('b', 'json')}
+            FROM (SELECT rowid, rank FROM bookings_fts(?) {window}) AS f
+            JOIN bookings b ON b.id = f.rowid
+            {where}
+            ORDER BY f.rank, b.id DESC
+            LIMIT ?
+        ''', (query, *params, limit)).fetchall()
+    else:
+        rows = conn.execute(f'''
+            SELECT {booking_json('b', 'json')} FROM bookings b
+            {where}
+            ORDER BY b.phone, b.id
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+    return f"[{','.join(row[0] for row in rows)}]".encode('utf-8')
+
+
+@app.get("/bookings/search", dependencies=[Depends(require_admin)])
+def search_bookings(
+    q: str = Query(..., min_length=1, max_length=SEARCH_QUERY_MAX_LENGTH),
+    limit: int = Query(SEARCH_LIMIT_DEFAULT, ge=1, le=SEARCH_LIMIT_MAX),
+    conn=Depends(get_db),
+):
+    # Поиск по мере ввода: ФИО через FTS5, телефон по префиксу.
+    # Запрос без букв и цифр ничего не находит
+    terms, digits = search_terms(q)
+    if not terms and not digits:
+        return Response(b'[]', media_type="application/json")
+    return Response(find_bookings(conn, terms, digits, limit), media_type="application/json")
+
+
+@sync_router.delete("/bookings", dependencies=[Depends(require_admin)])
+def delete_bookings(conn=Depends(get_db)):
+    last_id = max_booking_id(conn)
+    deleted = 0
+    while True:
+        with conn:
+            count = remove_bookings_chunk(conn, last_id)
+        notifier.notify()
+        if not count:
+            break
+        deleted += count
+    return {"message": "All bookings deleted", "deleted": deleted}
+
+
+@async_router.delete("/bookings", dependencies=[Depends(require_admin)])
+async def delete_bookings_async(db=Depends(get_async_db)):
+    # Порции встают в очередь писателя по одной, между ними проходят другие записи
+    last_id = await db.read(max_booking_id)
+    deleted = 0
+    while True:
+        count = await db.write(remove_bookings_chunk, last_id)
+        notifier.notify()
+        if not count:
+            break
+        deleted += count
+    return {"message": "All bookings deleted", "deleted": deleted}
+
+
+@sync_router.delete("/bookings/{booking_id}", dependencies=[Depends(require_admin)])
+def delete_booking_id(booking_id: int, conn=Depends(get_db)):
+    with conn:
+        remove_booking(conn, booking_id)
+    notifier.notify()
+    return {"message": f"Booking {booking_id} deleted"}
+
+
+@async_router.delete("/bookings/{booking_id}", dependencies=[Depends(require_admin)])
+async def delete_booking_id_async(booking_id: int, db=Depends(get_async_db)):
+    await db.write(remove_booking, booking_id)
+    notifier.notify()
+    return {"message": f"Booking {booking_id} deleted"}
+
+
+@sync_router.put("/bookings/{booking_id}", dependencies=[Depends(require_admin)])
+def update_booking(booking_id: int, booking: Booking, conn=Depends(get_db)):
+    try:
+        with conn:
+            replace_booking(conn, booking_id, booking)
+        notifier.notify()
+        return {"status": "updated"}
+    except sqlite3.IntegrityError as e:
+        raise integrity_error(e)
+
+
+@async_router.put("/bookings/{booking_id}", dependencies=[Depends(require_admin)])
+async def update_booking_async(booking_id: int, booking: Booking, db=Depends(get_async_db)):
+    try:
+        await db.write(replace_booking, booking_id, booking)
+    except sqlite3.IntegrityError as e:
+        raise integrity_error(e)
+    notifier.notify()
+    return {"status": "updated"}
+
+
+def date_range(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+@app.get("/availability")
+def get_availability(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    conn=Depends(get_db),
+):
+    # Ответ строится только по occupancy и вместимостям, таблица броней не читается
+    date_from = date_from or date.today()
+    date_to = date_to or date_from + timedelta(days=30)
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (date_to - date_from).days >= AVAILABILITY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {AVAILABILITY_MAX_DAYS} days")
+
+    bounds = (date_from.isoformat(), date_to.isoformat())
+    attractions = conn.execute('SELECT id, name, daily_capacity FROM attractions ORDER BY id').fetchall()
+    booked = {
+        (row['date'], row['attraction_id']): row['booked']
+        for row in conn.execute(
+            'SELECT date, attraction_id, booked FROM occupancy WHERE date BETWEEN ? AND ?', bounds
+        )
+    }
+    capacity = {
+        (row['date'], row['attraction_id']): row['capacity']
+        for row in conn.execute(
+            'SELECT date, attraction_id, capacity FROM attraction_capacity WHERE date BETWEEN ? AND ?', bounds
+        )
+    }
+
+    days = []
+    for day in date_range(date_from, date_to):
+        key = day.isoformat()
+        slots = {}
+        for attraction in attractions:
+            limit = capacity.get((key, attraction['id']), attraction['daily_capacity'])
+            taken = booked.get((key, attraction['id']), 0)
+            slots[attraction['name']] = {
+                "capacity": limit,
+                "booked": taken,
+                "available": None if limit is None else max(limit - taken, 0)
+            }
+        days.append({"date": key, "attractions": slots})
+    return {"from": bounds[0], "to": bounds[1], "days": days}
+
+
+@app.get("/stats", dependencies=[Depends(require_admin)])
+def get_stats(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    conn=Depends(get_db),
+):
+    # Только сводные таблицы: год - это пара тысяч строк booking_stats и occupancy
+    # плюс счётчики заархивированных броней
+    if date_from and date_to and date_to < date_from:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    bounds = (date_from.isoformat() if date_from else '', date_to.isoformat() if date_to else '9999-12-31')
+
+    days = [
+        {"date": row['date'], "bookings": row['bookings']}
+        for row in conn.execute('''
+            SELECT date, SUM(bookings) AS bookings FROM (
+                SELECT date, bookings FROM booking_stats
+                UNION ALL
+                SELECT date, bookings FROM archived_stats
+            )
+            WHERE date BETWEEN ? AND ?
+            GROUP BY date HAVING SUM(bookings) > 0
+            ORDER BY date
+        ''', bounds)
+    ]
+    attractions = [
+        {"name": row['name'], "bookings": row['bookings']}
+        for row in conn.execute('''
+            SELECT a.name, COALESCE(SUM(o.booked), 0) AS bookings
+            FROM attractions a
+            LEFT JOIN (
+                SELECT date, attraction_id, booked FROM occupancy
+                UNION ALL
+                SELECT date, attraction_id, booked FROM archived_occupancy
+            ) o ON o.attraction_id = a.id AND o.date BETWEEN ? AND ?
+            GROUP BY a.id
+            ORDER BY bookings DESC, a.id
+        ''', bounds)
+    ]
+    by_band = dict(conn.execute(f'''
+        SELECT age_band, SUM(bookings) FROM (
+            SELECT date, age_band, bookings FROM booking_stats
+            UNION ALL
+            SELECT date, {age_band('age')}, bookings FROM archived_stats
+        )
+        WHERE date BETWEEN ? AND ?
+        GROUP BY age_band
+    ''', bounds).fetchall())
+    uppers = [f'-{high - 1}' for high in AGE_BANDS[1:]] + ['+']
+    age_bands = [
+        {"band": f'{low}{upper}', "bookings": by_band.get(low, 0)}
+        for low, upper in zip(AGE_BANDS, uppers)
+    ]
+    return {
+        "from": date_from,
+        "to": date_to,
+        "total": sum(day['bookings'] for day in days),
+        "days": days,
+        "attractions": attractions,
+        "age_bands": age_bands,
+    }
+
+
+# Отдельное имя типа: внутри класса поле date с default=None перекрывает datetime.date
+OptionalDate = Optional[date]
+
+
+class Capacity(BaseModel):
+    capacity: Optional[int] = None
+    date: OptionalDate = None
+
+    @field_validator('capacity')
+    def validate_capacity(cls, v):
+        if v is not None and v < 0:
+            raise ValueError('Capacity must not be negative')
+        return v
+
+
+@app.put("/attractions/{name}/capacity", dependencies=[Depends(require_admin)])
+def set_capacity(name: str, capacity: Capacity, conn=Depends(get_db)):
+    # Без даты меняется вместимость по умолчанию (null - без ограничения),
+    # с датой - вместимость на этот день (null убирает исключение)
+    with conn:
+        row = conn.execute('SELECT id FROM attractions WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Аттракцион не найден")
+        if capacity.date is None:
+            conn.execute('UPDATE attractions SET daily_capacity = ? WHERE id = ?', (capacity.capacity, row['id']))
+        elif capacity.capacity is None:
+            conn.execute(
+                'DELETE FROM attraction_capacity WHERE date = ? AND attraction_id = ?',
+                (capacity.date.isoformat(), row['id'])
+            )
+        else:
+            conn.execute('''
+                INSERT INTO attraction_capacity (date, attraction_id, capacity) VALUES (?, ?, ?)
+                ON CONFLICT (date, attraction_id) DO UPDATE SET capacity = excluded.capacity
+            ''', (capacity.date.isoformat(), row['id'], capacity.capacity))
+    return {"status": "ok"}
+
+
+@app.post("/auth/admin")
+def admin_auth(request: Request, credentials: HTTPBasicCredentials = Depends(security)):
+    # В журнал - только исход и адрес клиента, не логин и не пароль
+    client = request.client.host if request.client else None
+    if check_admin_password(credentials):
+        log.info("admin auth succeeded", extra={"fields": {"client": client}})
+        return {"status": "ok", "token": issue_token("admin"), "expires_in": AUTH_TOKEN_TTL}
+
+    log.warning("admin auth failed", extra={"fields": {"client": client}})
+    raise HTTPException(status_code=401, detail="Invalid credentials")
+
+
+def single_worker():
+    # Запрос попадает в случайный воркер: счётчики "прыгали" бы назад, а stop
+    # профайлера доставался бы не тому процессу, что start
+    if WORKERS > 1:
+        raise HTTPException(status_code=409,
+                            detail=f"Per-process endpoint is disabled with {WORKERS} workers; use --workers 1")
+
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(single_worker)])
+def get_metrics(request: Request):
+    # Датчики пула и очереди писателя снимаются в момент опроса
+    pool = request.app.state.pool
+    metrics.set('db_pool_idle_connections', pool.idle())
+    metrics.set('db_pool_waiters', pool.waiting())
+    if API_MODE == "async":
+        metrics.set('db_write_queue_depth', request.app.state.db.pending())
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/debug/profiler/start", dependencies=[Depends(require_admin), Depends(single_worker)])
+def start_profiler(
+    interval_ms: float = Query(PROFILER_INTERVAL_MS, ge=1, le=1000),
+    seconds: float = Query(60, gt=0, le=PROFILER_MAX_SECONDS),
+):
+    if not profiler.start(interval_ms / 1000, seconds):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    log.info("profiler started", extra={"fields": {"interval_ms": interval_ms, "seconds": seconds}})
+    return {"status": "started"}
+
+
+@app.post("/debug/profiler/stop", dependencies=[Depends(require_admin), Depends(single_worker)])
+def stop_profiler():
+    samples = profiler.stop()
+    if samples is None:
+        raise HTTPException(status_code=409, detail="Profiler is not running")
+    log.info("profiler stopped", extra={"fields": {"samples": sum(samples.values())}})
+    body = ''.join(f'{stack} {count}\n' for stack, count in samples.most_common())
+    return Response(body, media_type="text/plain; charset=utf-8")
+
+
+app.include_router(async_router if API_MODE == "async" else sync_router)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сервер бронирований Extreme Park")
+    parser.add_argument("command", nargs="?", choices=["serve", "rebuild-stats", "archive"], default="serve")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="процессов uvicorn, по умолчанию WORKERS или 1; "
+                             "при нескольких /metrics и профайлер отключены")
+    parser.add_argument("--reload", action="store_true",
+                        help="разработка: один процесс, перезапуск при правке кода")
+    parser.add_argument("--archive-after-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="archive: перенести брони старше стольких дней")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Схема - до запуска воркеров, их lifespan только сверит user_version
+    init_db()
+    if args.command == "rebuild-stats":
+        rebuild_stats()
+        log.info("summary tables and search index rebuilt", extra={"fields": {"db": DB_PATH}})
+        sys.exit()
+    if args.command == "archive":
+        # Разовый перенос, например из cron при ARCHIVE_AFTER_DAYS=0 у сервера
+        if args.archive_after_days <= 0:
+            sys.exit("archive: укажите --archive-after-days или ARCHIVE_AFTER_DAYS")
+        pool = create_pool()
+        try:
+            archive_bookings(pool, archive_horizon(args.archive_after_days))
+        finally:
+            pool.close()
+        sys.exit()
+    if not os.getenv("SESSION_SECRET"):
+        # Воркеры наследуют окружение: токен, выданный одним, примут все
+        os.environ["SESSION_SECRET"] = os.urandom(32).hex()
+    workers = 1 if args.reload else max(args.workers, 1)
+    os.environ["WORKERS"] = str(workers)
+    # Сам хеш пароля в журнал не пишется
+    log.info("starting server", extra={"fields": {
+        "api_mode": API_MODE, "db": DB_PATH, "workers": workers, "reload": args.reload,
+        "admin_password_hash_set": bool(os.getenv("ADMIN_PASSWORD_HASH")),
+    }})
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=workers, reload=args.reload)
@@ -1,383 +1,1245 @@
-import tkinter as tk
-from tkinter import messagebox, ttk, simpledialog
-import requests
-from datetime import datetime
-
-SERVER_URL = "http://77.91.77.108:8001"
-ATTRACTIONS = ["Скалодром", "Зиплайн", "Веревочный парк", "Батутный парк"]
-
-
-def show_start_page():
-    start_root.deiconify()
-
-
-# ------------------ Клиентская часть ------------------ (изначально была, сейчас и новые функции есть)
-def show_client_app():
-    start_root.withdraw()
-    client_root = tk.Toplevel()
-    client_root.title("Extreme Park – Бронирование")
-    client_root.geometry("400x500")
-
-    def validate_phone(phone):
-        return phone.isdigit() and 10 <= len(phone) <= 15
-
-    def send_booking():
-        name = entry_name.get().strip()
-        phone = entry_phone.get().replace(' ', '')
-        age = age_var.get()
-        date_str = date_entry.get()
-        selected = [ATTRACTIONS[i] for i in range(len(ATTRACTIONS)) if attr_vars[i].get()]
-
-        errors = []
-        if not name: errors.append("Укажите ФИО")
-        if not validate_phone(phone): errors.append("Телефон: 10-15 цифр")
-        try:
-            age = int(age)
-            if (age < 14 or age > 100): errors.append("Возраст должен быть ≥14 и ты не должен быть слишком старым")
-        except ValueError:
-            errors.append("Некорректный возраст")
-        try:
-            datetime.strptime(date_str, '%Y-%m-%d')
-        except ValueError:
-            errors.append("Дата должна быть ГГГГ-ММ-ДД, я поменял Дмитрий Дмитриевич")
-        if not selected: errors.append("Выберите аттракционы")
-
-        if errors:
-            messagebox.showerror("Ошибки", "\n".join(errors))
-            return
-
-        data = {
-            "name": name,
-            "phone": phone,
-            "age": age,
-            "date": date_str,
-            "attractions": selected
-        }
-
-        try:
-            response = requests.post(f"{SERVER_URL}/book", json=data)
-            if response.status_code == 200:
-                messagebox.showinfo("Успех", "Бронирование принято!")
-                client_root.destroy()
-                show_start_page()
-            else:
-                messagebox.showerror("Ошибка", f"Ошибка: {response.text}")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка подключения: {str(e)}")
-
-    # GUI клиентской части
-    tk.Label(client_root, text="ФИО клиента:").pack()
-    entry_name = tk.Entry(client_root, width=40)
-    entry_name.pack()
-
-    tk.Label(client_root, text="Телефон:").pack()
-    entry_phone = tk.Entry(client_root, width=40)
-    entry_phone.pack()
-
-    tk.Label(client_root, text="Возраст:").pack()
-    age_var = tk.StringVar()
-    entry_age = tk.Entry(client_root, textvariable=age_var, width=10)
-    entry_age.pack()
-
-    tk.Label(client_root, text="Дата посещения (ГГГГ-ММ-ДД):").pack()
-    date_entry = tk.Entry(client_root, width=20)
-    date_entry.insert(0, datetime.now().strftime('%Y-%m-%d'))
-    date_entry.pack()
-
-    tk.Label(client_root, text="Выберите аттракционы:").pack()
-    attr_vars = []
-    for attr in ATTRACTIONS:
-        var = tk.IntVar()
-        attr_vars.append(var)
-        tk.Checkbutton(client_root, text=attr, variable=var).pack(anchor="w")
-
-    tk.Button(client_root, text="Забронировать", command=send_booking,
-              bg="#2e8b57", fg="white").pack(pady=20)
-
-    client_root.protocol("WM_DELETE_WINDOW", lambda: (client_root.destroy(), show_start_page()))
-
-
-# ------------------ Админская часть ------------------
-def show_admin_panel():
-    start_root.withdraw()
-    admin_root = tk.Toplevel()
-    admin_root.title("Extreme Park – Админ панель")
-    admin_root.geometry("1200x600")
-
-    # переменные для хранения состояния сортировки
-    sort_column = tk.StringVar(value="ID")
-    sort_order = tk.BooleanVar(value=True)
-
-    def treeview_sort_column(col, reverse):
-        nonlocal sort_column, sort_order
-
-        sort_column.set(col)
-        sort_order.set(reverse)
-
-        lst = [(tree.set(k, col), k) for k in tree.get_children('')]
-
-        # Сначало число потом дата потом строка
-        try:
-            lst = [(int(a[0]), a[1]) for a in lst]
-        except ValueError:
-            try:
-                lst = [(datetime.strptime(a[0], "%Y-%m-%d"), a[1]) for a in lst]
-            except ValueError:
-                lst = [(a[0].lower(), a[1]) for a in lst]
-
-        lst.sort(reverse=reverse)
-
-        # Перемещаем элементы в отсортированном порядке
-        for index, (val, k) in enumerate(lst):
-            tree.move(k, '', index)
-
-        tree.heading(col, command=lambda: treeview_sort_column(col, not reverse))
-
-        for c in tree["columns"]:
-            tree.heading(c, text=c)
-        tree.heading(col, text=f"{col} {'▼' if reverse else '▲'}")
-
-    def get_bookings():
-        try:
-            response = requests.get(f"{SERVER_URL}/bookings")
-            if response.status_code == 200:
-                update_table(response.json())
-            else:
-                messagebox.showerror("Ошибка", f"Ошибка сервера: {response.status_code}")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка подключения: {str(e)}")
-
-    def delete_booking():
-        selected = tree.selection()
-        if not selected:
-            messagebox.showwarning("Ошибка", "Выберите запись для удаления")
-            return
-
-        booking_id = tree.item(selected[0])['values'][0]
-        if not messagebox.askyesno("Подтверждение", f"Удалить бронирование #{booking_id}?"):
-            return
-
-        try:
-            response = requests.delete(f"{SERVER_URL}/bookings/{booking_id}")
-            if response.status_code == 200:
-                messagebox.showinfo("Успех", "Бронирование удалено!")
-                get_bookings()
-            else:
-                messagebox.showerror("Ошибка", f"Ошибка сервера: {response.text}")
-        except Exception as e:
-            messagebox.showerror("Ошибка подключения", str(e))
-
-    def clear_bookings():
-        if messagebox.askyesno("Подтверждение", "Удалить ВСЕ бронирования?"):
-            try:
-                response = requests.delete(f"{SERVER_URL}/bookings")
-                if response.status_code == 200:
-                    messagebox.showinfo("Успех", "Все бронирования удалены!")
-                    update_table([])
-                else:
-                    messagebox.showerror("Ошибка", f"Ошибка: {response.text}")
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка подключения: {str(e)}")
-
-    def edit_booking():
-        selected = tree.selection()
-        if not selected:
-            messagebox.showwarning("Ошибка", "Выберите запись для редактирования")
-            return
-
-        item = tree.item(selected[0])
-        values = item['values']
-        booking_id = values[0]
-
-        edit_window = tk.Toplevel(admin_root)
-        edit_window.title("Редактирование бронирования")
-        edit_window.geometry("400x500")
-
-        # Поля ввода
-        tk.Label(edit_window, text="ФИО:").pack()
-        name_entry = tk.Entry(edit_window)
-        name_entry.insert(0, values[1])
-        name_entry.pack()
-
-        tk.Label(edit_window, text="Телефон:").pack()
-        phone_entry = tk.Entry(edit_window)
-        phone_entry.insert(0, values[2])
-        phone_entry.pack()
-
-        tk.Label(edit_window, text="Возраст:").pack()
-        age_entry = tk.Entry(edit_window)
-        age_entry.insert(0, values[3])
-        age_entry.pack()
-
-        tk.Label(edit_window, text="Дата (ГГГГ-ММ-ДД):").pack()
-        date_entry = tk.Entry(edit_window)
-        date_entry.insert(0, values[4])
-        date_entry.pack()
-
-        tk.Label(edit_window, text="Аттракционы:").pack()
-        attr_vars = []
-        for i, attr in enumerate(ATTRACTIONS):
-            var = tk.IntVar(value=1 if attr in values[5] else 0)
-            attr_vars.append(var)
-            tk.Checkbutton(edit_window, text=attr, variable=var).pack(anchor="w")
-
-        def save_changes():
-            data = {
-                "name": name_entry.get(),
-                "phone": phone_entry.get(),
-                "age": age_entry.get(),
-                "date": date_entry.get(),
-                "attractions": [ATTRACTIONS[i] for i in range(len(ATTRACTIONS)) if attr_vars[i].get()]
-            }
-
-            errors = []
-            if not data['phone'].isdigit() or len(data['phone']) not in range(10, 16):
-                errors.append("Телефон должен содержать 10-15 цифр")
-            try:
-                data['age'] = int(data['age'])
-                if (data['age'] < 14 or data['age'] > 100): errors.append("Возраст должен быть ≥14 и ты не должен быть слишком старым")
-            except ValueError:
-                errors.append("Некорректный возраст")
-            try:
-                datetime.strptime(data['date'], '%Y-%m-%d')
-            except ValueError:
-                errors.append("Дата должна быть ГГГГ-ММ-ДД")
-            if not data['name']: errors.append("Укажите ФИО")
-            if not data['attractions']: errors.append("Выберите аттракционы")
-
-            if errors:
-                messagebox.showerror("Ошибки", "\n".join(errors))
-                return
-
-            try:
-                response = requests.put(
-                    f"{SERVER_URL}/bookings/{booking_id}",
-                    json=data
-                )
-                if response.status_code == 200:
-                    messagebox.showinfo("Успех", "Изменения сохранены")
-                    edit_window.destroy()
-                    get_bookings()
-                else:
-                    messagebox.showerror("Ошибка", f"Ошибка сервера: {response.text}")
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка подключения: {str(e)}")
-
-        tk.Button(edit_window, text="Сохранить", command=save_changes, bg="#4CAF50", fg="white").pack(pady=20)
-
-    def update_table(bookings):
-        tree.delete(*tree.get_children())
-        for booking in bookings:
-            tree.insert("", "end", values=(
-                booking['id'],
-                booking['name'],
-                booking['phone'],
-                booking['age'],
-                booking['date'],
-                ", ".join(booking['attractions'])
-            ))
-        # Применяем последнюю активную сортировку
-        if sort_column.get():
-            treeview_sort_column(sort_column.get(), sort_order.get())
-
-    def auto_refresh():
-        try:
-            get_bookings()
-        finally:
-            admin_root.after(10000, auto_refresh)
-
-    # GUI админской части
-    tree = ttk.Treeview(admin_root, columns=("ID", "ФИО", "Телефон", "Возраст", "Дата", "Аттракционы"), show="headings")
-
-    for col in ("ID", "ФИО", "Телефон", "Возраст", "Дата", "Аттракционы"):
-        tree.heading(col, text=col,
-                     command=lambda c=col: treeview_sort_column(c, False))
-        tree.column(col, width=100 if col == "ID" else 150, anchor='center' if col in ("ID", "Возраст") else 'w')
-
-    tree.column("ID", width=50, anchor='center')
-    tree.column("ФИО", width=150)
-    tree.column("Телефон", width=120)
-    tree.column("Возраст", width=60, anchor='center')
-    tree.column("Дата", width=100)
-    tree.column("Аттракционы", width=300)
-
-    tree.pack(fill="both", expand=True, padx=10, pady=10)
-
-    btn_frame = tk.Frame(admin_root)
-    btn_frame.pack(pady=10)
-
-    tk.Button(btn_frame, text="Обновить", command=get_bookings,
-              bg="#2196F3", fg="white").pack(side="left", padx=5)
-    tk.Button(btn_frame, text="Редактировать", command=edit_booking,
-              bg="#FF9800", fg="white").pack(side="left", padx=5)
-    tk.Button(btn_frame, text="Удалить", command=delete_booking,
-              bg="#e74c3c", fg="white").pack(side="left", padx=5)
-    tk.Button(btn_frame, text="Очистить все", command=clear_bookings,
-              bg="#F44336", fg="white").pack(side="left", padx=5)
-
-    auto_refresh()
-    admin_root.protocol("WM_DELETE_WINDOW", lambda: (admin_root.destroy(), show_start_page()))
-
-
-# ------------------ Стартовая страница ------------------
-def check_admin_password():
-    password = simpledialog.askstring("Пароль админа", "Введите пароль:",
-                                      show='*',
-                                      parent=start_root)
-    if not password:
-        return
-
-    try:
-        response = requests.post(
-            f"{SERVER_URL}/auth/admin",
-            auth=('admin', password),
-            timeout=5
-        )
-
-        print(f"Response status: {response.status_code}")
-        print(f"Response content: {response.text}")
-
-        if response.status_code == 200:
-            messagebox.showinfo("Успех", "Авторизация прошла успешно!")
-            show_admin_panel()
-        else:
-            error_msg = response.json().get('detail', 'Неизвестная ошибка')
-            messagebox.showerror("Ошибка", f"{error_msg} (код {response.status_code})")
-
-    except requests.exceptions.RequestException as e:
-        messagebox.showerror("Ошибка", f"Ошибка подключения: {str(e)}")
-    except Exception as e:
-        messagebox.showerror("Критическая ошибка", str(e))
-
-# Создание основного окна
-start_root = tk.Tk()
-start_root.title("Extreme Park – Выбор роли")
-start_root.geometry("400x350")
-start_root.configure(bg="#f0f2f5")
-
-style = ttk.Style()
-style.configure("Primary.TButton", font=('Helvetica', 12), padding=10,
-                foreground="#000000", background="#2e8b57")
-style.configure("Secondary.TButton", font=('Helvetica', 12), padding=10,
-                foreground="#000000", background="#4682b4")
-
-main_frame = tk.Frame(start_root, bg="#f0f2f5")
-main_frame.pack(expand=True, fill="both", padx=40, pady=40)
-
-tk.Label(main_frame, text="🏞️ Extreme Park", font=("Helvetica", 20, "bold"),
-         bg="#f0f2f5", fg="#2d3436").pack(pady=(0, 30))
-tk.Label(main_frame, text="Выберите тип входа:", font=("Helvetica", 12),
-         bg="#f0f2f5", fg="#636e72").pack()
-
-btn_frame = tk.Frame(main_frame, bg="#f0f2f5")
-btn_frame.pack(pady=20)
-
-ttk.Button(btn_frame, text="  Клиент  ", style="Primary.TButton",
-           command=show_client_app).pack(pady=10, ipadx=20)
-ttk.Button(btn_frame, text="  Администратор  ", style="Secondary.TButton",
-           command=check_admin_password).pack(pady=10, ipadx=20)
-
-tk.Label(main_frame, text="© 2024 Extreme Park System",
-         font=("Helvetica", 9), bg="#f0f2f5", fg="#636e72").pack(side="bottom", pady=10)
-
+import tkinter as tk
+from tkinter import filedialog, messagebox, ttk, simpledialog
+import requests
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SERVER_URL = os.getenv("SERVER_URL", "http://77.91.77.108:8001").rstrip("/")
+# (подключение, чтение) в секундах
+HTTP_TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+                float(os.getenv("HTTP_READ_TIMEOUT", "15")))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_WORKERS = 4
+# Брони, не ушедшие на сервер сразу, ждут в локальной базе и отправляются пачками
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+OUTBOX_SYNC_INTERVAL = 10
+OUTBOX_BATCH_SIZE = 100
+ATTRACTIONS = ["Скалодром", "Зиплайн", "Веревочный парк", "Батутный парк"]
+PAGE_SIZE = 100
+# В таблице только видимые строки; следующая страница запрашивается, когда
+# до конца загруженного остаётся меньше FETCH_AHEAD строк
+FETCH_AHEAD = 50
+CHANGES_LIMIT = 1000
+# Сервер шлёт keep-alive каждые 5 секунд, дольше тишины - соединение потеряно
+STREAM_READ_TIMEOUT = 30
+STREAM_RETRY_DELAY = 5
+# Ширина полосы-гистограммы на вкладке статистики, в символах
+STATS_BAR_WIDTH = 30
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Поиск по мере ввода уходит на сервер, когда ввод замер на столько миллисекунд
+SEARCH_DEBOUNCE_MS = 300
+SEARCH_LIMIT = 50
+
+# Токен из /auth/admin; с ним админские запросы не гоняют bcrypt на сервере
+admin_token = None
+# Закрывает открытую админ-панель; ставит show_admin_panel
+close_admin_panel = None
+
+
+def admin_headers():
+    return {"Authorization": f"Bearer {admin_token}"}
+
+
+def token_rejected(response):
+    # 401 на запрос с токеном - истёк срок (AUTH_TOKEN_TTL на сервере).
+    # 401 на вход по паролю сюда не попадает: там Basic, а не Bearer.
+    return (response.status_code == 401 and
+            response.request.headers.get("Authorization", "").startswith("Bearer "))
+
+
+def session_expired():
+    # Ответы, пришедшие после первого 401, уже ничего не меняют
+    global admin_token
+    if admin_token is None:
+        return
+    admin_token = None
+    close_admin_panel()
+    messagebox.showwarning("Сессия истекла", "Сессия администратора истекла, войдите заново.")
+    check_admin_password()
+
+
+def create_session():
+    # Один Session на приложение - соединения с сервером переиспользуются.
+    # Повторы с нарастающей паузой только для идемпотентных GET/PUT/DELETE:
+    # повтор POST /book после потерянного ответа создал бы вторую бронь.
+    retry = Retry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF,
+                  status_forcelist=(502, 503, 504), raise_on_status=False)
+    # +1 соединение на поток /bookings/stream
+    adapter = HTTPAdapter(pool_maxsize=HTTP_WORKERS + 1, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    return session
+
+
+session = create_session()
+# Запросы выполняются здесь, чтобы медленный сервер не замораживал окно
+http_pool = ThreadPoolExecutor(HTTP_WORKERS, thread_name_prefix="http")
+
+
+def api_request(method, path, **kwargs):
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return session.request(method, f"{SERVER_URL}{path}", **kwargs)
+
+
+def show_connection_error(error):
+    messagebox.showerror("Ошибка", f"Ошибка подключения: {str(error)}")
+
+
+def download(path, target, **kwargs):
+    # Ответ пишется на диск по частям и целиком в памяти не держится.
+    # До конца выгрузки файл лежит под временным именем - обрыв не оставит полуфайла.
+    partial = target + ".part"
+    with api_request("GET", path, stream=True, **kwargs) as response:
+        if response.status_code != 200:
+            # тело ошибки читаем, пока соединение открыто
+            response.content
+            return response
+        try:
+            with open(partial, "wb") as file:
+                for chunk in response.iter_content(EXPORT_CHUNK_BYTES):
+                    file.write(chunk)
+            os.replace(partial, target)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+    return response
+
+
+def run_async(widget, on_response, func, *args, on_error=show_connection_error, **kwargs):
+    # func уходит в пул потоков; on_response(результат) или on_error(исключение)
+    # вызываются уже в потоке Tk через after. Если окно закрыто - ответ не нужен.
+    def deliver(future):
+        if not widget.winfo_exists():
+            return
+        try:
+            response = future.result()
+        except Exception as e:
+            on_error(e)
+            return
+        if token_rejected(response):
+            session_expired()
+            return
+        on_response(response)
+
+    def done(future):
+        try:
+            widget.after(0, deliver, future)
+        except (RuntimeError, tk.TclError):
+            pass
+
+    http_pool.submit(func, *args, **kwargs).add_done_callback(done)
+
+
+def request_async(widget, on_response, method, path, on_error=show_connection_error, **kwargs):
+    run_async(widget, on_response, api_request, method, path, on_error=on_error, **kwargs)
+
+
+class Outbox:
+    # Очередь неотправленных броней в SQLite: переживает и обрыв связи, и
+    # перезапуск киоска. Ключ записи уходит на сервер как ключ идемпотентности,
+    # поэтому повторная отправка не создаёт дублей. Отклонённые сервером брони
+    # (нет мест, ошибка в данных) остаются с текстом ошибки и больше не шлются -
+    # оператор видит их на стартовой странице и удаляет вручную.
+    # Работает только из потока Tk.
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL,
+                error TEXT
+            )
+        ''')
+
+    def add(self, booking):
+        key = uuid.uuid4().hex
+        with self.conn:
+            self.conn.execute('INSERT INTO outbox (key, payload, created) VALUES (?, ?, ?)',
+                              (key, json.dumps(booking, ensure_ascii=False), time.time()))
+        return key
+
+    def pending(self, limit):
+        rows = self.conn.execute(
+            'SELECT key, payload FROM outbox WHERE error IS NULL ORDER BY created LIMIT ?', (limit,)
+        ).fetchall()
+        return [(key, json.loads(payload)) for key, payload in rows]
+
+    def remove(self, keys):
+        with self.conn:
+            self.conn.executemany('DELETE FROM outbox WHERE key = ?', [(key,) for key in keys])
+
+    def reject(self, key, error):
+        with self.conn:
+            self.conn.execute('UPDATE outbox SET error = ? WHERE key = ?', (error, key))
+
+    def rejected(self):
+        rows = self.conn.execute(
+            'SELECT key, payload, error FROM outbox WHERE error IS NOT NULL ORDER BY created'
+        ).fetchall()
+        return [(key, json.loads(payload), error) for key, payload, error in rows]
+
+
+outbox = Outbox(OUTBOX_PATH)
+outbox_syncing = False
+
+
+def sync_outbox():
+    start_root.after(OUTBOX_SYNC_INTERVAL * 1000, sync_outbox)
+    flush_outbox()
+
+
+def flush_outbox():
+    # Одна пачка за запрос; полная пачка - сразу следующая, не дожидаясь таймера
+    global outbox_syncing
+    if outbox_syncing:
+        return
+    batch = outbox.pending(OUTBOX_BATCH_SIZE)
+    if not batch:
+        return
+    outbox_syncing = True
+
+    def on_response(response):
+        global outbox_syncing
+        outbox_syncing = False
+        if response.status_code != 200:
+            return
+        results = response.json()['results']
+        outbox.remove([result['idempotency_key'] for result in results if result['status'] == 200])
+        rejected = [result for result in results if result['status'] != 200]
+        for result in rejected:
+            error = result.get('detail') or json.dumps(result.get('errors'), ensure_ascii=False)
+            outbox.reject(result['idempotency_key'], error)
+        if rejected:
+            update_rejected_button()
+        if len(batch) == OUTBOX_BATCH_SIZE:
+            flush_outbox()
+
+    def on_error(error):
+        # Связи всё ещё нет - попробуем по таймеру
+        global outbox_syncing
+        outbox_syncing = False
+
+    request_async(start_root, on_response, "POST", "/book/batch", on_error=on_error,
+                  json=[{**booking, "idempotency_key": key} for key, booking in batch])
+
+
+# Колонка таблицы -> поле сортировки на сервере
+SORT_FIELDS = {
+    "ID": "id",
+    "ФИО": "name",
+    "Телефон": "phone",
+    "Возраст": "age",
+    "Дата": "date",
+    "Аттракционы": "attractions",
+}
+
+
+class BookingTable:
+    # Загруженные брони по колонкам: номер строки -> значения в массивах.
+    # Числа и даты (порядковый номер дня) лежат в array, без объектов на ячейку.
+    # Для колонки кэшируется перестановка номеров строк по (значение, id);
+    # обратный порядок - та же перестановка с конца, как и на сервере.
+    def __init__(self):
+        self.columns = {
+            "id": array('q'),
+            "name": [],
+            "phone": [],
+            "age": array('q'),
+            "date": array('l'),
+            # строкой "a, b", как в ячейке; сервер сортирует по той же строке
+            "attractions": [],
+        }
+        self.rows = {}
+        self.free = []
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, booking_id):
+        return booking_id in self.rows
+
+    def clear(self):
+        self.__init__()
+
+    def _key(self, column):
+        values, ids = self.columns[column], self.columns["id"]
+        return lambda row: (values[row], ids[row])
+
+    def order(self, column):
+        order = self._orders.get(column)
+        if order is None:
+            # Две устойчивые сортировки по C-ключам быстрее ключа-кортежа
+            order = sorted(self.rows.values(), key=self.columns["id"].__getitem__)
+            if column != "id":
+                order.sort(key=self.columns[column].__getitem__)
+            self._orders[column] = order
+        return order
+
+    def add(self, booking):
+        # Новая или изменённая бронь; кэшированные порядки правятся точечно
+        self.remove(booking['id'])
+        values = (booking['id'], booking['name'], booking['phone'], booking['age'],
+                  date.fromisoformat(booking['date']).toordinal(), ", ".join(booking['attractions']))
+        if self.free:
+            row = self.free.pop()
+            for column, value in zip(self.columns.values(), values):
+                column[row] = value
+        else:
+            row = len(self.columns["id"])
+            for column, value in zip(self.columns.values(), values):
+                column.append(value)
+        self.rows[booking['id']] = row
+        for column, order in self._orders.items():
+            insort(order, row, key=self._key(column))
+
+    def extend(self, bookings):
+        for booking in bookings:
+            self.add(booking)
+
+    def remove(self, booking_id):
+        row = self.rows.pop(booking_id, None)
+        if row is None:
+            return
+        # Ключ (значение, id) уникален - позицию находит двоичный поиск
+        for column, order in self._orders.items():
+            key = self._key(column)
+            del order[bisect_left(order, key(row), key=key)]
+        self.free.append(row)
+
+    def position(self, column, descending, booking_id):
+        row = self.rows.get(booking_id)
+        if row is None:
+            return None
+        order = self.order(column)
+        key = self._key(column)
+        index = bisect_left(order, key(row), key=key)
+        return len(order) - 1 - index if descending else index
+
+    def window(self, column, descending, start, count):
+        # Значения колонок для строк start..start+count в заданном порядке
+        order = self.order(column)
+        if descending:
+            end = len(order) - start
+            rows = order[max(end - count, 0):end][::-1]
+        else:
+            rows = order[start:start + count]
+        return [self.values(row) for row in rows]
+
+    def values(self, row):
+        columns = self.columns
+        return (
+            columns["id"][row],
+            columns["name"][row],
+            columns["phone"][row],
+            columns["age"][row],
+            date.fromordinal(columns["date"][row]).isoformat(),
+            columns["attractions"][row]
+        )
+
+
+def show_start_page():
+    start_root.deiconify()
+
+
+def update_rejected_button():
+    count = len(outbox.rejected())
+    if count:
+        btn_rejected.config(text=f"⚠ Не принято сервером: {count}")
+        btn_rejected.pack(pady=(0, 10))
+    else:
+        btn_rejected.pack_forget()
+
+
+def show_rejected_bookings():
+    # Брони из очереди, которые сервер отклонил: их уже не отправить как есть
+    window = tk.Toplevel(start_root)
+    window.title("Не принятые сервером брони")
+    window.geometry("900x300")
+
+    columns = ("ФИО", "Телефон", "Дата", "Аттракционы", "Ошибка")
+    tree = ttk.Treeview(window, columns=columns, show="headings")
+    for col in columns:
+        tree.heading(col, text=col)
+        tree.column(col, width=120)
+    tree.column("Ошибка", width=300)
+    tree.pack(expand=True, fill="both")
+
+    def fill():
+        tree.delete(*tree.get_children())
+        for key, booking, error in outbox.rejected():
+            tree.insert("", "end", iid=key, values=(
+                booking["name"], booking["phone"], booking["date"],
+                ", ".join(booking["attractions"]), error
+            ))
+
+    def remove(keys):
+        if not keys:
+            return
+        if not messagebox.askyesno("Подтверждение", f"Удалить броней: {len(keys)}?", parent=window):
+            return
+        outbox.remove(keys)
+        update_rejected_button()
+        fill()
+
+    btn_frame = tk.Frame(window)
+    btn_frame.pack(pady=5)
+    tk.Button(btn_frame, text="Удалить выбранные",
+              command=lambda: remove(list(tree.selection()))).pack(side="left", padx=5)
+    tk.Button(btn_frame, text="Удалить все",
+              command=lambda: remove(list(tree.get_children()))).pack(side="left", padx=5)
+
+    fill()
+
+
+# ------------------ Клиентская часть ------------------ (изначально была, сейчас и новые функции есть)
+def show_client_app():
+    start_root.withdraw()
+    client_root = tk.Toplevel()
+    client_root.title("Extreme Park – Бронирование")
+    client_root.geometry("400x500")
+
+    def validate_phone(phone):
+        return phone.isdigit() and 10 <= len(phone) <= 15
+
+    def send_booking():
+        name = entry_name.get().strip()
+        phone = entry_phone.get().replace(' ', '')
+        age = age_var.get()
+        date_str = date_entry.get()
+        selected = [ATTRACTIONS[i] for i in range(len(ATTRACTIONS)) if attr_vars[i].get()]
+
+        errors = []
+        if not name: errors.append("Укажите ФИО")
+        if not validate_phone(phone): errors.append("Телефон: 10-15 цифр")
+        try:
+            age = int(age)
+            if (age < 14 or age > 100): errors.append("Возраст должен быть ≥14 и ты не должен быть слишком старым")
+        except ValueError:
+            errors.append("Некорректный возраст")
+        try:
+            datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError:
+            errors.append("Дата должна быть ГГГГ-ММ-ДД, я поменял Дмитрий Дмитриевич")
+        if not selected: errors.append("Выберите аттракционы")
+
+        if errors:
+            messagebox.showerror("Ошибки", "\n".join(errors))
+            return
+
+        data = {
+            "name": name,
+            "phone": phone,
+            "age": age,
+            "date": date_str,
+            "attractions": selected
+        }
+
+        # Сначала на диск: бронь не потеряется, даже если упадёт связь или киоск
+        key = outbox.add(data)
+
+        def on_response(response):
+            if response.status_code == 200:
+                outbox.remove([key])
+                messagebox.showinfo("Успех", "Бронирование принято!")
+                client_root.destroy()
+                show_start_page()
+            elif response.status_code >= 500:
+                saved_offline()
+            else:
+                # Сервер отклонил бронь - клиент ещё у киоска и может её исправить
+                outbox.remove([key])
+                btn_book.config(state="normal")
+                messagebox.showerror("Ошибка", f"Ошибка: {response.text}")
+
+        def saved_offline(error=None):
+            messagebox.showinfo("Бронирование сохранено",
+                                "Нет связи с сервером. Бронирование сохранено "
+                                "и будет отправлено автоматически.")
+            client_root.destroy()
+            show_start_page()
+
+        # Окно не ждёт ответа, поэтому не даём отправить бронь второй раз
+        btn_book.config(state="disabled")
+        request_async(client_root, on_response, "POST", "/book", on_error=saved_offline,
+                      json=data, headers={"Idempotency-Key": key})
+
+    # GUI клиентской части
+    tk.Label(client_root, text="ФИО клиента:").pack()
+    entry_name = tk.Entry(client_root, width=40)
+    entry_name.pack()
+
+    tk.Label(client_root, text="Телефон:").pack()
+    entry_phone = tk.Entry(client_root, width=40)
+    entry_phone.pack()
+
+    tk.Label(client_root, text="Возраст:").pack()
+    age_var = tk.StringVar()
+    entry_age = tk.Entry(client_root, textvariable=age_var, width=10)
+    entry_age.pack()
+
+    tk.Label(client_root, text="Дата посещения (ГГГГ-ММ-ДД):").pack()
+    date_entry = tk.Entry(client_root, width=20)
+    date_entry.insert(0, datetime.now().strftime('%Y-%m-%d'))
+    date_entry.pack()
+
+    tk.Label(client_root, text="Выберите аттракционы:").pack()
+    attr_vars = []
+    for attr in ATTRACTIONS:
+        var = tk.IntVar()
+        attr_vars.append(var)
+        tk.Checkbutton(client_root, text=attr, variable=var).pack(anchor="w")
+
+    btn_book = tk.Button(client_root, text="Забронировать", command=send_booking,
+                         bg="#2e8b57", fg="white")
+    btn_book.pack(pady=20)
+
+    client_root.protocol("WM_DELETE_WINDOW", lambda: (client_root.destroy(), show_start_page()))
+
+
+# ------------------ Админская часть ------------------
+def show_admin_panel():
+    global close_admin_panel
+    start_root.withdraw()
+    admin_root = tk.Toplevel()
+    admin_root.title("Extreme Park – Админ панель")
+    admin_root.geometry("1200x600")
+
+    # переменные для хранения состояния сортировки
+    sort_column = tk.StringVar(value="ID")
+    sort_order = tk.BooleanVar(value=True)
+
+    columns = ("ID", "ФИО", "Телефон", "Возраст", "Дата", "Аттракционы")
+    # Загруженные брони; в Treeview живут только видимые из них,
+    # начиная с позиции top в текущем порядке сортировки
+    table = BookingTable()
+    top = 0
+    visible_rows = 20
+    selected_id = None
+    # курсор keyset-пагинации для подгрузки следующей страницы
+    next_cursor = None
+    # номер загрузки с начала: ответы на более старые запросы отбрасываются
+    generation = 0
+    loading = False
+    # последняя применённая версия журнала изменений на сервере
+    change_version = 0
+    # (параметры, ETag) первой страницы, которую показывает таблица
+    loaded_page = (None, None)
+    # отложенный запрос поиска и номер последнего: устаревшие ответы не показываем
+    search_job = None
+    search_generation = 0
+    search_results = {}
+    # поток /bookings/stream; пока он жив, опрос раз в 10 секунд не нужен
+    stream_connected = threading.Event()
+    stream_stop = threading.Event()
+
+    def view():
+        # (колонка модели, по убыванию) для текущей сортировки
+        return SORT_FIELDS[sort_column.get()], sort_order.get()
+
+    def treeview_sort_column(col, reverse):
+        nonlocal top
+        sort_column.set(col)
+        sort_order.set(reverse)
+        if next_cursor is None:
+            # Загружено всё - порядок даёт кэшированная перестановка модели
+            top = 0
+            render()
+        else:
+            # Порядок незагруженных строк знает только сервер
+            get_bookings()
+
+        tree.heading(col, command=lambda: treeview_sort_column(col, not reverse))
+
+        for c in tree["columns"]:
+            tree.heading(c, text=c)
+        tree.heading(col, text=f"{col} {'▼' if reverse else '▲'}")
+
+    def current_filters():
+        filters = {
+            "from": filter_from.get().strip(),
+            "to": filter_to.get().strip(),
+            "attraction": filter_attraction.get(),
+            "phone": filter_phone.get().strip(),
+            "name": filter_name.get().strip(),
+        }
+        return {key: value for key, value in filters.items() if value}
+
+    def fetch_page(cursor, on_page):
+        # on_page(брони, курсор следующей страницы, версия журнала) в потоке Tk
+        requested = generation
+        params = {
+            "sort": SORT_FIELDS[sort_column.get()],
+            "order": "desc" if sort_order.get() else "asc",
+            "limit": PAGE_SIZE,
+            # имена колонок один раз, дальше массивы значений - меньше байт
+            "format": "columns",
+            **current_filters(),
+        }
+        headers = admin_headers()
+        if cursor:
+            params["cursor"] = cursor
+        elif loaded_page[0] == params and loaded_page[1]:
+            # Таблица уже собрана из этого запроса: при той же версии сервер
+            # ответит 304 без тела, и перестраивать ничего не нужно
+            headers["If-None-Match"] = loaded_page[1]
+
+        def on_response(response):
+            nonlocal loading, loaded_page
+            if requested != generation:
+                return
+            loading = False
+            if response.status_code == 304:
+                return
+            if response.status_code == 200:
+                if not cursor:
+                    loaded_page = (params, response.headers.get("ETag"))
+                data = response.json()
+                bookings = [dict(zip(data['columns'], row)) for row in data['rows']]
+                on_page(bookings, response.headers.get("X-Next-Cursor"),
+                        int(response.headers.get("X-Change-Version", 0)))
+            else:
+                messagebox.showerror("Ошибка", f"Ошибка сервера: {response.status_code}")
+
+        def on_error(error):
+            nonlocal loading
+            if requested == generation:
+                loading = False
+                show_connection_error(error)
+
+        request_async(admin_root, on_response, "GET", "/bookings", on_error=on_error,
+                      params=params, headers=headers)
+
+    def get_bookings():
+        # Загрузка с начала: другая сортировка, фильтры или сброс журнала
+        nonlocal generation, loading
+        generation += 1
+        loading = True
+        fetch_page(None, first_page)
+
+    def first_page(bookings, cursor, version):
+        nonlocal next_cursor, change_version, top
+        next_cursor, change_version = cursor, version
+        table.clear()
+        table.extend(bookings)
+        top = 0
+        render()
+
+    def load_more():
+        nonlocal loading
+        if loading:
+            return
+        loading = True
+        fetch_page(next_cursor, next_page)
+
+    def next_page(bookings, cursor, _):
+        # Версию журнала не двигаем: изменения загруженных строк применятся по старой
+        nonlocal next_cursor
+        next_cursor = cursor
+        table.extend(bookings)
+        render()
+
+    def poll_changes():
+        def on_response(response):
+            if response.status_code != 200:
+                messagebox.showerror("Ошибка", f"Ошибка сервера: {response.status_code}")
+                return
+            handle_changes(response.json())
+
+        request_async(admin_root, on_response, "GET", "/bookings/changes",
+                      params={"since": change_version, "limit": CHANGES_LIMIT},
+                      headers=admin_headers())
+
+    def handle_changes(data):
+        nonlocal change_version
+        # Одни и те же изменения могут прийти и из потока, и из опроса
+        changes = [change for change in data['changes'] if change['version'] > change_version]
+        # Слишком много изменений - одна страница дешевле, чем их применение
+        if data['reset'] or len(changes) >= CHANGES_LIMIT:
+            get_bookings()
+            return
+        if not changes:
+            return
+        change_version = data['version']
+        if not apply_changes(changes):
+            get_bookings()
+
+    def stream_changes():
+        # Работает в фоновом потоке; с виджетами работаем только через after
+        while not stream_stop.is_set():
+            try:
+                with api_request("GET", "/bookings/stream",
+                                 params={"since": change_version}, stream=True,
+                                 headers=admin_headers(),
+                                 timeout=(HTTP_TIMEOUT[0], STREAM_READ_TIMEOUT)) as response:
+                    if token_rejected(response):
+                        # с этим токеном повторять бесполезно
+                        admin_root.after(0, session_expired)
+                        break
+                    if response.status_code == 200:
+                        stream_connected.set()
+                        for line in response.iter_lines(decode_unicode=True):
+                            if stream_stop.is_set():
+                                break
+                            if line.startswith("data: "):
+                                admin_root.after(0, handle_changes, json.loads(line[6:]))
+            except (requests.RequestException, ValueError):
+                pass
+            except (RuntimeError, tk.TclError):
+                # окно уже закрыто, главный цикл Tk не принимает вызовы
+                break
+            stream_connected.clear()
+            stream_stop.wait(STREAM_RETRY_DELAY)
+
+    def apply_changes(changes):
+        # Возвращает False, если изменения проще перезапросить целиком:
+        # очистка или новая запись при фильтрах, которые проверяет только сервер
+        filtered = bool(current_filters())
+        for change in changes:
+            if change['op'] == 'clear':
+                return False
+            if change['op'] == 'delete' or change['booking'] is None:
+                # у уже удалённой записи booking нет, её 'delete' придёт следом
+                table.remove(change['id'])
+                continue
+            if filtered and change['id'] not in table:
+                return False
+            table.add(change['booking'])
+            # Строка за концом загруженного и так придёт со следующей страницей
+            if next_cursor and table.position(*view(), change['id']) == len(table) - 1:
+                table.remove(change['id'])
+        render()
+        return True
+
+    def export_bookings():
+        # Выгрузка с текущими фильтрами, сервер отдаёт её потоком
+        target = filedialog.asksaveasfilename(
+            parent=admin_root, title="Экспорт бронирований", defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("NDJSON", "*.ndjson")])
+        if not target:
+            return
+        fmt = "ndjson" if target.endswith(".ndjson") else "csv"
+
+        def on_response(response):
+            btn_export.config(state="normal")
+            if response.status_code == 200:
+                messagebox.showinfo("Экспорт", f"Бронирования сохранены в {target}")
+            else:
+                messagebox.showerror("Ошибка", f"Ошибка сервера: {response.text}")
+
+        def on_error(error):
+            btn_export.config(state="normal")
+            show_connection_error(error)
+
+        btn_export.config(state="disabled")
+        run_async(admin_root, on_response, download, "/bookings/export", target, on_error=on_error,
+                  params={"format": fmt, **current_filters()}, headers=admin_headers())
+
+    def clear_filters():
+        for entry in (filter_from, filter_to, filter_phone, filter_name):
+            entry.delete(0, tk.END)
+        filter_attraction.set("")
+        get_bookings()
+
+    def delete_booking():
+        selected = tree.selection()
+        if not selected:
+            messagebox.showwarning("Ошибка", "Выберите запись для удаления")
+            return
+
+        booking_id = tree.item(selected[0])['values'][0]
+        if not messagebox.askyesno("Подтверждение", f"Удалить бронирование #{booking_id}?"):
+            return
+
+        def on_response(response):
+            if response.status_code == 200:
+                messagebox.showinfo("Успех", "Бронирование удалено!")
+                poll_changes()
+            else:
+                messagebox.showerror("Ошибка", f"Ошибка сервера: {response.text}")
+
+        request_async(admin_root, on_response, "DELETE", f"/bookings/{booking_id}",
+                      headers=admin_headers())
+
+    def clear_bookings():
+        if not messagebox.askyesno("Подтверждение", "Удалить ВСЕ бронирования?"):
+            return
+
+        def on_response(response):
+            if response.status_code == 200:
+                messagebox.showinfo("Успех", "Все бронирования удалены!")
+                get_bookings()
+            else:
+                messagebox.showerror("Ошибка", f"Ошибка: {response.text}")
+
+        request_async(admin_root, on_response, "DELETE", "/bookings", headers=admin_headers())
+
+    def edit_booking():
+        selected = tree.selection()
+        if not selected:
+            messagebox.showwarning("Ошибка", "Выберите запись для редактирования")
+            return
+
+        item = tree.item(selected[0])
+        values = item['values']
+        booking_id = values[0]
+
+        edit_window = tk.Toplevel(admin_root)
+        edit_window.title("Редактирование бронирования")
+        edit_window.geometry("400x500")
+
+        # Поля ввода
+        tk.Label(edit_window, text="ФИО:").pack()
+        name_entry = tk.Entry(edit_window)
+        name_entry.insert(0, values[1])
+        name_entry.pack()
+
+        tk.Label(edit_window, text="Телефон:").pack()
+        phone_entry = tk.Entry(edit_window)
+        phone_entry.insert(0, values[2])
+        phone_entry.pack()
+
+        tk.Label(edit_window, text="Возраст:").pack()
+        age_entry = tk.Entry(edit_window)
+        age_entry.insert(0, values[3])
+        age_entry.pack()
+
+        tk.Label(edit_window, text="Дата (ГГГГ-ММ-ДД):").pack()
+        date_entry = tk.Entry(edit_window)
+        date_entry.insert(0, values[4])
+        date_entry.pack()
+
+        tk.Label(edit_window, text="Аттракционы:").pack()
+        attr_vars = []
+        for i, attr in enumerate(ATTRACTIONS):
+            var = tk.IntVar(value=1 if attr in values[5] else 0)
+            attr_vars.append(var)
+            tk.Checkbutton(edit_window, text=attr, variable=var).pack(anchor="w")
+
+        def save_changes():
+            data = {
+                "name": name_entry.get(),
+                "phone": phone_entry.get(),
+                "age": age_entry.get(),
+                "date": date_entry.get(),
+                "attractions": [ATTRACTIONS[i] for i in range(len(ATTRACTIONS)) if attr_vars[i].get()]
+            }
+
+            errors = []
+            if not data['phone'].isdigit() or len(data['phone']) not in range(10, 16):
+                errors.append("Телефон должен содержать 10-15 цифр")
+            try:
+                data['age'] = int(data['age'])
+                if (data['age'] < 14 or data['age'] > 100): errors.append("Возраст должен быть ≥14 и ты не должен быть слишком старым")
+            except ValueError:
+                errors.append("Некорректный возраст")
+            try:
+                datetime.strptime(data['date'], '%Y-%m-%d')
+            except ValueError:
+                errors.append("Дата должна быть ГГГГ-ММ-ДД")
+            if not data['name']: errors.append("Укажите ФИО")
+            if not data['attractions']: errors.append("Выберите аттракционы")
+
+            if errors:
+                messagebox.showerror("Ошибки", "\n".join(errors))
+                return
+
+            def on_response(response):
+                if response.status_code == 200:
+                    messagebox.showinfo("Успех", "Изменения сохранены")
+                    edit_window.destroy()
+                    poll_changes()
+                else:
+                    messagebox.showerror("Ошибка", f"Ошибка сервера: {response.text}")
+
+            request_async(edit_window, on_response, "PUT", f"/bookings/{booking_id}",
+                          json=data, headers=admin_headers())
+
+        tk.Button(edit_window, text="Сохранить", command=save_changes, bg="#4CAF50", fg="white").pack(pady=20)
+
+    def render():
+        # Одни и те же строки виджета row0..rowN получают значения текущего окна
+        nonlocal top
+        top = max(0, min(top, len(table) - visible_rows))
+        rows = table.window(*view(), top, visible_rows)
+        items = tree.get_children()
+        if len(items) > len(rows):
+            tree.delete(*items[len(rows):])
+        for i in range(len(items), len(rows)):
+            tree.insert("", "end", iid=f"row{i}")
+        for i, row in enumerate(rows):
+            tree.item(f"row{i}", values=row)
+        # Выделение привязано к брони, а не к строке виджета
+        tree.selection_set([f"row{i}" for i, row in enumerate(rows) if row[0] == selected_id])
+        if table:
+            scrollbar.set(top / len(table), (top + len(rows)) / len(table))
+        else:
+            scrollbar.set(0, 1)
+        status_label.config(text=f"Загружено записей: {len(table)}{'+' if next_cursor else ''}")
+        if next_cursor and top + visible_rows + FETCH_AHEAD > len(table):
+            load_more()
+
+    def on_select(event):
+        nonlocal selected_id
+        # Пустое выделение - выбранная строка просто ушла из окна
+        selection = tree.selection()
+        if selection:
+            selected_id = tree.item(selection[0])['values'][0]
+
+    def on_scrollbar(*args):
+        nonlocal top
+        if args[0] == "moveto":
+            top = int(float(args[1]) * len(table))
+        elif args[0] == "scroll":
+            top += int(args[1]) * (visible_rows if args[2] == "pages" else 1)
+        render()
+
+    def on_mousewheel(event):
+        nonlocal top
+        top += -3 if event.num == 4 or event.delta > 0 else 3
+        render()
+        return "break"
+
+    def on_key(event):
+        # Стрелки и PageUp/PageDown ходят по всему хранилищу, а не по окну
+        nonlocal top, selected_id
+        if not table:
+            return "break"
+        step = {"Up": -1, "Down": 1, "Prior": -visible_rows, "Next": visible_rows}[event.keysym]
+        position = table.position(*view(), selected_id)
+        position = 0 if position is None else max(0, min(position + step, len(table) - 1))
+        selected_id = table.window(*view(), position, 1)[0][0]
+        top = min(max(top, position - visible_rows + 1), position)
+        render()
+        return "break"
+
+    def on_resize(event):
+        nonlocal visible_rows
+        items = tree.get_children()
+        bbox = tree.bbox(items[0]) if items else ""
+        header, row_height = (bbox[1], bbox[3]) if bbox else (25, 20)
+        rows = max((event.height - header) // row_height, 1)
+        if rows != visible_rows:
+            visible_rows = rows
+            render()
+
+    def auto_refresh():
+        try:
+            if not stream_connected.is_set():
+                poll_changes()
+        finally:
+            admin_root.after(10000, auto_refresh)
+
+    def load_stats():
+        params = {
+            "from": stats_from.get().strip(),
+            "to": stats_to.get().strip(),
+        }
+
+        def on_response(response):
+            if response.status_code != 200:
+                messagebox.showerror("Ошибка", f"Ошибка сервера: {response.text}")
+                return
+            data = response.json()
+            stats_total.config(text=f"Всего броней: {data['total']}")
+            fill_stats(stats_days, [(day['date'], day['bookings']) for day in data['days']])
+            fill_stats(stats_attractions, [(item['name'], item['bookings']) for item in data['attractions']])
+            fill_stats(stats_ages, [(band['band'], band['bookings']) for band in data['age_bands']])
+
+        request_async(admin_root, on_response, "GET", "/stats",
+                      params={key: value for key, value in params.items() if value},
+                      headers=admin_headers())
+
+    def fill_stats(tree_widget, rows):
+        tree_widget.delete(*tree_widget.get_children())
+        peak = max((count for _, count in rows), default=0) or 1
+        for label, count in rows:
+            tree_widget.insert("", "end", values=(label, count, "█" * round(STATS_BAR_WIDTH * count / peak)))
+
+    def schedule_search(*_):
+        # Каждая буква откладывает запрос заново: уходит только последний текст
+        nonlocal search_job
+        if search_job is not None:
+            admin_root.after_cancel(search_job)
+        search_job = admin_root.after(SEARCH_DEBOUNCE_MS, search_bookings)
+
+    def search_bookings():
+        nonlocal search_job, search_generation
+        search_job = None
+        search_generation += 1
+        requested = search_generation
+        query = search_var.get().strip()
+        if not query:
+            fill_search([])
+            return
+
+        def on_response(response):
+            if requested != search_generation:
+                return
+            if response.status_code != 200:
+                messagebox.showerror("Ошибка", f"Ошибка сервера: {response.status_code}")
+                return
+            fill_search(response.json())
+
+        def on_error(error):
+            if requested == search_generation:
+                show_connection_error(error)
+
+        request_async(admin_root, on_response, "GET", "/bookings/search", on_error=on_error,
+                      params={"q": query, "limit": SEARCH_LIMIT}, headers=admin_headers())
+
+    def fill_search(bookings):
+        # Порядок - ранг сервера, сортировки по колонкам здесь нет
+        search_tree.delete(*search_tree.get_children())
+        search_results.clear()
+        for booking in bookings:
+            search_results[str(booking['id'])] = booking
+            search_tree.insert("", "end", iid=str(booking['id']), values=(
+                booking['id'], booking['name'], booking['phone'], booking['age'],
+                booking['date'], ", ".join(booking['attractions'])))
+        search_status.config(text=f"Найдено: {len(bookings)}")
+
+    def open_search_result(event):
+        # Все брони клиента - на вкладке бронирований с фильтром по его телефону
+        selection = search_tree.selection()
+        if not selection:
+            return
+        for entry in (filter_from, filter_to, filter_phone, filter_name):
+            entry.delete(0, tk.END)
+        filter_attraction.set("")
+        filter_phone.insert(0, search_results[selection[0]]['phone'])
+        notebook.select(bookings_tab)
+        get_bookings()
+
+    def on_tab_changed(event):
+        if notebook.select() == str(stats_tab):
+            load_stats()
+        elif notebook.select() == str(search_tab):
+            search_entry.focus_set()
+
+    # GUI админской части
+    notebook = ttk.Notebook(admin_root)
+    notebook.pack(fill="both", expand=True)
+    bookings_tab = tk.Frame(notebook)
+    search_tab = tk.Frame(notebook)
+    stats_tab = tk.Frame(notebook)
+    notebook.add(bookings_tab, text="Бронирования")
+    notebook.add(search_tab, text="Поиск")
+    notebook.add(stats_tab, text="Статистика")
+    notebook.bind("<<NotebookTabChanged>>", on_tab_changed)
+
+    filter_frame = tk.Frame(bookings_tab)
+    filter_frame.pack(fill="x", padx=10, pady=(10, 0))
+
+    tk.Label(filter_frame, text="Дата с:").pack(side="left")
+    filter_from = tk.Entry(filter_frame, width=11)
+    filter_from.pack(side="left", padx=(0, 5))
+    tk.Label(filter_frame, text="по:").pack(side="left")
+    filter_to = tk.Entry(filter_frame, width=11)
+    filter_to.pack(side="left", padx=(0, 5))
+    tk.Label(filter_frame, text="Аттракцион:").pack(side="left")
+    filter_attraction = ttk.Combobox(filter_frame, values=[""] + ATTRACTIONS, state="readonly", width=16)
+    filter_attraction.pack(side="left", padx=(0, 5))
+    tk.Label(filter_frame, text="Телефон:").pack(side="left")
+    filter_phone = tk.Entry(filter_frame, width=14)
+    filter_phone.pack(side="left", padx=(0, 5))
+    tk.Label(filter_frame, text="ФИО:").pack(side="left")
+    filter_name = tk.Entry(filter_frame, width=20)
+    filter_name.pack(side="left", padx=(0, 5))
+    tk.Button(filter_frame, text="Найти", command=get_bookings).pack(side="left", padx=5)
+    tk.Button(filter_frame, text="Сбросить", command=clear_filters).pack(side="left")
+
+    table_frame = tk.Frame(bookings_tab)
+    table_frame.pack(fill="both", expand=True, padx=10, pady=10)
+    tree = ttk.Treeview(table_frame, columns=columns, show="headings")
+    # Полоса прокрутки ходит по хранилищу, а не по строкам виджета
+    scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=on_scrollbar)
+    scrollbar.pack(side="right", fill="y")
+
+    for col in columns:
+        tree.heading(col, text=col,
+                     command=lambda c=col: treeview_sort_column(c, False))
+        tree.column(col, width=100 if col == "ID" else 150, anchor='center' if col in ("ID", "Возраст") else 'w')
+
+    tree.heading(sort_column.get(), text=f"{sort_column.get()} {'▼' if sort_order.get() else '▲'}",
+                 command=lambda: treeview_sort_column(sort_column.get(), not sort_order.get()))
+
+    tree.column("ID", width=50, anchor='center')
+    tree.column("ФИО", width=150)
+    tree.column("Телефон", width=120)
+    tree.column("Возраст", width=60, anchor='center')
+    tree.column("Дата", width=100)
+    tree.column("Аттракционы", width=300)
+
+    tree.pack(side="left", fill="both", expand=True)
+    tree.bind("<<TreeviewSelect>>", on_select)
+    tree.bind("<Configure>", on_resize)
+    for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+        tree.bind(sequence, on_mousewheel)
+    for sequence in ("<Up>", "<Down>", "<Prior>", "<Next>"):
+        tree.bind(sequence, on_key)
+
+    status_label = tk.Label(bookings_tab, text="Загружено записей: 0")
+    status_label.pack()
+
+    btn_frame = tk.Frame(bookings_tab)
+    btn_frame.pack(pady=10)
+
+    tk.Button(btn_frame, text="Обновить", command=get_bookings,
+              bg="#2196F3", fg="white").pack(side="left", padx=5)
+    tk.Button(btn_frame, text="Редактировать", command=edit_booking,
+              bg="#FF9800", fg="white").pack(side="left", padx=5)
+    tk.Button(btn_frame, text="Удалить", command=delete_booking,
+              bg="#e74c3c", fg="white").pack(side="left", padx=5)
+    tk.Button(btn_frame, text="Очистить все", command=clear_bookings,
+              bg="#F44336", fg="white").pack(side="left", padx=5)
+    btn_export = tk.Button(btn_frame, text="Экспорт", command=export_bookings,
+                           bg="#607D8B", fg="white")
+    btn_export.pack(side="left", padx=5)
+
+    # Вкладка поиска: ФИО или часть телефона, результаты по мере ввода
+    search_bar = tk.Frame(search_tab)
+    search_bar.pack(fill="x", padx=10, pady=(10, 0))
+    tk.Label(search_bar, text="ФИО или телефон:").pack(side="left")
+    search_var = tk.StringVar()
+    search_var.trace_add("write", schedule_search)
+    search_entry = tk.Entry(search_bar, textvariable=search_var, width=40)
+    search_entry.pack(side="left", padx=(0, 5))
+    search_status = tk.Label(search_bar, text="")
+    search_status.pack(side="left", padx=20)
+
+    search_frame = tk.Frame(search_tab)
+    search_frame.pack(fill="both", expand=True, padx=10, pady=10)
+    search_tree = ttk.Treeview(search_frame, columns=columns, show="headings", selectmode="browse")
+    for col, width in zip(columns, (50, 200, 120, 60, 100, 300)):
+        search_tree.heading(col, text=col)
+        search_tree.column(col, width=width, anchor='center' if col in ("ID", "Возраст") else 'w')
+    search_scroll = ttk.Scrollbar(search_frame, orient="vertical", command=search_tree.yview)
+    search_tree.configure(yscrollcommand=search_scroll.set)
+    search_scroll.pack(side="right", fill="y")
+    search_tree.pack(side="left", fill="both", expand=True)
+    search_tree.bind("<Double-1>", open_search_result)
+    tk.Label(search_tab, text="Двойной щелчок - все брони клиента").pack(pady=(0, 10))
+
+    # Вкладка статистики: сервер считает всё по сводным таблицам
+    stats_filter = tk.Frame(stats_tab)
+    stats_filter.pack(fill="x", padx=10, pady=(10, 0))
+    tk.Label(stats_filter, text="Дата с:").pack(side="left")
+    stats_from = tk.Entry(stats_filter, width=11)
+    stats_from.pack(side="left", padx=(0, 5))
+    tk.Label(stats_filter, text="по:").pack(side="left")
+    stats_to = tk.Entry(stats_filter, width=11)
+    stats_to.pack(side="left", padx=(0, 5))
+    tk.Button(stats_filter, text="Показать", command=load_stats).pack(side="left", padx=5)
+    stats_total = tk.Label(stats_filter, text="Всего броней: 0")
+    stats_total.pack(side="left", padx=20)
+
+    stats_frame = tk.Frame(stats_tab)
+    stats_frame.pack(fill="both", expand=True, padx=10, pady=10)
+    stats_trees = []
+    for title, first in (("По дням", "Дата"), ("Аттракционы", "Аттракцион"), ("Возраст", "Группа")):
+        frame = tk.LabelFrame(stats_frame, text=title)
+        frame.pack(side="left", fill="both", expand=True, padx=5)
+        stats_tree = ttk.Treeview(frame, columns=(first, "Брони", ""), show="headings")
+        stats_tree.heading(first, text=first)
+        stats_tree.heading("Брони", text="Брони")
+        stats_tree.column(first, width=110)
+        stats_tree.column("Брони", width=60, anchor="center")
+        stats_tree.column("", width=STATS_BAR_WIDTH * 7)
+        stats_scroll = ttk.Scrollbar(frame, orient="vertical", command=stats_tree.yview)
+        stats_tree.configure(yscrollcommand=stats_scroll.set)
+        stats_scroll.pack(side="right", fill="y")
+        stats_tree.pack(side="left", fill="both", expand=True)
+        stats_trees.append(stats_tree)
+    stats_days, stats_attractions, stats_ages = stats_trees
+
+    get_bookings()
+    threading.Thread(target=stream_changes, daemon=True).start()
+    admin_root.after(10000, auto_refresh)
+
+    def close_panel():
+        stream_stop.set()
+        admin_root.destroy()
+        show_start_page()
+
+    close_admin_panel = close_panel
+    admin_root.protocol("WM_DELETE_WINDOW", close_panel)
+
+
+# ------------------ Стартовая страница ------------------
+def check_admin_password():
+    password = simpledialog.askstring("Пароль админа", "Введите пароль:",
+                                      show='*',
+                                      parent=start_root)
+    if not password:
+        return
+
+    def on_response(response):
+        global admin_token
+        try:
+            if response.status_code == 200:
+                admin_token = response.json()['token']
+                messagebox.showinfo("Успех", "Авторизация прошла успешно!")
+                show_admin_panel()
+            else:
+                error_msg = response.json().get('detail', 'Неизвестная ошибка')
+                messagebox.showerror("Ошибка", f"{error_msg} (код {response.status_code})")
+        except Exception as e:
+            messagebox.showerror("Критическая ошибка", str(e))
+
+    request_async(start_root, on_response, "POST", "/auth/admin", auth=('admin', password))
+
+# Создание основного окна
+start_root = tk.Tk()
+start_root.title("Extreme Park – Выбор роли")
+start_root.geometry("400x400")
+start_root.configure(bg="#f0f2f5")
+
+style = ttk.Style()
+style.configure("Primary.TButton", font=('Helvetica', 12), padding=10,
+                foreground="#000000", background="#2e8b57")
+style.configure("Secondary.TButton", font=('Helvetica', 12), padding=10,
+                foreground="#000000", background="#4682b4")
+
+main_frame = tk.Frame(start_root, bg="#f0f2f5")
+main_frame.pack(expand=True, fill="both", padx=40, pady=40)
+
+tk.Label(main_frame, text="🏞️ Extreme Park", font=("Helvetica", 20, "bold"),
+         bg="#f0f2f5", fg="#2d3436").pack(pady=(0, 30))
+tk.Label(main_frame, text="Выберите тип входа:", font=("Helvetica", 12),
+         bg="#f0f2f5", fg="#636e72").pack()
+
+btn_frame = tk.Frame(main_frame, bg="#f0f2f5")
+btn_frame.pack(pady=20)
+
+ttk.Button(btn_frame, text="  Клиент  ", style="Primary.TButton",
+           command=show_client_app).pack(pady=10, ipadx=20)
+ttk.Button(btn_frame, text="  Администратор  ", style="Secondary.TButton",
+           command=check_admin_password).pack(pady=10, ipadx=20)
+
+tk.Label(main_frame, text="© 2024 Extreme Park System",
+         font=("Helvetica", 9), bg="#f0f2f5", fg="#636e72").pack(side="bottom", pady=10)
+
+# Виден, только пока в очереди есть отклонённые сервером брони
+btn_rejected = tk.Button(main_frame, text="", fg="#c0392b", relief="flat", bg="#f0f2f5",
+                         command=show_rejected_bookings)
+update_rejected_button()
+
+sync_outbox()
 start_root.mainloop()
\ No newline at end of file
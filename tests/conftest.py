@@ -0,0 +1,39 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# main читает настройки при импорте: база и архив тестов - во временной папке
+WORKDIR = tempfile.mkdtemp(prefix="extreme-park-tests-")
+os.environ["DB_PATH"] = os.path.join(WORKDIR, "bookings.db")
+os.environ["ARCHIVE_DIR"] = os.path.join(WORKDIR, "archive")
+os.environ.setdefault("SESSION_SECRET", "tests")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    # Каждый тест - с пустой базой; кэш страниц переживает перезапуск приложения
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(main.DB_PATH + suffix):
+            os.remove(main.DB_PATH + suffix)
+    shutil.rmtree(main.ARCHIVE_DIR, ignore_errors=True)
+    main.page_cache.clear()
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def admin():
+    return {"Authorization": f"Bearer {main.issue_token('admin')}"}
+
+
+def booking(**fields):
+    return {"name": "Иванов Иван", "phone": "79001234567", "age": 25,
+            "date": "2026-07-01", "attractions": ["Зиплайн"], **fields}
@@ -0,0 +1,56 @@
+import main
+from conftest import booking
+
+
+PAST = [("2024-03-10", 16, ["Зиплайн"]), ("2024-03-10", 30, ["Зиплайн", "Батутный парк"]),
+        ("2024-11-02", 70, ["Батутный парк"])]
+
+
+def seed(client):
+    for day, age, attractions in PAST:
+        response = client.post("/book", json=booking(date=day, age=age, attractions=attractions))
+        assert response.status_code == 200, response.text
+    assert client.post("/book", json=booking(date="2026-07-01")).status_code == 200
+
+
+def stats(client, admin, **params):
+    response = client.get("/stats", params=params, headers=admin)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_archive_keeps_stats(client, admin):
+    seed(client)
+    before = stats(client, admin)
+    before_2024 = stats(client, admin, **{"from": "2024-01-01", "to": "2024-12-31"})
+
+    assert main.archive_bookings(client.app.state.pool, "2025-01-01") == len(PAST)
+    remaining = client.get("/bookings", headers=admin).json()
+    assert [item["date"] for item in remaining] == ["2026-07-01"]
+
+    assert stats(client, admin) == before
+    assert stats(client, admin, **{"from": "2024-01-01", "to": "2024-12-31"}) == before_2024
+
+    # Полный пересчёт сводок не теряет заархивированное
+    main.rebuild_stats(main.DB_PATH)
+    assert stats(client, admin) == before
+
+
+def test_archive_serves_rows(client, admin):
+    seed(client)
+    main.archive_bookings(client.app.state.pool, "2025-01-01")
+    response = client.get("/bookings/archive", params={"format": "ndjson"}, headers=admin)
+    assert response.status_code == 200
+    rows = [line for line in response.text.splitlines() if line]
+    assert len(rows) == len(PAST)
+    response = client.get("/bookings/archive", params={"from": "2024-11-01", "to": "2024-11-30"}, headers=admin)
+    assert len(response.text.splitlines()) == 2
+
+
+def test_archive_then_new_booking(client, admin):
+    seed(client)
+    main.archive_bookings(client.app.state.pool, "2025-01-01")
+    before = stats(client, admin, **{"from": "2024-03-10", "to": "2024-03-10"})
+    assert client.post("/book", json=booking(date="2024-03-10")).status_code == 200
+    after = stats(client, admin, **{"from": "2024-03-10", "to": "2024-03-10"})
+    assert after != before
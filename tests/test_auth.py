@@ -0,0 +1,27 @@
+import pytest
+
+import main
+
+
+def test_token_opens_admin_routes(client, admin):
+    assert client.get("/stats", headers=admin).status_code == 200
+
+
+@pytest.mark.parametrize("token", ["", "abc", "abc.def", "é.é", "токен", "…"])
+def test_bad_token_is_rejected(client, token):
+    # Не-ASCII в заголовке - тоже 401, а не 500
+    response = client.get("/stats", headers={"Authorization": f"Bearer {token}".encode("utf-8")})
+    assert response.status_code == 401
+
+
+def test_tampered_token_is_rejected(client):
+    token = main.issue_token("admin")
+    for bad in (token[:-1] + ("A" if token[-1] != "A" else "B"), token + "é"):
+        response = client.get("/stats", headers={"Authorization": f"Bearer {bad}".encode("utf-8")})
+        assert response.status_code == 401
+
+
+def test_expired_token_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(main, "AUTH_TOKEN_TTL", -1)
+    response = client.get("/stats", headers={"Authorization": f"Bearer {main.issue_token('admin')}"})
+    assert response.status_code == 401
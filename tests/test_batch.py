@@ -0,0 +1,62 @@
+import json
+
+from conftest import booking
+
+
+def upload(client, admin, body, content_type):
+    response = client.post("/bookings/batch", content=body,
+                           headers={**admin, "Content-Type": content_type})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def rows(result):
+    return {error["row"]: error["errors"] for error in result["errors"]}
+
+
+def test_ndjson_reports_bad_rows(client, admin):
+    lines = [
+        json.dumps(booking(), ensure_ascii=False).encode("utf-8"),
+        b"{not json",
+        json.dumps(booking(age=5), ensure_ascii=False).encode("utf-8"),
+        '{"name": "Иван'.encode("cp1251") + b'"}',
+        b"[1, 2]",
+        json.dumps(booking(name="Последний"), ensure_ascii=False).encode("utf-8"),
+    ]
+    result = upload(client, admin, b"\n".join(lines), "application/x-ndjson")
+    assert (result["inserted"], result["failed"]) == (2, 4)
+    errors = rows(result)
+    assert sorted(errors) == [2, 3, 4, 5]
+    assert errors[2][0]["message"].startswith("Invalid JSON")
+    assert errors[3][0]["field"] == "age"
+    assert errors[4][0]["message"].startswith("Invalid UTF-8")
+    assert errors[5][0]["message"] == "Expected a JSON object"
+
+
+def test_csv_reports_bad_rows(client, admin):
+    body = "\n".join([
+        "name,phone,age,date,attractions",
+        'Иванов Иван,79001234567,25,2026-07-01,"Зиплайн, Скалодром"',
+        "Петров,123,25,2026-07-01,Зиплайн",
+    ]).encode("utf-8") + "\nСидоров,79001234567,25,2026-07-01,Зиплайн\n".encode("cp1251")
+    body += "Козлов,79001234567,30,2026-07-01,Зиплайн\n".encode("utf-8")
+    result = upload(client, admin, body, "text/csv")
+    assert (result["inserted"], result["failed"]) == (2, 2)
+    errors = rows(result)
+    assert errors[2][0]["field"] == "phone"
+    assert errors[3][0]["message"].startswith("Invalid UTF-8")
+    names = [item["name"] for item in client.get("/bookings", headers=admin).json()]
+    assert names == ["Иванов Иван", "Козлов"]
+
+
+def test_capacity_errors_keep_the_rest(client, admin):
+    client.put("/attractions/Зиплайн/capacity", json={"capacity": 2}, headers=admin)
+    body = "\n".join(json.dumps(booking(name=f"Клиент {i}"), ensure_ascii=False) for i in range(4))
+    result = upload(client, admin, body.encode("utf-8"), "application/x-ndjson")
+    assert (result["inserted"], result["failed"]) == (2, 2)
+    assert sorted(rows(result)) == [3, 4]
+
+
+def test_unknown_content_type(client, admin):
+    response = client.post("/bookings/batch", content=b"x", headers={**admin, "Content-Type": "text/plain"})
+    assert response.status_code == 415
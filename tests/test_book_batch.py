@@ -0,0 +1,30 @@
+from conftest import booking
+
+
+def test_each_item_gets_a_result(client):
+    items = [
+        {**booking(), "idempotency_key": "k1"},
+        "not an object",
+        None,
+        [1, 2],
+        {**booking(age=5), "idempotency_key": "k2"},
+        {**booking(), "idempotency_key": "k3"},
+    ]
+    response = client.post("/book/batch", json=items)
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [200, 422, 422, 422, 422, 200]
+    assert [result["idempotency_key"] for result in results] == ["k1", None, None, None, "k2", "k3"]
+    assert results[4]["errors"][0]["field"] == "age"
+
+
+def test_retry_returns_the_same_ids(client):
+    items = [{**booking(), "idempotency_key": f"k{i}"} for i in range(3)]
+    first = client.post("/book/batch", json=items).json()["results"]
+    again = client.post("/book/batch", json=items).json()["results"]
+    assert [result["id"] for result in first] == [result["id"] for result in again] == [1, 2, 3]
+
+
+def test_batch_must_be_a_list(client):
+    assert client.post("/book/batch", json={"idempotency_key": "k"}).status_code == 422
+    assert client.post("/book/batch", json=[{}] * 101).status_code == 422
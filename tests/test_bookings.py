@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+import main
+from conftest import booking
+
+
+def add(client, **fields):
+    response = client.post("/book", json=booking(**fields))
+    assert response.status_code == 200, response.text
+
+
+def ids(response):
+    assert response.status_code == 200, response.text
+    return [item["id"] for item in response.json()]
+
+
+def test_cursor_pages_cover_the_table(client, admin):
+    for age in range(20, 25):
+        add(client, age=age)
+    seen, cursor = [], None
+    while True:
+        params = {"sort": "age", "order": "desc", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/bookings", params=params, headers=admin)
+        seen += ids(response)
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [5, 4, 3, 2, 1]
+
+
+@pytest.mark.parametrize("sort, cursor", [
+    ("id", "not base64!"),
+    ("id", main.encode_cursor(None, "x")),
+    ("age", main.encode_cursor([1], 5)),
+    ("age", main.encode_cursor({"a": 1}, 5)),
+    # больше 64 бит: SQLite такое число не привяжет
+    ("id", main.encode_cursor(None, 10 ** 30)),
+    ("age", main.encode_cursor(10 ** 30, 1)),
+    ("age", main.encode_cursor(-(10 ** 30), 1)),
+    ("age", main.encode_cursor(1, 10 ** 30)),
+])
+def test_bad_cursor_is_400(client, admin, sort, cursor):
+    add(client)
+    response = client.get("/bookings", params={"sort": sort, "cursor": cursor}, headers=admin)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_prefix_filters(client, admin):
+    add(client, name="Петров Пётр", phone="79001110000")
+    add(client, name="Петрова Анна", phone="79002220000")
+    add(client, name="Сидоров", phone="79001119999")
+    assert ids(client.get("/bookings", params={"name": "Петров"}, headers=admin)) == [1, 2]
+    assert ids(client.get("/bookings", params={"phone": "7900111"}, headers=admin)) == [1, 3]
+
+
+@pytest.mark.parametrize("name", ["\U0010ffff", "П\U0010ffff\U0010ffff", "\ud7ff"])
+def test_prefix_filter_at_the_end_of_unicode(client, admin, name):
+    # U+10FFFF увеличить нельзя, а за U+D7FF идут суррогаты - не 500
+    add(client, name="П\U0010ffff\U0010ffffй")
+    add(client, name="Р")
+    response = client.get("/bookings", params={"name": name}, headers=admin)
+    expected = [1] if name.startswith("П") else []
+    assert ids(response) == expected
+
+
+
+def test_unknown_attraction_is_rejected(client, admin):
+    # Публичный /book не заводит новых аттракционов ни одним путём записи
+    unknown = ["Зиплайн", "Unknown, attraction"]
+    response = client.post("/book", json=booking(attractions=unknown))
+    assert response.status_code == 422
+    add(client)
+    assert client.put("/bookings/1", json=booking(attractions=unknown), headers=admin).status_code == 422
+    results = client.post("/book/batch", json=[booking(attractions=unknown, idempotency_key="k")]).json()["results"]
+    assert results[0]["status"] == 422
+    body = json.dumps(booking(attractions=unknown), ensure_ascii=False).encode("utf-8")
+    result = client.post("/bookings/batch", content=body,
+                         headers={**admin, "Content-Type": "application/x-ndjson"}).json()
+    assert (result["inserted"], result["failed"]) == (0, 1)
+    names = client.get("/availability", params={"from": "2026-07-01", "to": "2026-07-01"}).json()["days"][0]["attractions"]
+    assert sorted(names) == sorted(main.ATTRACTIONS)
+    assert ids(client.get("/bookings", headers=admin)) == [1]
+
+
+def test_edit_on_an_overbooked_day(client, admin):
+    # Вместимость снизили после броней: день переполнен, но правка брони,
+    # не добавляющая мест, проходить должна
+    add(client, attractions=["Зиплайн", "Скалодром"])
+    add(client, attractions=["Зиплайн"])
+    response = client.put("/attractions/Зиплайн/capacity", json={"capacity": 1, "date": "2026-07-01"}, headers=admin)
+    assert response.status_code == 200, response.text
+
+    def booked():
+        day = client.get("/availability", params={"from": "2026-07-01", "to": "2026-07-01"}).json()["days"][0]
+        return {name: slot["booked"] for name, slot in day["attractions"].items() if slot["booked"]}
+
+    def edit(booking_id, **fields):
+        return client.put(f"/bookings/{booking_id}", json=booking(**fields), headers=admin).status_code
+
+    assert edit(1, name="Иванов Иван Иванович", attractions=["Зиплайн", "Скалодром"]) == 200
+    assert edit(1, attractions=["Зиплайн"]) == 200
+    assert edit(1, attractions=["Зиплайн", "Батутный парк"]) == 200
+    assert booked() == {"Зиплайн": 2, "Батутный парк": 1}
+    # Снятое место на переполненном аттракционе обратно не вернуть
+    assert edit(2, attractions=["Скалодром"]) == 200
+    assert edit(2, attractions=["Зиплайн"]) == 409
+    # Перенос на другой день и обратно - заново под проверку вместимости
+    assert edit(1, date="2026-07-02", attractions=["Зиплайн", "Батутный парк"]) == 200
+    assert edit(1, attractions=["Зиплайн", "Батутный парк"]) == 200
+    assert booked() == {"Зиплайн": 1, "Батутный парк": 1, "Скалодром": 1}
+    shown = {item["id"]: item["attractions"] for item in client.get("/bookings", headers=admin).json()}
+    assert shown == {1: ["Зиплайн", "Батутный парк"], 2: ["Скалодром"]}
@@ -0,0 +1,48 @@
+from conftest import booking
+
+
+def test_same_page_same_version_is_304(client, admin):
+    client.post("/book", json=booking())
+    first = client.get("/bookings", headers=admin)
+    etag = first.headers["ETag"]
+    again = client.get("/bookings", headers={**admin, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+    assert again.content == b""
+
+
+def test_write_changes_the_etag(client, admin):
+    client.post("/book", json=booking())
+    etag = client.get("/bookings", headers=admin).headers["ETag"]
+    client.post("/book", json=booking(name="Второй"))
+    response = client.get("/bookings", headers={**admin, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.headers["ETag"] != etag
+
+
+def test_other_query_does_not_match(client, admin):
+    # Валидатор первой страницы без фильтров не подходит к другому запросу
+    for name in ("Иванов", "Петров", "Сидоров"):
+        client.post("/book", json=booking(name=name))
+    first = client.get("/bookings", headers=admin)
+    assert first.headers.get("X-Next-Cursor") is None
+    etag = first.headers["ETag"]
+    others = [
+        {"limit": 1},
+        {"name": "Петров"},
+        {"sort": "name"},
+        {"order": "desc"},
+        {"format": "columns"},
+        {"cursor": client.get("/bookings", params={"limit": 1}, headers=admin).headers["X-Next-Cursor"]},
+    ]
+    for params in others:
+        response = client.get("/bookings", params=params, headers={**admin, "If-None-Match": etag})
+        assert response.status_code == 200, params
+        assert response.headers["ETag"] != etag, params
+
+
+def test_if_none_match_lists(client, admin):
+    etag = client.get("/bookings", headers=admin).headers["ETag"]
+    assert client.get("/bookings", headers={**admin, "If-None-Match": f'W/"x", {etag}'}).status_code == 304
+    assert client.get("/bookings", headers={**admin, "If-None-Match": etag.removeprefix("W/")}).status_code == 304
@@ -0,0 +1,16 @@
+import main
+
+
+def test_metrics(client, admin):
+    client.get("/availability")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "http_request_duration_seconds" in response.text
+
+
+def test_per_process_endpoints_need_one_worker(client, admin, monkeypatch):
+    # Счётчики и профайлер у каждого воркера свои
+    monkeypatch.setattr(main, "WORKERS", 3)
+    assert client.get("/metrics").status_code == 409
+    assert client.post("/debug/profiler/start", headers=admin).status_code == 409
+    assert client.post("/debug/profiler/stop", headers=admin).status_code == 409
@@ -0,0 +1,66 @@
+import pytest
+
+import main
+from conftest import booking
+
+
+@pytest.fixture
+def people(client):
+    for name, phone in (("Ёжиков Пётр Сергеевич", "79001234567"),
+                        ("Петрова Анна", "89001234000"),
+                        ("Ivan Petrov", "9001111111"),
+                        ("Петров-Водкин Кузьма", "79161112233")):
+        assert client.post("/book", json=booking(name=name, phone=phone)).status_code == 200
+
+
+def search(client, admin, q, **params):
+    response = client.get("/bookings/search", params={"q": q, **params}, headers=admin)
+    assert response.status_code == 200, response.text
+    return sorted(item["name"] for item in response.json())
+
+
+def test_yo_and_case_fold(client, admin, people):
+    # ё и е - одна буква и в имени, и в запросе
+    assert search(client, admin, "ежик") == ["Ёжиков Пётр Сергеевич"]
+    assert search(client, admin, "ЁЖИ") == ["Ёжиков Пётр Сергеевич"]
+    assert search(client, admin, "петр") == ["Ёжиков Пётр Сергеевич", "Петров-Водкин Кузьма", "Петрова Анна"]
+
+
+def test_diacritics_fold(client, admin, people):
+    assert search(client, admin, "IVÁN") == ["Ivan Petrov"]
+
+
+def test_all_words_must_match(client, admin, people):
+    assert search(client, admin, "петр анн") == ["Петрова Анна"]
+    assert search(client, admin, "петров кузьм") == ["Петров-Водкин Кузьма"]
+
+
+def test_phone_prefix_in_any_notation(client, admin, people):
+    # Номер хранится как ввели: и с 7, и с 8, и без кода страны
+    expected = ["Ivan Petrov", "Ёжиков Пётр Сергеевич", "Петрова Анна"]
+    assert search(client, admin, "+7 (900)") == expected
+    assert search(client, admin, "8-900") == expected
+    assert search(client, admin, "900 123") == ["Ёжиков Пётр Сергеевич", "Петрова Анна"]
+    assert search(client, admin, "петр 916") == ["Петров-Водкин Кузьма"]
+
+
+def test_query_syntax_is_not_interpreted(client, admin, people):
+    assert search(client, admin, '"пет* OR') == []
+    assert search(client, admin, "NEAR(a b)") == []
+    assert search(client, admin, "!!!") == []
+
+
+def test_index_follows_edits(client, admin, people):
+    assert client.put("/bookings/1", json=booking(name="Сидоров Пётр"), headers=admin).status_code == 200
+    assert search(client, admin, "ежик") == []
+    assert search(client, admin, "сид") == ["Сидоров Пётр"]
+    assert client.delete("/bookings/2", headers=admin).status_code == 200
+    assert search(client, admin, "анна") == []
+    main.rebuild_stats(main.DB_PATH)
+    assert search(client, admin, "сидоров") == ["Сидоров Пётр"]
+
+
+def test_limit_and_validation(client, admin, people):
+    assert len(search(client, admin, "п", limit=1)) == 1
+    assert client.get("/bookings/search", params={"q": ""}, headers=admin).status_code == 422
+    assert client.get("/bookings/search", params={"q": "петр"}).status_code == 401